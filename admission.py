@@ -0,0 +1,330 @@
+"""Допуск запросов к LLM: ограничение частоты и параллельности.
+
+У каждого пользователя есть токен-бакет (``LLM_RATE_PER_MINUTE``, запас
+``LLM_RATE_BURST``), у каждого провайдера — предел одновременных запросов
+(``LLM_PROVIDER_CONCURRENCY``). Если свободного слота нет, запрос ждёт в
+ограниченной очереди; следующим слот получает пользователь, у которого
+сейчас меньше всего активных запросов. Состояние хранится в SQLite, поэтому
+ограничения общие для всех воркеров gunicorn и асинхронного шлюза.
+
+Ожидающий запрос проверяет очередь без блокировки записи и берёт её только
+тогда, когда он первый в очереди и у провайдера есть свободный слот; отметка
+в очереди обновляется раз в ``QUEUE_STALE / 2`` секунд. Занятые слоты процесса
+фоновый поток продлевает каждые ``LLM_SLOT_TTL / 3`` секунд, поэтому долгий
+поток ответа не теряет слот, а слот умершего воркера истекает через
+``LLM_SLOT_TTL``.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+import db
+import metrics
+from configs import (LLM_PROVIDER_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_PER_USER,
+                     LLM_QUEUE_TIMEOUT, LLM_RATE_BURST, LLM_RATE_PER_MINUTE, LLM_SLOT_TTL)
+from groq_llm import GROQ_MODELS
+
+logger = logging.getLogger(__name__)
+
+# Ожидающий запрос отмечается в очереди при каждой проверке; запись без
+# отметок дольше QUEUE_STALE секунд принадлежит умершему воркеру
+QUEUE_STALE = 5.0
+POLL_MIN = 0.05
+POLL_MAX = 0.5
+
+_counters = {
+    "admitted": 0,
+    "queued": 0,
+    "rate_limited": 0,
+    "queue_full": 0,
+    "queue_timeouts": 0,
+}
+_held: Dict[int, float] = {}
+_held_lock = threading.Lock()
+_renewer_pid: Optional[int] = None
+# Среднее время удержания слота, по нему оценивается Retry-After
+_hold_avg = 5.0
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{reason}, retry after {self.retry_after}s")
+
+    @property
+    def message(self) -> str:
+        return f"Слишком много запросов. Попробуйте через {self.retry_after} с."
+
+
+def provider_for(model_key: str) -> str:
+    return "groq" if model_key in GROQ_MODELS else "yandex"
+
+
+def _take_token(conn, user_id: int, now: float) -> float:
+    """Списывает токен; возвращает 0 или через сколько секунд появится токен."""
+    rate = LLM_RATE_PER_MINUTE / 60
+    row = conn.execute(
+        'SELECT tokens, updated_at FROM llm_rate_buckets WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    tokens = LLM_RATE_BURST
+    if row is not None:
+        tokens = min(LLM_RATE_BURST, row['tokens'] + (now - row['updated_at']) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    conn.execute(
+        '''INSERT INTO llm_rate_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            tokens = excluded.tokens, updated_at = excluded.updated_at''',
+        (user_id, tokens - 1, now)
+    )
+    return 0.0
+
+
+def _purge(conn, now: float) -> None:
+    conn.execute('DELETE FROM llm_slots WHERE expires_at < ?', (now,))
+    conn.execute('DELETE FROM llm_queue WHERE heartbeat < ?', (now - QUEUE_STALE,))
+
+
+def _queue_head(conn, provider: str, now: float) -> Optional[int]:
+    # Очередь короткая (не больше LLM_QUEUE_MAX), поэтому выбор делается в Python:
+    # первым идёт пользователь с наименьшим числом активных запросов. Записи
+    # умерших ожидающих и истёкшие слоты пропускаются, даже если ещё не удалены
+    queued = [
+        row for row in conn.execute(
+            'SELECT id, user_id, heartbeat FROM llm_queue WHERE provider = ? ORDER BY id',
+            (provider,)
+        ).fetchall()
+        if row['heartbeat'] >= now - QUEUE_STALE
+    ]
+    if not queued:
+        return None
+    active = dict(conn.execute(
+        '''SELECT user_id, count(*) FROM llm_slots
+        WHERE provider = ? AND expires_at >= ? GROUP BY user_id''',
+        (provider, now)
+    ).fetchall())
+    return min(queued, key=lambda row: (active.get(row['user_id'], 0), row['id']))['id']
+
+
+def _can_acquire(conn, provider: str, now: float, ticket: Optional[int]) -> bool:
+    active = conn.execute(
+        'SELECT count(*) FROM llm_slots WHERE provider = ? AND expires_at >= ?',
+        (provider, now)
+    ).fetchone()[0]
+    if active >= LLM_PROVIDER_CONCURRENCY[provider]:
+        return False
+    # Новый запрос не обгоняет тех, кто уже ждёт в очереди
+    return _queue_head(conn, provider, now) == ticket
+
+
+def _try_acquire(conn, provider: str, user_id: int, now: float,
+                 ticket: Optional[int]) -> Optional[int]:
+    if not _can_acquire(conn, provider, now, ticket):
+        return None
+    if ticket is not None:
+        conn.execute('DELETE FROM llm_queue WHERE id = ?', (ticket,))
+    cursor = conn.execute(
+        '''INSERT INTO llm_slots (provider, user_id, acquired_at, expires_at)
+        VALUES (?, ?, ?, ?)''',
+        (provider, user_id, now, now + LLM_SLOT_TTL)
+    )
+    return cursor.lastrowid
+
+
+def _enter(provider: str, user_id: int) -> Tuple[Optional[int], Optional[int]]:
+    """Возвращает (слот, None) или (None, номер в очереди); иначе AdmissionRejected."""
+    with db.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        _purge(conn, now)
+        retry_after = _take_token(conn, user_id, now)
+        if retry_after:
+            _counters["rate_limited"] += 1
+            raise AdmissionRejected("rate_limited", retry_after)
+
+        slot = _try_acquire(conn, provider, user_id, now, None)
+        if slot is not None:
+            return slot, None
+
+        queued, mine = conn.execute(
+            '''SELECT count(*), count(CASE WHEN user_id = ? THEN 1 END)
+            FROM llm_queue WHERE provider = ?''',
+            (user_id, provider)
+        ).fetchone()
+        if queued >= LLM_QUEUE_MAX or mine >= LLM_QUEUE_PER_USER:
+            _counters["queue_full"] += 1
+            raise AdmissionRejected(
+                "queue_full", (queued + 1) / LLM_PROVIDER_CONCURRENCY[provider] * _hold_avg
+            )
+        cursor = conn.execute(
+            '''INSERT INTO llm_queue (provider, user_id, enqueued_at, heartbeat)
+            VALUES (?, ?, ?, ?)''',
+            (provider, user_id, now, now)
+        )
+        return None, cursor.lastrowid
+
+
+def _poll(provider: str, user_id: int, ticket: int) -> Optional[int]:
+    with db.connection() as conn:
+        # Сначала только чтение: пока слот занят или очередь не дошла, блокировка
+        # записи не нужна, кроме редкого обновления отметки
+        now = time.time()
+        row = conn.execute('SELECT heartbeat FROM llm_queue WHERE id = ?', (ticket,)).fetchone()
+        if row is None:
+            raise AdmissionRejected("queue_lost", _hold_avg)
+        if not _can_acquire(conn, provider, now, ticket):
+            if now - row['heartbeat'] >= QUEUE_STALE / 2:
+                conn.execute('UPDATE llm_queue SET heartbeat = ? WHERE id = ?', (now, ticket))
+            return None
+
+        conn.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        _purge(conn, now)
+        alive = conn.execute(
+            'UPDATE llm_queue SET heartbeat = ? WHERE id = ?', (now, ticket)
+        ).rowcount
+        if not alive:
+            raise AdmissionRejected("queue_lost", _hold_avg)
+        return _try_acquire(conn, provider, user_id, now, ticket)
+
+
+def _leave(ticket: int) -> None:
+    with db.connection() as conn:
+        conn.execute('DELETE FROM llm_queue WHERE id = ?', (ticket,))
+
+
+def _renew_held() -> None:
+    with _held_lock:
+        slots = list(_held)
+    if not slots:
+        return
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                f'''UPDATE llm_slots SET expires_at = ?
+                WHERE id IN ({", ".join("?" * len(slots))})''',
+                (time.time() + LLM_SLOT_TTL, *slots)
+            )
+    except Exception as e:
+        # Следующая попытка через треть TTL, слот к этому времени ещё не истечёт
+        logger.warning("Failed to renew %d LLM slots: %s", len(slots), e)
+
+
+def _renew_loop() -> None:
+    while True:
+        time.sleep(LLM_SLOT_TTL / 3)
+        _renew_held()
+
+
+def _ensure_renewer() -> None:
+    global _renewer_pid
+    if _renewer_pid == os.getpid():
+        return
+    with _held_lock:
+        if _renewer_pid == os.getpid():
+            return
+        _renewer_pid = os.getpid()
+    threading.Thread(target=_renew_loop, name="llm-slot-renew", daemon=True).start()
+
+
+def _admitted(slot: int) -> int:
+    _counters["admitted"] += 1
+    with _held_lock:
+        _held[slot] = time.monotonic()
+    _ensure_renewer()
+    return slot
+
+
+def acquire(user_id: int, model_key: str) -> int:
+    """Занимает слот провайдера модели, при необходимости ожидая в очереди."""
+    provider = provider_for(model_key)
+    slot, ticket = _enter(provider, user_id)
+    if slot is not None:
+        return _admitted(slot)
+
+    _counters["queued"] += 1
+    deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+    delay = POLL_MIN
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+            slot = _poll(provider, user_id, ticket)
+            if slot is not None:
+                return _admitted(slot)
+    finally:
+        if slot is None:
+            _leave(ticket)
+    _counters["queue_timeouts"] += 1
+    raise AdmissionRejected("queue_timeout", _hold_avg)
+
+
+async def aacquire(user_id: int, model_key: str) -> int:
+    """Асинхронный вариант acquire: ожидание в очереди не блокирует event loop."""
+    provider = provider_for(model_key)
+    slot, ticket = await asyncio.to_thread(_enter, provider, user_id)
+    if slot is not None:
+        return _admitted(slot)
+
+    _counters["queued"] += 1
+    deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+    delay = POLL_MIN
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+            slot = await asyncio.to_thread(_poll, provider, user_id, ticket)
+            if slot is not None:
+                return _admitted(slot)
+    finally:
+        if slot is None:
+            await asyncio.to_thread(_leave, ticket)
+    _counters["queue_timeouts"] += 1
+    raise AdmissionRejected("queue_timeout", _hold_avg)
+
+
+def release(slot: int) -> None:
+    global _hold_avg
+    with _held_lock:
+        started = _held.pop(slot, None)
+    if started is None:
+        return
+    _hold_avg = 0.9 * _hold_avg + 0.1 * (time.monotonic() - started)
+    with db.connection() as conn:
+        conn.execute('DELETE FROM llm_slots WHERE id = ?', (slot,))
+
+
+@contextmanager
+def admitted(user_id: int, model_key: str) -> Iterator[int]:
+    slot = acquire(user_id, model_key)
+    try:
+        yield slot
+    finally:
+        release(slot)
+
+
+def counters() -> Dict[str, int]:
+    """Только счётчики решений, без подсчёта слотов и очереди в базе."""
+    return dict(_counters)
+
+
+metrics.watch_counters("admission_events_total", counters)
+
+
+def stats() -> Dict[str, float]:
+    result: Dict[str, float] = dict(_counters)
+    result["hold_avg"] = _hold_avg
+    with db.connection() as conn:
+        for provider, limit in LLM_PROVIDER_CONCURRENCY.items():
+            result[f"{provider}_active"] = conn.execute(
+                'SELECT count(*) FROM llm_slots WHERE provider = ?', (provider,)
+            ).fetchone()[0]
+            result[f"{provider}_limit"] = limit
+        result["queued_now"] = conn.execute('SELECT count(*) FROM llm_queue').fetchone()[0]
+    return result
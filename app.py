@@ -1,33 +1,54 @@
+import hashlib
+import hmac
 import logging
+import mimetypes
 import os
 import random
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 
 from dotenv import load_dotenv
-from flask import Flask, flash, jsonify, redirect, render_template, request, url_for
+from flask import (Flask, Response, flash, jsonify, redirect, render_template, request,
+                   send_from_directory, stream_with_context, url_for)
 from flask_login import (LoginManager, current_user, login_required, login_user,
                         logout_user)
 from werkzeug.security import generate_password_hash
-from werkzeug.utils import secure_filename
 
-from configs import (ADVANCED_WORDS, ALLOWED_EXTENSIONS, DATABASE, DEFAULT_PAIRS,
-                    RANDOM_NAMES, UPLOAD_FOLDER)
-from groq_llm import GROQ_MODELS, _get_response_groq
+import admission
+import assets
+import chat_context
+import db
+import deck_io
+import enrichment
+import http_cache
+import images
+import leaderboard
+import llm_cache
+import llm_clients
+import llm_router
+import logging_setup
+import metrics
+import migrations
+import sampler
+import search
+import srs
+from cache import TTLCache
+from chat_store import save_assistant_message, save_user_message_and_get_context, sse_event
+from configs import (ADVANCED_WORDS, ASSETS_AUTO_BUILD, ASSETS_DIST, CARDS_PAGE_MAX,
+                    CHAT_HISTORY_PAGE_MAX, CHAT_HISTORY_PAGE_SIZE, DATABASE, ENRICH_MAX_WORDS,
+                    GAME_BATCH_MAX, GAME_BATCH_SIZE, LLM_GATEWAY_URL, MEMORY_GAME_PAIRS,
+                    METRICS_TOKEN, RANDOM_NAMES, REVIEW_BATCH_MAX, REVIEW_BATCH_SIZE,
+                    SEARCH_PAGE_MAX, SEARCH_PAGE_SIZE, SECRET_KEY, STATIC_MAX_AGE, STUDY_PAGE_SIZE,
+                    UPLOAD_FOLDER, USER_CACHE_SIZE, USER_CACHE_TTL)
 from models import User
-from yandex_gpt import _get_response_yandex_gpt
 
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
-# Добавляем секретный ключ для сессий
-app.secret_key = os.urandom(24)
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+# Добавляем секретный ключ для сессий (общий для всех воркеров и шлюза LLM)
+app.secret_key = SECRET_KEY or os.urandom(24)
+
+# Настройка логирования: запись в отдельном потоке, JSON по умолчанию
+logging_setup.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация Flask-Login
@@ -36,142 +57,54 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Пожалуйста, войдите для доступа к этой странице.'
 
+# Сжатие динамических ответов brotli/gzip
+http_cache.init_app(app)
+# Замеры маршрутов и запросов к базе для /metrics
+metrics.init_app(app)
+
+# Кеш пользователей: load_user вызывается почти на каждый запрос
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+metrics.watch_cache("user", user_cache)
+
 @login_manager.user_loader
 def load_user(user_id):
+    try:
+        key = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    cached = user_cache.get(key)
+    if cached is not None:
+        return cached
     with get_db_connection() as conn:
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        user = conn.execute('SELECT * FROM users WHERE id = ?', (key,)).fetchone()
         if user:
-            return User(
+            user = User(
                 id=user['id'],
                 username=user['username'],
                 email=user['email'],
                 password_hash=user['password_hash']
             )
+            user_cache.set(key, user)
+            return user
     return None
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Соединение из пула текущего воркера (WAL, кеш выражений, общие pragma)
+    return db.connection()
 
 def init_db():
-    if not os.path.exists(DATABASE):
-        with open(DATABASE, 'w') as db_file:
-            pass
+    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
     try:
-        with get_db_connection() as conn:
-            # Сохраняем существующие данные
-            try:
-                existing_cards = conn.execute('SELECT * FROM cards').fetchall()
-            except sqlite3.OperationalError:
-                existing_cards = []
-
-            try:
-                existing_highscores = conn.execute('SELECT * FROM highscores').fetchall()
-            except sqlite3.OperationalError:
-                existing_highscores = []
-
-            try:
-                existing_chat = conn.execute('SELECT * FROM chat_history').fetchall()
-            except sqlite3.OperationalError:
-                existing_chat = []
-
-            # Удаляем существующие таблицы
-            conn.executescript('''
-                DROP TABLE IF EXISTS chat_history;
-                DROP TABLE IF EXISTS cards;
-                DROP TABLE IF EXISTS highscores;
-                DROP TABLE IF EXISTS users;
-            ''')
-
-            # Создаем таблицы заново
-            conn.executescript('''
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE cards (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    english_word TEXT NOT NULL,
-                    russian_word TEXT NOT NULL,
-                    description TEXT,
-                    transcription TEXT,
-                    pronunciation_url TEXT,
-                    image_path TEXT,
-                    is_hidden INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                );
-
-                CREATE TABLE highscores (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    player_name TEXT NOT NULL,
-                    score INTEGER NOT NULL,
-                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                );
-
-                CREATE TABLE chat_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    role TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    model TEXT NOT NULL DEFAULT 'yandex',
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                );
-            ''')
-
-            # Создаем тестового пользователя, если нужно
-            try:
-                conn.execute('''
-                    INSERT INTO users (username, email, password_hash)
-                    VALUES (?, ?, ?)
-                ''', ('admin', 'admin@example.com', generate_password_hash('Admin123')))
-                admin_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
-                
-                # Восстанавливаем существующие данные с привязкой к admin
-                if existing_cards:
-                    for card in existing_cards:
-                        conn.execute('''
-                            INSERT INTO cards (
-                                user_id, english_word, russian_word, description,
-                                transcription, pronunciation_url, image_path, is_hidden
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (admin_id, card['english_word'], card['russian_word'],
-                              card['description'], card['transcription'],
-                              card['pronunciation_url'], card['image_path'],
-                              card['is_hidden']))
-
-                if existing_highscores:
-                    for score in existing_highscores:
-                        conn.execute('''
-                            INSERT INTO highscores (user_id, player_name, score, date)
-                            VALUES (?, ?, ?, ?)
-                        ''', (admin_id, score['player_name'], score['score'], score['date']))
-
-                if existing_chat:
-                    for chat in existing_chat:
-                        conn.execute('''
-                            INSERT INTO chat_history (user_id, role, message, model, timestamp)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (admin_id, chat['role'], chat['message'],
-                              chat.get('model', 'yandex'), chat['timestamp']))
-
-            except sqlite3.IntegrityError:
-                # Пользователь уже существует
-                pass
-
-            conn.commit()
-            
+        # Применяем только недостающие миграции, существующие данные не трогаем
+        version = migrations.migrate()
+        logger.info("Database schema version: %s", version)
     except Exception as e:
-        logger.error(f"Error initializing database: {e}")
+        logger.error("Error initializing database: %s", e)
         raise
+    try:
+        migrations.check_query_plans()
+    except migrations.QueryPlanError as e:
+        logger.warning(str(e))
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -278,15 +211,146 @@ def index():
         return render_template('welcome.html')
     return render_template('index.html', username=current_user.username)
 
+def fetch_cards_page(conn, user_id, after=0, limit=STUDY_PAGE_SIZE):
+    # Keyset-пагинация по id: стоимость страницы не зависит от её номера и размера колоды
+    rows = conn.execute(
+        '''SELECT id, english_word, russian_word
+        FROM cards
+        WHERE user_id = ? AND is_hidden = 0 AND id > ?
+        ORDER BY id
+        LIMIT ?''',
+        (user_id, after, limit + 1)
+    ).fetchall()
+    cards = [dict(row) for row in rows[:limit]]
+    next_cursor = cards[-1]['id'] if len(rows) > limit else None
+    return cards, next_cursor
+
 @app.route('/study')
 @login_required
+@http_cache.conditional('cards')
 def study():
     with get_db_connection() as conn:
-        cards = conn.execute(
-            'SELECT * FROM cards WHERE user_id = ? AND is_hidden = 0', 
-            (current_user.id,)
-        ).fetchall()
-    return render_template('study.html', cards=cards)
+        cards, next_cursor = fetch_cards_page(conn, current_user.id)
+    return render_template('study.html', cards=cards, next_cursor=next_cursor)
+
+@app.route('/api/cards')
+@login_required
+def api_cards():
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', STUDY_PAGE_SIZE, type=int), 1), CARDS_PAGE_MAX)
+    with get_db_connection() as conn:
+        cards, next_cursor = fetch_cards_page(conn, current_user.id, after, limit)
+    return jsonify({"cards": cards, "next_cursor": next_cursor})
+
+@app.route('/review')
+@login_required
+def review():
+    return render_template('review.html', batch_size=REVIEW_BATCH_SIZE)
+
+@app.route('/api/review/next')
+@login_required
+def review_next():
+    limit = min(max(request.args.get('limit', REVIEW_BATCH_SIZE, type=int), 1), REVIEW_BATCH_MAX)
+    cards, next_due_at = srs.due_cards(current_user.id, limit)
+    return jsonify({"cards": cards, "next_due_at": next_due_at})
+
+@app.route('/api/review/<int:card_id>', methods=['POST'])
+@login_required
+def review_grade(card_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("JSON body must be an object")
+        grade = int(data.get('grade', request.form.get('grade')))
+        state = srs.record_review(current_user.id, card_id, grade)
+    except (TypeError, ValueError):
+        return jsonify({"error": f"Grade must be between {srs.MIN_GRADE} and {srs.MAX_GRADE}"}), 400
+    except srs.CardNotFound:
+        return jsonify({"error": "Card not found"}), 404
+    return jsonify(state)
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_PAGE_MAX)
+    offset = request.args.get('offset', 0, type=int)
+    results, next_offset = search.search(
+        current_user.id, request.args.get('q', ''), limit, offset
+    )
+    return jsonify({"results": results, "next_offset": next_offset})
+
+@app.route('/enrich', methods=['POST'])
+@login_required
+def enrich():
+    # Список слов приходит из формы (по строке или через запятую) или JSON {"words": [...]};
+    # в JSON допустима и строка в формате формы
+    data = request.get_json(silent=True)
+    if data is not None:
+        if not isinstance(data, dict):
+            return jsonify({"error": "Invalid request"}), 400
+        raw = data.get('words', [])
+        if isinstance(raw, str):
+            words = enrichment.split_words(raw)
+        elif isinstance(raw, list):
+            words = enrichment.normalize_words(str(word) for word in raw)
+        else:
+            return jsonify({"error": "words must be a list or a string"}), 400
+    else:
+        words = enrichment.split_words(request.form.get('words', ''))
+    if not words:
+        return jsonify({"error": "Word list is empty"}), 400
+
+    try:
+        job_id = enrichment.start_job(current_user.id, words)
+    except admission.AdmissionRejected as e:
+        response = jsonify({"error": e.message})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    return jsonify({
+        "job_id": job_id,
+        "total": min(len(words), ENRICH_MAX_WORDS),
+        "status_url": url_for('enrich_status', job_id=job_id),
+    }), 202
+
+@app.route('/enrich/<int:job_id>')
+@login_required
+def enrich_status(job_id):
+    job = enrichment.get_job(current_user.id, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/import_cards', methods=['POST'])
+@login_required
+def import_cards():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"error": "File is required"}), 400
+    try:
+        fmt = deck_io.detect_format(request.form.get('format'), file.filename)
+        # Werkzeug держит большие загрузки во временном файле, читаем его потоком
+        result = deck_io.import_cards(current_user.id, file.stream, fmt)
+    except deck_io.ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    except deck_io.ImportInterrupted as e:
+        # Часть пачек уже сохранена: сообщаем, сколько карточек добавлено
+        return jsonify({"error": str(e), "imported": e.imported}), 500
+    return jsonify(result)
+
+@app.route('/export_cards')
+@login_required
+def export_cards():
+    try:
+        fmt = deck_io.detect_format(request.args.get('format', 'csv'))
+    except deck_io.ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    mimetype, extension = deck_io.FORMATS[fmt]
+    return Response(
+        stream_with_context(deck_io.export_cards(current_user.id, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="cards.{extension}"'},
+    )
 
 @app.route('/add_card', methods=['GET', 'POST'])
 @login_required
@@ -298,24 +362,25 @@ def add_card():
         transcription = request.form['transcription']
         pronunciation_url = request.form['pronunciation_url']
 
-        image_path = None
+        image_path = image_hash = None
         if 'image' in request.files:
             file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                base, ext = os.path.splitext(filename)
-                filename = f"{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_path = f"card_images/{filename}"
+            if file and file.filename and images.allowed_file(file.filename):
+                # Имя файла — хеш содержимого, уменьшенные копии строятся в фоне
+                try:
+                    image_path, image_hash = images.save_upload(file)
+                except images.ImageTooLarge as e:
+                    flash(str(e))
+                    return render_template('add_card.html'), 413
 
         with get_db_connection() as conn:
             conn.execute(
                 '''INSERT INTO cards (
                     user_id, english_word, russian_word, description, 
-                    transcription, pronunciation_url, image_path
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    transcription, pronunciation_url, image_path, image_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
                 (current_user.id, english_word, russian_word, description,
-                 transcription, pronunciation_url, image_path)
+                 transcription, pronunciation_url, image_path, image_hash)
             )
             conn.commit()
         return redirect(url_for('study'))
@@ -324,85 +389,194 @@ def add_card():
 @app.route('/chat')
 @login_required
 def chat():
-    return render_template('chat.html')
+    return render_template('chat.html', gateway_url=LLM_GATEWAY_URL)
+
+def parse_ask_request():
+    data = request.get_json()
+    return (
+        data.get('message'),
+        data.get('model', 'yandex'),
+        float(data.get('temperature', 0.7)),
+        int(data.get('max_tokens', 2000)),
+    )
+
+def too_many_requests(e):
+    response = jsonify({"response": e.message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def get_assistant_response(context, model_key, temperature, max_tokens):
+    cached = llm_cache.lookup(model_key, context, temperature, max_tokens)
+    if cached:
+        return cached
+
+    assistant_response, tokens, answered_by = llm_router.route(
+        context, model_key, temperature, max_tokens
+    )
+
+    # Ответ запасной модели не кешируем под ключом запрошенной
+    if assistant_response and answered_by == model_key:
+        llm_cache.store(model_key, context, temperature, max_tokens, assistant_response, tokens)
+    return assistant_response, tokens
 
 @app.route('/ask', methods=['POST'])
 @login_required
 def ask():
     try:
-        data = request.get_json()
-        user_message = data.get('message')
-        model_key = data.get('model', 'yandex')
-        temperature = float(data.get('temperature', 0.7))
-        max_tokens = int(data.get('max_tokens', 2000))
+        user_message, model_key, temperature, max_tokens = parse_ask_request()
 
-        logger.info(f"Request from user {current_user.username} - Model: {model_key}")
+        logger.info("Chat request", extra={"user_id": current_user.id, "model": model_key})
         
         if not user_message:
             return jsonify({"response": "Message cannot be empty"}), 400
 
-        with get_db_connection() as conn:
-            conn.execute(
-                'INSERT INTO chat_history (user_id, role, message, model) VALUES (?, ?, ?, ?)',
-                (current_user.id, 'user', user_message, model_key)
+        with admission.admitted(current_user.id, model_key):
+            context = save_user_message_and_get_context(
+                current_user.id, user_message, model_key, max_tokens
             )
-            conn.commit()
 
-            history = conn.execute(
-                '''SELECT role, message 
-                FROM chat_history 
-                WHERE user_id = ? AND model = ? 
-                ORDER BY timestamp DESC LIMIT 10''',
-                (current_user.id, model_key)
-            ).fetchall()
-
-        context = []
-        for msg in reversed(history):
-            context.append({"role": msg['role'], "text": msg['message']})
-
-        if model_key in GROQ_MODELS:
-            assistant_response, tokens = _get_response_groq(
-                context,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                model=GROQ_MODELS[model_key],
-            )
-        else:
-            assistant_response, tokens = _get_response_yandex_gpt(
-                context, temperature=temperature, max_tokens=max_tokens
+            assistant_response, tokens = get_assistant_response(
+                context, model_key, temperature, max_tokens
             )
 
         if assistant_response:
-            with get_db_connection() as conn:
-                conn.execute(
-                    'INSERT INTO chat_history (user_id, role, message, model) VALUES (?, ?, ?, ?)',
-                    (current_user.id, 'assistant', assistant_response, model_key)
-                )
-                conn.commit()
+            save_assistant_message(current_user.id, assistant_response, model_key)
             return jsonify({"response": assistant_response})
         else:
             return jsonify({"response": "Извините, не удалось получить ответ."}), 500
 
+    except admission.AdmissionRejected as e:
+        return too_many_requests(e)
     except Exception as e:
-        logger.error(f"Error in ask endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in ask endpoint: %s", e, exc_info=True)
         return jsonify({"response": f"Произошла ошибка: {str(e)}"}), 500
 
+@app.route('/ask_stream', methods=['POST'])
+@login_required
+def ask_stream():
+    # Тот же контракт, что у /ask, но ответ приходит частями через Server-Sent Events
+    try:
+        user_message, model_key, temperature, max_tokens = parse_ask_request()
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"response": "Invalid request"}), 400
+    if not user_message:
+        return jsonify({"response": "Message cannot be empty"}), 400
+
+    logger.info("Chat stream request", extra={"user_id": current_user.id, "model": model_key})
+    user_id = current_user.id
+    try:
+        slot = admission.acquire(user_id, model_key)
+    except admission.AdmissionRejected as e:
+        return too_many_requests(e)
+
+    try:
+        context = save_user_message_and_get_context(user_id, user_message, model_key, max_tokens)
+
+        route_info = {}
+        cached = llm_cache.lookup(model_key, context, temperature, max_tokens)
+        if cached:
+            # Ответ из кеша отдаём одним событием
+            chunks = (part for part in (cached[0],))
+        else:
+            chunks = llm_router.stream(
+                context, model_key, temperature, max_tokens, route_info=route_info
+            )
+    except Exception:
+        admission.release(slot)
+        raise
+
+    def generate():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event('token', {"text": chunk})
+            assistant_response = ''.join(parts)
+            if not assistant_response:
+                yield sse_event('error', {"response": "Извините, не удалось получить ответ."})
+                return
+            # В историю попадает только полностью полученный ответ
+            save_assistant_message(user_id, assistant_response, model_key)
+            if route_info.get("model") == model_key:
+                llm_cache.store(model_key, context, temperature, max_tokens, assistant_response)
+            yield sse_event('done', {"response": assistant_response})
+        except llm_clients.StreamInterrupted as e:
+            # Неполный ответ не сохраняем и не кешируем
+            logger.warning("Interrupted ask_stream: %s", e)
+            yield sse_event('error', {"response": "Ответ модели оборвался, попробуйте ещё раз."})
+        except Exception as e:
+            logger.error("Error in ask_stream: %s", e, exc_info=True)
+            yield sse_event('error', {"response": f"Произошла ошибка: {str(e)}"})
+        finally:
+            # При отключении клиента закрываем и запрос к провайдеру
+            chunks.close()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Слот занят, пока поток не закрыт, даже если клиент ушёл до первого события
+    response.call_on_close(lambda: admission.release(slot))
+    return response
+
+def fetch_chat_history(conn, user_id, model=None, before=None, after=None,
+                       limit=CHAT_HISTORY_PAGE_SIZE):
+    # Курсор по id: либо страница старше before (по умолчанию самая свежая),
+    # либо только сообщения новее after — размер ответа не растёт с историей
+    conditions, params = ['user_id = ?'], [user_id]
+    if model:
+        conditions.append('model = ?')
+        params.append(model)
+    if after is not None:
+        conditions.append('id > ?')
+        params.append(after)
+        order = 'ASC'
+    else:
+        if before is not None:
+            conditions.append('id < ?')
+            params.append(before)
+        order = 'DESC'
+    rows = conn.execute(
+        f'''SELECT id, role, message, model
+        FROM chat_history
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id {order}
+        LIMIT ?''',
+        (*params, limit + 1)
+    ).fetchall()
+    messages = [dict(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    if order == 'DESC':
+        messages.reverse()
+    return messages, has_more
+
 @app.route('/get_chat_history')
 @login_required
+@http_cache.conditional('chat')
 def get_chat_history():
+    model = request.args.get('model') or None
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = min(
+        max(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE, type=int), 1), CHAT_HISTORY_PAGE_MAX
+    )
     try:
         with get_db_connection() as conn:
-            history = conn.execute(
-                '''SELECT role, message 
-                FROM chat_history 
-                WHERE user_id = ? 
-                ORDER BY timestamp ASC''',
-                (current_user.id,)
-            ).fetchall()
-        return jsonify([{"role": h['role'], "message": h['message']} for h in history])
+            messages, has_more = fetch_chat_history(
+                conn, current_user.id, model, before, after, limit
+            )
+        # prev_cursor — для подгрузки более ранних сообщений, last_id — для дельты
+        result = {"messages": messages, "has_more": has_more}
+        if after is None:
+            result["prev_cursor"] = messages[0]['id'] if has_more else None
+        if before is None:
+            result["last_id"] = messages[-1]['id'] if messages else (after or 0)
+        return jsonify(result)
     except Exception as e:
-        logger.error(f"Error getting chat history: {e}")
-        return jsonify([])
+        logger.error("Error getting chat history: %s", e)
+        return jsonify({"messages": [], "has_more": False}), 500
 
 @app.route('/clear_chat_history', methods=['POST'])
 @login_required
@@ -413,53 +587,45 @@ def clear_chat_history():
                 'DELETE FROM chat_history WHERE user_id = ?',
                 (current_user.id,)
             )
+            chat_context.clear_summaries(conn, current_user.id)
             conn.commit()
         return jsonify({"success": True})
     except Exception as e:
-        logger.error(f"Error clearing chat history: {e}")
+        logger.error("Error clearing chat history: %s", e)
         return jsonify({"success": False}), 500
 
 @app.route('/game')
 @login_required
 def game():
+    return render_template("game.html", batch_size=GAME_BATCH_SIZE)
+
+@app.route('/api/game/questions')
+@login_required
+def game_questions():
+    # Вопросы выбираются на сервере по индексу, поэтому ответ не растёт с размером колоды
+    count = min(max(request.args.get('count', GAME_BATCH_SIZE, type=int), 1), GAME_BATCH_MAX)
+    weighted = request.args.get('weighted', '0') == '1'
     with get_db_connection() as conn:
-        # Получаем все видимые карточки текущего пользователя
-        cards = conn.execute(
-            'SELECT * FROM cards WHERE user_id = ? AND is_hidden = 0', 
-            (current_user.id,)
-        ).fetchall()
-        cards_list = []
-        for card in cards:
-            cards_list.append({
-                "id": card["id"],
-                "english_word": card["english_word"],
-                "russian_word": card["russian_word"],
-                "is_hidden": card["is_hidden"],
+        questions = []
+        for card in sampler.sample_cards(conn, current_user.id, count, weighted=weighted):
+            options = sampler.distractors(conn, current_user.id, card)
+            questions.append({
+                **sampler.public(card),
+                "distractors": [sampler.public(option) for option in options],
             })
-    return render_template("game.html", cards=cards_list)
+    return jsonify({"questions": questions})
 
 @app.route('/memory_game')
 @login_required
 def memory_game():
-    with get_db_connection() as conn:
-        cards = conn.execute(
-            'SELECT * FROM cards WHERE user_id = ? AND is_hidden = 0', 
-            (current_user.id,)
-        ).fetchall()
-        cards_list = []
-        for card in cards:
-            cards_list.append({
-                "english_word": card["english_word"],
-                "russian_word": card["russian_word"],
-            })
-
-        # Если карточек меньше 8 пар, добавляем карточки по умолчанию
-        while len(cards_list) < 8:
-            default_card = DEFAULT_PAIRS[len(cards_list)]
-            if default_card not in cards_list:
-                cards_list.append(default_card)
+    return render_template("memory_game.html", pairs_count=MEMORY_GAME_PAIRS)
 
-    return render_template("memory_game.html", cards=cards_list[:8])
+@app.route('/api/memory_game/pairs')
+@login_required
+def memory_game_pairs():
+    with get_db_connection() as conn:
+        pairs = sampler.pairs(conn, current_user.id, MEMORY_GAME_PAIRS)
+    return jsonify({"pairs": [sampler.public(pair) for pair in pairs]})
 
 @app.route('/hide_card/<int:card_id>', methods=['POST'])
 @login_required
@@ -491,39 +657,88 @@ def restore_all():
     return redirect(url_for('study'))
 
 @app.route('/highscores')
+@http_cache.conditional('leaderboard')
 def highscores():
-    with get_db_connection() as conn:
-        scores = conn.execute('''
-            SELECT h.player_name, h.score, h.date, u.username 
-            FROM highscores h
-            JOIN users u ON h.user_id = u.id
-            ORDER BY h.score DESC 
-            LIMIT 10
-        ''').fetchall()
-    return render_template('highscores.html', scores=scores)
+    window = request.args.get('window', 'all')
+    if window not in leaderboard.WINDOWS:
+        window = 'all'
+    best = leaderboard.user_best(current_user.id) if current_user.is_authenticated else None
+    return render_template(
+        'highscores.html', scores=leaderboard.top(window), window=window, best=best
+    )
 
 @app.route('/save_score', methods=['POST'])
 @login_required
 def save_score():
-    score = request.form.get('score')
-    if score:
-        player_name = random.choice(RANDOM_NAMES)
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        with get_db_connection() as conn:
-            conn.execute(
-                'INSERT INTO highscores (user_id, player_name, score, date) VALUES (?, ?, ?, ?)',
-                (current_user.id, player_name, score, current_time)
-            )
-            conn.commit()
+    # Очки приходят из формы строкой; нечисловые и отрицательные значения не сохраняем
+    score = request.form.get('score', type=int)
+    if score is not None and score >= 0:
+        leaderboard.record_score(current_user.id, random.choice(RANDOM_NAMES), score)
     return redirect(url_for('highscores'))
 
+@app.route('/images/<filename>')
+def card_image(filename):
+    # Имя содержит хеш содержимого, поэтому файл можно кешировать навсегда
+    if not images.FINGERPRINTED_NAME.match(filename):
+        return {"error": "Not found"}, 404
+    response = send_from_directory(UPLOAD_FOLDER, filename, max_age=STATIC_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# Заранее сжатые варианты собранной статики в порядке предпочтения
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    # Собранные файлы содержат хеш в имени: изменённый файл получит новый URL
+    response = None
+    for encoding, suffix in ASSET_ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(
+                os.path.join(ASSETS_DIST, filename + suffix)):
+            response = send_from_directory(ASSETS_DIST, filename + suffix, max_age=STATIC_MAX_AGE)
+            response.content_encoding = encoding
+            response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            break
+    if response is None:
+        response = send_from_directory(ASSETS_DIST, filename, max_age=STATIC_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.template_global()
+def asset_url(filename):
+    if app.debug:
+        # При разработке правки в static/ подхватываются без перезапуска
+        assets.ensure_built(ASSETS_AUTO_BUILD)
+    built = assets.asset_path(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=built)
+
+def card_image_fields(card):
+    if card["image_hash"]:
+        image_url = url_for('card_image', filename=card["image_path"].rsplit('/', 1)[-1])
+        srcset = images.srcsets(
+            card["image_variants"], card["image_hash"],
+            lambda name: url_for('card_image', filename=name),
+        )
+    else:
+        # Картинки, загруженные до появления хешированных имён
+        image_url = url_for('static', filename=card["image_path"]) if card["image_path"] else None
+        srcset = {}
+    return {"image_path": card["image_path"], "image_url": image_url, "image_srcset": srcset}
+
 @app.route('/get_card_description/<int:card_id>')
 @login_required
+@http_cache.conditional('cards')
 def get_card_description(card_id):
     with get_db_connection() as conn:
         card = conn.execute(
-            'SELECT * FROM cards WHERE id = ? AND user_id = ?',
+            '''SELECT cards.*, images.variants AS image_variants
+            FROM cards LEFT JOIN images ON images.hash = cards.image_hash
+            WHERE cards.id = ? AND cards.user_id = ?''',
             (card_id, current_user.id)
         ).fetchone()
     if card:
@@ -533,14 +748,91 @@ def get_card_description(card_id):
             "description": card["description"],
             "transcription": card["transcription"],
             "pronunciation_url": card["pronunciation_url"],
-            "image_path": card["image_path"],
+            **card_image_fields(card),
         }
     return {"error": "Card not found"}, 404
 
+@app.route('/api/cards/details')
+@login_required
+def api_card_details():
+    # Детали нескольких карточек одним запросом: ?ids=1,2,3
+    try:
+        ids = sorted({int(i) for i in request.args.get('ids', '').split(',') if i.strip()})
+    except ValueError:
+        return jsonify({"error": "Invalid ids"}), 400
+    if not ids:
+        return jsonify({"cards": {}})
+    ids = ids[:CARDS_PAGE_MAX]
+
+    placeholders = ', '.join('?' * len(ids))
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            f'''SELECT cards.id, english_word, russian_word, description, transcription,
+                   pronunciation_url, image_path, image_hash, version, updated_at,
+                   images.variants AS image_variants
+            FROM cards LEFT JOIN images ON images.hash = cards.image_hash
+            WHERE cards.user_id = ? AND cards.id IN ({placeholders})''',
+            (current_user.id, *ids)
+        ).fetchall()
+
+    # Валидаторы строятся из версий карточек, а не из тела ответа
+    versions = ','.join(f"{row['id']}:{row['version']}" for row in sorted(rows, key=lambda r: r['id']))
+    etag = hashlib.sha1(f"{current_user.id}|{versions}".encode()).hexdigest()
+    last_modified = max((row['updated_at'] for row in rows if row['updated_at']), default=None)
+
+    response = jsonify({"cards": {
+        row['id']: {
+            "english_word": row["english_word"],
+            "russian_word": row["russian_word"],
+            "description": row["description"],
+            "transcription": row["transcription"],
+            "pronunciation_url": row["pronunciation_url"],
+            **card_image_fields(row),
+        }
+        for row in rows
+    }})
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = datetime.strptime(
+            last_modified, '%Y-%m-%d %H:%M:%S'
+        ).replace(tzinfo=timezone.utc)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/stats')
+@login_required
+def stats():
+    return jsonify({
+        "db_pool": db.pool_stats(),
+        "user_cache": user_cache.stats(),
+        "llm_clients": llm_clients.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_router": llm_router.stats(),
+        "admission": admission.stats(),
+        "leaderboard_cache": leaderboard.stats(),
+        "http_cache": http_cache.stats(),
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus ходит без сессии, поэтому доступ закрывается отдельным токеном;
+    # пока METRICS_TOKEN не задан, эндпоинт выключен
+    if not METRICS_TOKEN:
+        return Response('Not Found\n', status=404, mimetype='text/plain')
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token, METRICS_TOKEN):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Остальные маршруты остаются без изменений...
 
+# Схема обновляется и под gunicorn, и при запуске напрямую
+init_db()
+assets.ensure_built(ASSETS_AUTO_BUILD)
+
 if __name__ == '__main__':
     load_dotenv()
     #check_environment()
-    init_db()
     app.run(debug=True)
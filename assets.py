@@ -0,0 +1,145 @@
+"""Сборка статики с хешем содержимого в имени файла.
+
+``python assets.py`` копирует CSS и JS из ``static/`` в ``ASSETS_DIST`` под
+именами вида ``js/chat.3f9a1c2b7d4e.js``, рядом кладёт заранее сжатые
+варианты ``.gz`` и ``.br`` (brotli — если установлен пакет Brotli) и пишет
+``manifest.json`` с соответствием исходных имён собранным. Шаблоны получают
+URL через ``asset_url``: изменённый файл получает новое имя, поэтому старое
+можно кешировать навсегда, и повторная загрузка страницы не делает ни одного
+запроса за статикой. Старые сборки не удаляются: их ещё могут запросить
+страницы, отданные до выкладки.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from configs import ASSETS_DIST, BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+STATIC_FOLDER = os.path.join(BASE_DIR, "static")
+SOURCE_EXTENSIONS = (".css", ".js")
+# Каталоги static/, которые не являются исходниками статики
+SKIP_DIRS = ("card_images", os.path.basename(ASSETS_DIST))
+MANIFEST_NAME = "manifest.json"
+# Выигрыш от сжатия совсем маленьких файлов меньше накладных расходов
+COMPRESS_MIN_BYTES = 512
+
+_manifest: Optional[Dict[str, str]] = None
+_manifest_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _brotli() -> Any:
+    try:
+        import brotli
+    except ImportError:
+        logger.warning("Brotli is not installed, assets are precompressed with gzip only")
+        return None
+    return brotli
+
+
+def _write(path: str, data: bytes) -> None:
+    # Воркеры могут собирать статику одновременно, поэтому запись атомарная
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _sources() -> Dict[str, str]:
+    """{имя относительно static/: путь к файлу} для всех исходников статики."""
+    sources: Dict[str, str] = {}
+    for root, dirs, files in os.walk(STATIC_FOLDER):
+        if root == STATIC_FOLDER:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for filename in files:
+            if filename.endswith(SOURCE_EXTENSIONS):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, STATIC_FOLDER).replace(os.sep, "/")
+                sources[name] = path
+    return sources
+
+
+def hashed_name(name: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def build() -> Dict[str, str]:
+    """Собирает статику и возвращает новый манифест."""
+    brotli = _brotli()
+    manifest: Dict[str, str] = {}
+    for name, path in sorted(_sources().items()):
+        with open(path, "rb") as f:
+            data = f.read()
+        target = hashed_name(name, data)
+        manifest[name] = target
+        target_path = os.path.join(ASSETS_DIST, target)
+        if os.path.exists(target_path):
+            continue
+        _write(target_path, data)
+        if len(data) < COMPRESS_MIN_BYTES:
+            continue
+        # mtime=0 делает архив воспроизводимым при повторной сборке
+        _write(target_path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(target_path + ".br", brotli.compress(data, mode=brotli.MODE_TEXT))
+    _write(os.path.join(ASSETS_DIST, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    logger.info("Built %d assets into %s", len(manifest), ASSETS_DIST)
+    return manifest
+
+
+def _is_stale() -> bool:
+    manifest_path = os.path.join(ASSETS_DIST, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    return any(os.path.getmtime(path) > built_at for path in _sources().values())
+
+
+def load_manifest() -> Dict[str, str]:
+    try:
+        with open(os.path.join(ASSETS_DIST, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def ensure_built(auto_build: bool = True) -> Dict[str, str]:
+    """Пересобирает статику, если исходники новее манифеста, и загружает манифест."""
+    global _manifest
+    with _manifest_lock:
+        if auto_build and _is_stale():
+            try:
+                _manifest = build()
+            except OSError as e:
+                # Например, static/ только для чтения: отдаём исходные файлы
+                logger.error("Failed to build assets: %s", e)
+                _manifest = load_manifest()
+        else:
+            _manifest = load_manifest()
+        return _manifest
+
+
+def manifest() -> Dict[str, str]:
+    if _manifest is None:
+        return ensure_built(auto_build=False)
+    return _manifest
+
+
+def asset_path(name: str) -> Optional[str]:
+    """Имя собранного файла внутри ASSETS_DIST или None, если файла нет в сборке."""
+    return manifest().get(name)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    build()
@@ -0,0 +1,13 @@
+"""Нагрузочные и микро-бенчмарки приложения.
+
+* ``datagen`` — синтетические пользователи, колоды, история чата и рекорды
+  заданного объёма (от 10³ до 10⁶ строк) в отдельной базе;
+* ``stubs`` — локальные заглушки YandexGPT и Groq с настраиваемой задержкой
+  и потоковой выдачей;
+* ``load`` — прогон всех маршрутов ``app.py`` в несколько потоков с p50/p95/p99
+  и пропускной способностью;
+* ``micro`` — время отдельных запросов к базе и функций горячего пути;
+* ``report`` — сохранение результатов в JSON и сравнение с базовым прогоном.
+
+Запуск целиком: ``python -m bench.run --scale 100000 --out results.json``.
+"""
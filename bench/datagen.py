@@ -0,0 +1,168 @@
+"""Синтетические данные для бенчмарков.
+
+Колоды распределены между пользователями по закону Ципфа: у ``bench0``
+самая большая колода, у остальных всё меньше, как у настоящих пользователей.
+Строки вставляются обычными INSERT, поэтому все триггеры (поиск, номера
+выборки, состояние повторения, версии данных) отрабатывают как в работе.
+
+База берётся из переменной DATABASE, её нужно задать до импорта модуля::
+
+    DATABASE=/tmp/bench.db python -m bench.datagen --scale 100000
+"""
+import argparse
+import logging
+import random
+import string
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from werkzeug.security import generate_password_hash
+
+import db
+import leaderboard
+import migrations
+from configs import IMPORT_BATCH_SIZE, PRONUNCIATION_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+USER_PREFIX = "bench"
+PASSWORD = "Bench12345"
+MODELS = ("yandex", "llama3")
+CYRILLIC = "абвгдеёжзийклмнопрстуфхцчшщыэюя"
+DAY = 24 * 3600
+
+
+def _word(rng: random.Random, alphabet: str) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(3, 12)))
+
+
+def _owners(rng: random.Random, user_ids: Sequence[int], count: int) -> List[int]:
+    weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+    return rng.choices(user_ids, weights=weights, k=count)
+
+
+def _batches(rows: Iterator[tuple], size: int = IMPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    batch: List[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(sql: str, rows: Iterator[tuple]) -> int:
+    total = 0
+    for batch in _batches(rows):
+        with db.connection() as conn:
+            conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def create_users(count: int) -> List[int]:
+    # Хеш пароля считается один раз: он намеренно медленный
+    password_hash = generate_password_hash(PASSWORD)
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+            [(f"{USER_PREFIX}{i}", f"{USER_PREFIX}{i}@example.com", password_hash)
+             for i in range(count)]
+        )
+        rows = conn.execute(
+            "SELECT id FROM users WHERE username IN ({})".format(", ".join("?" * count)),
+            [f"{USER_PREFIX}{i}" for i in range(count)]
+        ).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def _cards(rng: random.Random, owners: List[int]) -> Iterator[tuple]:
+    for user_id in owners:
+        word = _word(rng, string.ascii_lowercase)
+        yield (
+            user_id, word, _word(rng, CYRILLIC),
+            f"{_word(rng, CYRILLIC)} {_word(rng, CYRILLIC)}. Пример: \"{word} is here.\"",
+            f"/{word}/", PRONUNCIATION_BASE_URL + word,
+        )
+
+
+def _chat(rng: random.Random, owners: List[int]) -> Iterator[tuple]:
+    for i, user_id in enumerate(owners):
+        role = "user" if i % 2 == 0 else "assistant"
+        message = " ".join(_word(rng, string.ascii_lowercase) for _ in range(rng.randint(5, 60)))
+        yield user_id, role, message, MODELS[i // 2 % len(MODELS)]
+
+
+def _scores(rng: random.Random, owners: List[int], now: datetime) -> Iterator[tuple]:
+    for user_id in owners:
+        date = now - timedelta(seconds=rng.randrange(30 * DAY))
+        name = _word(rng, string.ascii_letters)
+        yield user_id, name, rng.randrange(1000), date.strftime(leaderboard.DATE_FORMAT)
+
+
+def _spread_due_dates(now: int) -> None:
+    # Часть карточек уже пора повторять, остальные — в ближайший месяц
+    with db.connection() as conn:
+        conn.execute(
+            "UPDATE card_reviews SET due_at = ? + (abs(random()) % ?) - ?",
+            (now, 30 * DAY, 3 * DAY)
+        )
+
+
+def generate(users: int, cards: int, chat: int, scores: int, seed: int = 1) -> Dict[str, int]:
+    """Создаёт пользователей bench0..bench{users-1} и распределяет между ними строки."""
+    rng = random.Random(seed)
+    migrations.migrate()
+    user_ids = create_users(users)
+    started = time.perf_counter()
+    counts: Dict[str, int] = {"users": len(user_ids)}
+    counts["cards"] = _insert(
+        """INSERT INTO cards (user_id, english_word, russian_word, description,
+        transcription, pronunciation_url) VALUES (?, ?, ?, ?, ?, ?)""",
+        _cards(rng, _owners(rng, user_ids, cards)),
+    )
+    _spread_due_dates(int(time.time()))
+    # История чата — подряд идущие пары вопрос-ответ одного пользователя
+    chat_owners = [user_id for user_id in _owners(rng, user_ids, chat // 2) for _ in range(2)]
+    counts["chat_history"] = _insert(
+        "INSERT INTO chat_history (user_id, role, message, model) VALUES (?, ?, ?, ?)",
+        _chat(rng, chat_owners),
+    )
+    counts["highscores"] = _insert(
+        "INSERT INTO highscores (user_id, player_name, score, date) VALUES (?, ?, ?, ?)",
+        _scores(rng, _owners(rng, user_ids, scores), datetime.now()),
+    )
+    with db.connection() as conn:
+        leaderboard.rebuild(conn)
+        conn.execute("ANALYZE")
+    logger.info("Generated %s in %.1fs", counts, time.perf_counter() - started)
+    return counts
+
+
+def scale_counts(scale: int) -> Tuple[int, int, int, int]:
+    """(пользователи, карточки, сообщения, рекорды) для общего масштаба ``scale``."""
+    return max(5, min(1000, scale // 1000)), scale, scale // 2, scale // 10
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument("--scale", type=int, default=10000, help="number of cards (10^3..10^6)")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--chat", type=int)
+    parser.add_argument("--scores", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    users, cards, chat, scores = scale_counts(args.scale)
+    generate(
+        args.users or users, cards,
+        chat if args.chat is None else args.chat,
+        scores if args.scores is None else args.scores,
+        args.seed,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,337 @@
+"""Нагрузочный прогон маршрутов приложения по HTTP.
+
+Для каждого маршрута ``app.py`` есть сценарий. Сценарии прогоняются по
+очереди: каждый делает заданное число запросов в ``concurrency`` потоков,
+у каждого потока своя сессия своего пользователя bench*. Затем идёт
+смешанная нагрузка заданной длительности, где сценарии выбираются по весам
+примерно как у живых пользователей. Как и браузер, клиент повторяет
+GET-запросы с If-None-Match, поэтому в замер попадают ответы 304.
+
+Сценарии, которые меняют данные заметно для других (скрытие карточек,
+очистка чата, выход), идут последними и в смешанную нагрузку не входят.
+"""
+import io
+import itertools
+import os
+import random
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import requests
+
+import assets
+from bench.datagen import PASSWORD, USER_PREFIX
+from bench.report import summarize
+
+REQUEST_TIMEOUT = 60
+
+
+class Session:
+    """Вошедший пользователь bench* с id карточек своей колоды."""
+
+    def __init__(self, base_url: str, username: str, revalidate: bool = True,
+                 seed: Optional[int] = None) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.revalidate = revalidate
+        self.http = requests.Session()
+        self.rng = random.Random(seed)
+        self.card_ids: List[int] = []
+        self.job_id = 0
+        self._etags: Dict[str, str] = {}
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def sign_in(self) -> requests.Response:
+        return self.post("/login", data={"username": self.username, "password": PASSWORD})
+
+    def login(self) -> "Session":
+        response = self.sign_in()
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed for {self.username}: {response.status_code}")
+        page = self.http.get(self.url("/api/cards"), params={"limit": 200},
+                             timeout=REQUEST_TIMEOUT).json()
+        self.card_ids = [card["id"] for card in page["cards"]]
+        return self
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        headers = kwargs.pop("headers", {})
+        key = f"{path}?{sorted((kwargs.get('params') or {}).items())}"
+        if self.revalidate and key in self._etags:
+            headers["If-None-Match"] = self._etags[key]
+        response = self.http.get(self.url(path), headers=headers, allow_redirects=False,
+                                 timeout=REQUEST_TIMEOUT, **kwargs)
+        if self.revalidate and "ETag" in response.headers:
+            self._etags[key] = response.headers["ETag"]
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.http.post(self.url(path), allow_redirects=False,
+                              timeout=REQUEST_TIMEOUT, **kwargs)
+
+    def card_id(self) -> int:
+        return self.rng.choice(self.card_ids) if self.card_ids else 1
+
+
+class Scenario:
+    def __init__(self, name: str, endpoint: str, call: Callable[[Session], requests.Response],
+                 weight: int = 0, destructive: bool = False, stream: bool = False) -> None:
+        self.name = name
+        self.endpoint = endpoint
+        self.call = call
+        # Вес в смешанной нагрузке; 0 — сценарий в неё не входит
+        self.weight = weight
+        self.destructive = destructive
+        self.stream = stream
+
+
+def _anonymous(session: Session) -> Session:
+    return Session(session.base_url, session.username, revalidate=False)
+
+
+def _logout(session: Session) -> requests.Response:
+    # Выход — на отдельной сессии, чтобы поток не терял свою
+    return _anonymous(session).login().get("/logout")
+
+
+def _register(session: Session) -> requests.Response:
+    name = f"{USER_PREFIX}_reg_{uuid.uuid4().hex[:12]}"
+    return _anonymous(session).post(
+        "/register", data={"username": name, "email": f"{name}@example.com", "password": PASSWORD}
+    )
+
+
+def _import(session: Session) -> requests.Response:
+    rows = "".join(f"imp{uuid.uuid4().hex[:8]},импорт{i},bench\n" for i in range(20))
+    data = ("english_word,russian_word,description\n" + rows).encode()
+    return session.post("/import_cards", files={"file": ("bench.csv", io.BytesIO(data))})
+
+
+def _add_card(session: Session) -> requests.Response:
+    word = f"add{uuid.uuid4().hex[:8]}"
+    return session.post("/add_card", data={
+        "english_word": word, "russian_word": "добавить", "description": "bench",
+        "transcription": f"/{word}/", "pronunciation_url": "",
+    })
+
+
+def _enrich(session: Session) -> requests.Response:
+    # Слова проверяются по шаблону только из латинских букв
+    words = ["".join(session.rng.choice(string.ascii_lowercase) for _ in range(8))
+             for _ in range(5)]
+    response = session.post("/enrich", json={"words": words})
+    if response.status_code == 202:
+        session.job_id = response.json()["job_id"]
+    return response
+
+
+def _ask(session: Session, stream: bool, model: str) -> requests.Response:
+    # Уникальный вопрос, чтобы не попадать в кеш ответов LLM
+    word = session.rng.choice(("ubiquitous", "serendipity", "ephemeral"))
+    message = f"What does {word} mean? ({uuid.uuid4().hex[:8]})"
+    path = "/ask_stream" if stream else "/ask"
+    return session.post(path, json={"message": message, "model": model}, stream=stream)
+
+
+def _asset(session: Session) -> requests.Response:
+    built = assets.asset_path("styles.css")
+    return session.get(f"/assets/{built}", headers={"Accept-Encoding": "br, gzip"})
+
+
+def _image(session: Session) -> requests.Response:
+    # Настоящих картинок в синтетических данных нет: замеряется ответ 404
+    return session.get(f"/images/{'0' * 64}.webp")
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("index", "index", lambda s: s.get("/"), weight=5),
+    Scenario("login_page", "login", lambda s: _anonymous(s).get("/login")),
+    Scenario("login", "login", lambda s: _anonymous(s).sign_in()),
+    Scenario("register_page", "register", lambda s: _anonymous(s).get("/register")),
+    Scenario("register", "register", _register),
+    Scenario("static", "static", lambda s: s.get("/static/styles.css")),
+    Scenario("asset", "asset", _asset, weight=5),
+    Scenario("card_image", "card_image", _image),
+    Scenario("study", "study", lambda s: s.get("/study"), weight=10),
+    Scenario("api_cards", "api_cards",
+             lambda s: s.get("/api/cards", params={"after": s.card_id()}), weight=8),
+    Scenario("card_description", "get_card_description",
+             lambda s: s.get(f"/get_card_description/{s.card_id()}"), weight=10),
+    Scenario("card_details", "api_card_details",
+             lambda s: s.get("/api/cards/details", params={
+                 "ids": ",".join(str(s.card_id()) for _ in range(10))}), weight=5),
+    Scenario("search", "api_search",
+             lambda s: s.get("/api/search", params={"q": s.rng.choice("abcdefghklmnoprst") * 2}),
+             weight=8),
+    Scenario("search_fuzzy", "api_search",
+             lambda s: s.get("/api/search", params={"q": "serendipty"}), weight=2),
+    Scenario("review", "review", lambda s: s.get("/review"), weight=3),
+    Scenario("review_next", "review_next", lambda s: s.get("/api/review/next"), weight=8),
+    Scenario("review_grade", "review_grade",
+             lambda s: s.post(f"/api/review/{s.card_id()}", json={"grade": s.rng.randint(0, 5)}),
+             weight=8),
+    Scenario("game", "game", lambda s: s.get("/game"), weight=2),
+    Scenario("game_questions", "game_questions",
+             lambda s: s.get("/api/game/questions", params={"weighted": s.rng.randint(0, 1)}),
+             weight=6),
+    Scenario("memory_game", "memory_game", lambda s: s.get("/memory_game"), weight=2),
+    Scenario("memory_game_pairs", "memory_game_pairs",
+             lambda s: s.get("/api/memory_game/pairs"), weight=4),
+    Scenario("highscores", "highscores",
+             lambda s: s.get("/highscores", params={"window": s.rng.choice(("all", "day"))}),
+             weight=4),
+    Scenario("save_score", "save_score",
+             lambda s: s.post("/save_score", data={"score": s.rng.randrange(1000)}), weight=2),
+    Scenario("add_card_page", "add_card", lambda s: s.get("/add_card")),
+    Scenario("add_card", "add_card", _add_card, weight=1),
+    Scenario("import_cards", "import_cards", _import),
+    Scenario("export_cards", "export_cards", lambda s: s.get("/export_cards"), stream=True),
+    Scenario("enrich", "enrich", _enrich),
+    Scenario("enrich_status", "enrich_status", lambda s: s.get(f"/enrich/{s.job_id or 1}")),
+    Scenario("chat", "chat", lambda s: s.get("/chat"), weight=3),
+    Scenario("chat_history", "get_chat_history", lambda s: s.get("/get_chat_history"), weight=6),
+    Scenario("ask_yandex", "ask", lambda s: _ask(s, False, "yandex"), weight=2),
+    Scenario("ask_groq", "ask", lambda s: _ask(s, False, "llama3"), weight=1),
+    Scenario("ask_stream_yandex", "ask_stream", lambda s: _ask(s, True, "yandex"),
+             weight=2, stream=True),
+    Scenario("ask_stream_groq", "ask_stream", lambda s: _ask(s, True, "llama3"),
+             weight=1, stream=True),
+    Scenario("stats", "stats", lambda s: s.get("/stats")),
+    Scenario("metrics", "prometheus_metrics", lambda s: s.get("/metrics", headers={
+        "Authorization": f"Bearer {os.getenv('METRICS_TOKEN', '')}"})),
+    Scenario("hide_card", "hide_card", lambda s: s.post(f"/hide_card/{s.card_id()}"),
+             destructive=True),
+    Scenario("restore_all", "restore_all", lambda s: s.post("/restore_all"), destructive=True),
+    Scenario("clear_chat_history", "clear_chat_history",
+             lambda s: s.post("/clear_chat_history"), destructive=True),
+    Scenario("logout", "logout", _logout, destructive=True),
+]
+
+
+def uncovered(endpoints: Sequence[str]) -> List[str]:
+    """Маршруты приложения, для которых нет сценария."""
+    covered = {scenario.endpoint for scenario in SCENARIOS}
+    return sorted(set(endpoints) - covered)
+
+
+class Recorder:
+    """Замеры одного сценария из нескольких потоков."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.ttfb: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def call(self, scenario: Scenario, session: Session) -> None:
+        started = time.perf_counter()
+        first_byte = None
+        try:
+            response = scenario.call(session)
+            if scenario.stream:
+                # Время до первого байта и до конца потока считаются отдельно
+                chunks = response.iter_content(chunk_size=None)
+                next(chunks, None)
+                first_byte = time.perf_counter() - started
+                for _ in chunks:
+                    pass
+            else:
+                response.content
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+            if first_byte is not None:
+                self.ttfb.append(first_byte)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other: "Recorder") -> None:
+        self.latencies.extend(other.latencies)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def summary(self, elapsed: float) -> Dict:
+        errors = sum(count for status, count in self.statuses.items()
+                     if status == 0 or status >= 500)
+        result = summarize(self.latencies, elapsed, errors)
+        result["statuses"] = {str(status): count for status, count in sorted(self.statuses.items())}
+        if self.ttfb:
+            result["ttfb"] = summarize(self.ttfb, elapsed)
+        return result
+
+
+def _parallel(sessions: Sequence[Session], worker: Callable[[Session], None]) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(worker, sessions))
+    return time.perf_counter() - started
+
+
+def run_scenario(scenario: Scenario, sessions: Sequence[Session], requests_count: int) -> Dict:
+    recorder = Recorder()
+    counter = itertools.count()
+
+    def worker(session: Session) -> None:
+        while next(counter) < requests_count:
+            recorder.call(scenario, session)
+
+    return recorder.summary(_parallel(sessions, worker))
+
+
+def run_mixed(sessions: Sequence[Session], duration: float) -> Dict[str, Dict]:
+    """Смешанная нагрузка: сводка по каждому сценарию и общая строка ``total``."""
+    mix = [scenario for scenario in SCENARIOS if scenario.weight and not scenario.destructive]
+    weights = [scenario.weight for scenario in mix]
+    recorders = {scenario.name: Recorder() for scenario in mix}
+    deadline = time.perf_counter() + duration
+
+    def worker(session: Session) -> None:
+        while time.perf_counter() < deadline:
+            scenario = session.rng.choices(mix, weights)[0]
+            recorders[scenario.name].call(scenario, session)
+
+    elapsed = _parallel(sessions, worker)
+    result = {name: recorder.summary(elapsed)
+              for name, recorder in recorders.items() if recorder.latencies}
+    total = Recorder()
+    for recorder in recorders.values():
+        total.merge(recorder)
+    result["total"] = total.summary(elapsed)
+    return result
+
+
+def open_sessions(base_url: str, users: int, concurrency: int,
+                  revalidate: bool = True) -> List[Session]:
+    sessions = [
+        Session(base_url, f"{USER_PREFIX}{i % users}", revalidate, seed=i)
+        for i in range(concurrency)
+    ]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(Session.login, sessions))
+
+
+def run(base_url: str, users: int, concurrency: int, requests_per_route: int,
+        mixed_duration: float, only: Optional[Sequence[str]] = None,
+        revalidate: bool = True, log: Callable[[str], None] = print) -> Dict[str, Dict]:
+    """Прогон сценариев по одному, затем смешанная нагрузка, затем разрушающие сценарии."""
+    sessions = open_sessions(base_url, users, concurrency, revalidate)
+    selected = [scenario for scenario in SCENARIOS if not only or scenario.name in only]
+    routes = {}
+
+    def run_all(scenarios: List[Scenario]) -> None:
+        for scenario in scenarios:
+            routes[scenario.name] = summary = run_scenario(scenario, sessions, requests_per_route)
+            log(f"{scenario.name}: p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms "
+                f"p99={summary['p99_ms']}ms rps={summary['rps']} statuses={summary['statuses']}")
+
+    run_all([scenario for scenario in selected if not scenario.destructive])
+    mixed = run_mixed(sessions, mixed_duration) if mixed_duration > 0 else {}
+    run_all([scenario for scenario in selected if scenario.destructive])
+    return {"routes": routes, "mixed": mixed}
@@ -0,0 +1,96 @@
+"""Микро-бенчмарки запросов к базе и функций горячего пути.
+
+Запускаются в процессе бенчмарка на той же базе, что и приложение.
+Чтения из ``migrations.HOT_QUERIES`` выполняются с их примерными
+параметрами; функции модулей — для пользователя с самой большой колодой,
+где разница между поиском по индексу и перебором заметнее всего.
+"""
+import random
+import time
+from typing import Callable, Dict, List
+
+import db
+import http_cache
+import leaderboard
+import migrations
+import sampler
+import search
+import srs
+from bench.datagen import USER_PREFIX
+from bench.report import summarize
+
+WARMUP = 5
+
+
+def _measure(func: Callable[[], object], iterations: int) -> Dict[str, float]:
+    for _ in range(WARMUP):
+        func()
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def _query(sql: str, params) -> Callable[[], object]:
+    def run() -> object:
+        with db.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+    return run
+
+
+def _heaviest_user() -> int:
+    with db.connection() as conn:
+        row = conn.execute(
+            '''SELECT deck_sizes.user_id FROM deck_sizes JOIN users ON users.id = deck_sizes.user_id
+            WHERE users.username LIKE ? ORDER BY size DESC LIMIT 1''',
+            (f"{USER_PREFIX}%",)
+        ).fetchone()
+    return row[0] if row else 1
+
+
+def _functions(user_id: int) -> Dict[str, Callable[[], object]]:
+    rng = random.Random(1)
+
+    def with_conn(func: Callable) -> Callable[[], object]:
+        def run() -> object:
+            with db.connection() as conn:
+                return func(conn)
+        return run
+
+    return {
+        "search_prefix": lambda: search.search(user_id, rng.choice("abcdefgh") * 2, 20),
+        "search_fuzzy": lambda: search.search(user_id, "serendipty", 20),
+        "sample_cards": with_conn(lambda conn: sampler.sample_cards(conn, user_id, 10)),
+        "sample_cards_weighted": with_conn(
+            lambda conn: sampler.sample_cards(conn, user_id, 10, weighted=True)
+        ),
+        "memory_game_pairs": with_conn(lambda conn: sampler.pairs(conn, user_id, 8)),
+        "due_cards": lambda: srs.due_cards(user_id, 20),
+        "leaderboard_top": lambda: leaderboard.top("all"),
+        "leaderboard_user_best": lambda: leaderboard.user_best(user_id),
+        "data_version": lambda: http_cache.data_version("cards", user_id),
+        "cards_page_deep": _query(
+            '''SELECT id, english_word, russian_word FROM cards
+            WHERE user_id = ? AND is_hidden = 0 AND id > ? ORDER BY id LIMIT ?''',
+            (user_id, 0, 61),
+        ),
+        "chat_history_page": _query(
+            '''SELECT id, role, message, model FROM chat_history
+            WHERE user_id = ? ORDER BY id DESC LIMIT ?''',
+            (user_id, 51),
+        ),
+    }
+
+
+def run(iterations: int = 200) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, (sql, params) in migrations.HOT_QUERIES.items():
+        # Изменяющие запросы в списке есть ради проверки планов, их не выполняем
+        if sql.lstrip().upper().startswith("SELECT"):
+            results[f"query.{name}"] = _measure(_query(sql, params), iterations)
+    for name, func in _functions(_heaviest_user()).items():
+        results[f"func.{name}"] = _measure(func, iterations)
+    return results
@@ -0,0 +1,102 @@
+"""Сводка замеров, сохранение в JSON и сравнение с базовым прогоном."""
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+# Метрики, по которым ищутся регрессии: больше — хуже
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """Перцентиль по методу ближайшего ранга; выборка уже отсортирована."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    """Сводка по задержкам в секундах: перцентили в миллисекундах и запросы в секунду."""
+    samples = sorted(latencies)
+    count = len(samples)
+    return {
+        "count": count,
+        "errors": errors,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(sum(samples) / count * 1000, 3) if count else 0.0,
+        "max_ms": round(samples[-1] * 1000, 3) if count else 0.0,
+        "rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save(results: Dict[str, Any], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+            min_delta_ms: float = 0.0) -> List[Dict[str, Any]]:
+    """Строки сравнения по секциям routes, mixed и micro.
+
+    Регрессия — относительный рост больше ``threshold`` и при этом не меньше
+    ``min_delta_ms``: у быстрых замеров шум в доли миллисекунды даёт десятки процентов.
+    """
+    rows = []
+    for section in ("routes", "mixed", "micro"):
+        for name, summary in current.get(section, {}).items():
+            base = baseline.get(section, {}).get(name)
+            if not base:
+                continue
+            for metric in COMPARED_METRICS:
+                old, new = base.get(metric), summary.get(metric)
+                if not old or new is None:
+                    continue
+                change = new / old - 1
+                rows.append({
+                    "name": f"{section}.{name}", "metric": metric, "baseline": old,
+                    "current": new, "change": round(change, 3),
+                    "regression": change > threshold and new - old >= min_delta_ms,
+                })
+    return rows
+
+
+def format_table(section: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'name':<32} {'count':>7} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9}"]
+    for name, s in section.items():
+        lines.append(
+            f"{name:<32} {s['count']:>7} {s['errors']:>5} {s['p50_ms']:>9.2f} "
+            f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['rps']:>9.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,237 @@
+"""Полный прогон бенчмарков: данные, заглушки LLM, сервер, нагрузка, микро-замеры.
+
+::
+
+    python -m bench.run --scale 100000 --out results.json
+    python -m bench.run --scale 100000 --reuse --baseline results.json --out new.json
+
+Без ``--url`` скрипт сам запускает заглушки и приложение (gunicorn или
+встроенный сервер Flask) на свободных портах с отдельной базой. С ``--url``
+нагрузка идёт на уже запущенный сервер, который должен смотреть в ту же
+базу DATABASE, что и генератор данных. Если задан ``--baseline``, p50/p95/p99
+сравниваются с прошлым прогоном, и при росте больше ``--max-regression``
+скрипт завершается с кодом 1.
+"""
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_TIMEOUT = 60
+
+logger = logging.getLogger("bench")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: Optional[subprocess.Popen]) -> None:
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} was up")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not respond in {READY_TIMEOUT}s")
+
+
+def _remove_database(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _configure_environment(args: argparse.Namespace, stub_url: str) -> None:
+    # Настройки, заданные снаружи, имеют приоритет
+    defaults = {
+        "DATABASE": args.database,
+        "YANDEX_GPT_URL": f"{stub_url}/foundationModels/v1/completion",
+        "GROQ_BASE_URL": stub_url,
+        "GROQ_API_KEY": "bench",
+        "catalog_id": "bench",
+        "secret_key": "bench",
+        "SECRET_KEY": "bench",
+        "METRICS_TOKEN": "bench",
+        # Сводка прогона печатается в консоль, где JSON-строки читать неудобно
+        "LOG_FORMAT": "text",
+    }
+    if not args.keep_limits:
+        # Иначе ответы 429 от ограничения частоты вытеснили бы замеры LLM-маршрутов
+        defaults.update({
+            "LLM_RATE_PER_MINUTE": "1000000",
+            "LLM_RATE_BURST": "1000000",
+            "LLM_QUEUE_PER_USER": str(args.concurrency),
+            "LLM_QUEUE_MAX": str(max(32, 2 * args.concurrency)),
+        })
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def _server_command(args: argparse.Namespace, port: int) -> List[str]:
+    if args.server == "gunicorn":
+        return ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+                "--threads", str(args.threads), "--log-level", "warning", "app:app"]
+    return [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+            "--with-threads"]
+
+
+def _start(command: List[str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "ab")
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=os.environ.copy(),
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="English Cards load and micro benchmarks")
+    data = parser.add_argument_group("data")
+    data.add_argument("--scale", type=int, default=10000, help="number of cards (10^3..10^6)")
+    data.add_argument("--users", type=int, help="number of bench users")
+    data.add_argument("--database",
+                      default=os.path.join(tempfile.gettempdir(), "english_cards_bench.db"))
+    data.add_argument("--reuse", action="store_true", help="keep an existing benchmark database")
+    data.add_argument("--seed", type=int, default=1)
+
+    server = parser.add_argument_group("server")
+    server.add_argument("--url", help="benchmark an already running server")
+    server.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    server.add_argument("--workers", type=int, default=4)
+    server.add_argument("--threads", type=int, default=2)
+    server.add_argument("--keep-limits", action="store_true",
+                        help="keep the per-user LLM rate limits")
+
+    stubs = parser.add_argument_group("LLM stubs")
+    stubs.add_argument("--ttft", type=float, default=0.2)
+    stubs.add_argument("--token-delay", type=float, default=0.01)
+    stubs.add_argument("--tokens", type=int, default=50)
+    stubs.add_argument("--error-rate", type=float, default=0.0)
+
+    load = parser.add_argument_group("load")
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--requests", type=int, default=200, help="requests per route")
+    load.add_argument("--duration", type=float, default=30, help="mixed load seconds, 0 to skip")
+    load.add_argument("--only", nargs="*", help="scenario names to run")
+    load.add_argument("--no-revalidate", action="store_true",
+                      help="do not send If-None-Match on repeated GETs")
+    load.add_argument("--skip-load", action="store_true")
+    load.add_argument("--iterations", type=int, default=200, help="micro benchmark iterations")
+    load.add_argument("--skip-micro", action="store_true")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--out", default="bench_results.json")
+    output.add_argument("--baseline", help="previous results to compare against")
+    output.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative growth of p50/p95/p99")
+    output.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore regressions smaller than this many milliseconds")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Пути из командной строки — относительно каталога запуска, а работаем из корня репозитория
+    args.out = os.path.abspath(args.out)
+    args.database = os.path.abspath(args.database)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+    os.chdir(REPO_ROOT)
+    stub_port, app_port = _free_port(), _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    _configure_environment(args, stub_url)
+
+    # Модули приложения читают configs при импорте, поэтому импорт — после настройки окружения
+    from bench import datagen, load, micro, report
+
+    database = os.environ["DATABASE"]
+    if not (args.reuse and os.path.exists(database)):
+        _remove_database(database)
+        users, cards, chat, scores = datagen.scale_counts(args.scale)
+        counts = datagen.generate(args.users or users, cards, chat, scores, args.seed)
+    else:
+        datagen.migrations.migrate()
+        counts = {"reused": True}
+    users = args.users or datagen.scale_counts(args.scale)[0]
+
+    results: Dict = {
+        "meta": {**report.environment(), "args": vars(args), "data": counts},
+    }
+    processes: List[subprocess.Popen] = []
+    try:
+        if not args.skip_load:
+            base_url = args.url
+            if base_url is None:
+                log_dir = os.path.dirname(args.out)
+                processes.append(_start(
+                    [sys.executable, "-m", "bench.stubs", "--port", str(stub_port),
+                     "--ttft", str(args.ttft), "--token-delay", str(args.token_delay),
+                     "--tokens", str(args.tokens), "--error-rate", str(args.error_rate)],
+                    os.path.join(log_dir, "bench_stubs.log"),
+                ))
+                _wait_ready(f"{stub_url}/stats", processes[-1])
+                base_url = f"http://127.0.0.1:{app_port}"
+                processes.append(_start(_server_command(args, app_port),
+                                        os.path.join(log_dir, "bench_server.log")))
+                _wait_ready(f"{base_url}/login", processes[-1])
+
+            from app import app
+            missing = load.uncovered([rule.endpoint for rule in app.url_map.iter_rules()])
+            if missing:
+                logger.warning("Routes without a load scenario: %s", ", ".join(missing))
+
+            results.update(load.run(
+                base_url, users, args.concurrency, args.requests, args.duration,
+                only=args.only, revalidate=not args.no_revalidate, log=logger.info,
+            ))
+            if args.url is None:
+                results["stubs"] = requests.get(f"{stub_url}/stats", timeout=5).json()
+        if not args.skip_micro:
+            results["micro"] = micro.run(args.iterations)
+    finally:
+        _stop(processes)
+
+    report.save(results, args.out)
+    for section in ("routes", "mixed", "micro"):
+        if results.get(section):
+            print(f"\n[{section}]\n{report.format_table(results[section])}")
+    print(f"\nResults saved to {args.out}")
+
+    if args.baseline:
+        rows = report.compare(
+            results, report.load(args.baseline), args.max_regression, args.min_delta_ms
+        )
+        regressions = [row for row in rows if row["regression"]]
+        for row in regressions:
+            print(f"REGRESSION {row['name']} {row['metric']}: "
+                  f"{row['baseline']} -> {row['current']} ({row['change']:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions above {args.max_regression:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
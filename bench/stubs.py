@@ -0,0 +1,181 @@
+"""Локальные заглушки API YandexGPT и Groq (aiohttp).
+
+Заглушки отвечают в форматах настоящих API, включая потоковый режим:
+YandexGPT присылает JSON-строки с накопленным текстом, Groq — события SSE
+в формате OpenAI с приращениями. Задержка до первого токена, пауза между
+токенами, длина ответа и доля ошибок настраиваются. На запрос обогащения
+слов (``enrichment.ENRICH_PROMPT``) заглушка отвечает JSON-массивом, который
+разбирает ``enrichment.parse_batch``.
+
+Приложение направляется на заглушки переменными окружения::
+
+    python -m bench.stubs --port 8090
+    YANDEX_GPT_URL=http://127.0.0.1:8090/foundationModels/v1/completion \\
+    GROQ_BASE_URL=http://127.0.0.1:8090 gunicorn app:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+from aiohttp import web
+
+YANDEX_PATH = "/foundationModels/v1/completion"
+GROQ_PATH = "/openai/v1/chat/completions"
+WORDS_MARKER = "Слова:\n"
+
+
+class StubConfig:
+    def __init__(self, ttft: float = 0.2, token_delay: float = 0.01, tokens: int = 50,
+                 jitter: float = 0.2, error_rate: float = 0.0) -> None:
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self, base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+def _tokens(prompt: str, count: int) -> List[str]:
+    if WORDS_MARKER in prompt:
+        words = [word for word in prompt.split(WORDS_MARKER, 1)[1].splitlines() if word]
+        answer = json.dumps([
+            {"word": word, "russian": f"перевод {word}",
+             "description": f'Описание. Пример: "{word}."', "transcription": f"/{word}/"}
+            for word in words
+        ], ensure_ascii=False)
+        # Порции по 16 символов, как если бы модель выдавала JSON по токенам
+        return [answer[i:i + 16] for i in range(0, len(answer), 16)]
+    return [f"token{i} " for i in range(count)]
+
+
+def _usage(prompt: str, completion: List[str]) -> Dict[str, int]:
+    prompt_tokens = len(prompt.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(completion),
+            "total_tokens": prompt_tokens + len(completion)}
+
+
+async def _should_fail(config: StubConfig, counters: Dict[str, int], name: str) -> bool:
+    counters[f"{name}_requests"] += 1
+    if random.random() < config.error_rate:
+        counters[f"{name}_errors"] += 1
+        await asyncio.sleep(config.delay(config.ttft))
+        return True
+    return False
+
+
+async def yandex(request: web.Request) -> web.StreamResponse:
+    config: StubConfig = request.app["config"]
+    if await _should_fail(config, request.app["counters"], "yandex"):
+        return web.json_response({"error": "stub failure"}, status=500)
+    body = await request.json()
+    prompt = "\n".join(message.get("text", "") for message in body.get("messages", []))
+    tokens = _tokens(prompt, config.tokens)
+    usage = _usage(prompt, tokens)
+    yandex_usage = {"inputTextTokens": str(usage["prompt_tokens"]),
+                    "completionTokens": str(usage["completion_tokens"]),
+                    "totalTokens": str(usage["total_tokens"])}
+
+    def line(text: str, final: bool) -> Dict:
+        return {"result": {
+            "alternatives": [{
+                "message": {"role": "assistant", "text": text},
+                "status": "ALTERNATIVE_STATUS_FINAL" if final else "ALTERNATIVE_STATUS_PARTIAL",
+            }],
+            "usage": yandex_usage,
+            "modelVersion": "stub",
+        }}
+
+    await asyncio.sleep(config.delay(config.ttft))
+    if not body.get("completionOptions", {}).get("stream"):
+        await asyncio.sleep(config.delay(config.token_delay) * len(tokens))
+        return web.json_response(line("".join(tokens), final=True))
+
+    response = web.StreamResponse(headers={"Content-Type": "application/json"})
+    await response.prepare(request)
+    text = ""
+    for i, token in enumerate(tokens):
+        text += token
+        await response.write((json.dumps(line(text, i == len(tokens) - 1)) + "\n").encode())
+        await asyncio.sleep(config.delay(config.token_delay))
+    await response.write_eof()
+    return response
+
+
+async def groq(request: web.Request) -> web.StreamResponse:
+    config: StubConfig = request.app["config"]
+    if await _should_fail(config, request.app["counters"], "groq"):
+        return web.json_response({"error": {"message": "stub failure"}}, status=500)
+    body = await request.json()
+    prompt = "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+    tokens = _tokens(prompt, config.tokens)
+    common = {"id": f"chatcmpl-stub-{random.getrandbits(32):x}", "created": int(time.time()),
+              "model": body.get("model", "stub")}
+
+    await asyncio.sleep(config.delay(config.ttft))
+    if not body.get("stream"):
+        await asyncio.sleep(config.delay(config.token_delay) * len(tokens))
+        return web.json_response({
+            **common,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": "".join(tokens)}}],
+            "usage": _usage(prompt, tokens),
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+
+    async def send(delta: Dict, finish_reason=None, **extra) -> None:
+        chunk = {**common, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                              "logprobs": None}], **extra}
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+    await send({"role": "assistant", "content": ""})
+    for token in tokens:
+        await send({"content": token})
+        await asyncio.sleep(config.delay(config.token_delay))
+    # Как и Groq, расход токенов потока приходит в x_groq последнего фрагмента
+    await send({}, finish_reason="stop",
+               x_groq={"id": common["id"], "usage": _usage(prompt, tokens)})
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["counters"])
+
+
+def create_app(config: StubConfig) -> web.Application:
+    app = web.Application()
+    app["config"] = config
+    app["counters"] = {f"{name}_{kind}": 0 for name in ("yandex", "groq")
+                       for kind in ("requests", "errors")}
+    app.router.add_post(YANDEX_PATH, yandex)
+    app.router.add_post(GROQ_PATH, groq)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local YandexGPT and Groq API stubs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    config = StubConfig(args.ttft, args.token_delay, args.tokens, args.jitter, args.error_rate)
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Сборка контекста диалога под бюджет токенов модели.
+
+Последние сообщения берутся по убыванию id, пока помещаются в бюджет,
+который зависит от окна модели и запрошенного max_tokens. Всё, что старше,
+сжимается в скользящее резюме (таблица chat_summaries): оно обновляется в
+фоновом потоке и добавляется в начало контекста. Так размер промпта
+ограничен независимо от длины беседы.
+"""
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import db
+from configs import (CHAT_SUMMARY_MAX_TOKENS, CHAT_SUMMARY_MIN_MESSAGES, DEFAULT_CONTEXT_WINDOW,
+                     YANDEX_CONTEXT_WINDOW)
+from groq_llm import GROQ_MODELS, _get_response_groq
+from yandex_gpt import _get_response_yandex_gpt, system_prompt
+
+logger = logging.getLogger(__name__)
+
+_cyrillic = re.compile(r"[Ѐ-ӿ]")
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Запас на неточность оценки токенов без настоящего токенизатора
+SAFETY_RATIO = 0.9
+
+SUMMARY_PROMPT = (
+    "Кратко перескажи предыдущую часть беседы ученика с помощником по английскому языку: "
+    "какие слова и правила обсуждались, какие ошибки ученика исправлялись. "
+    "Пиши по-русски, не больше нескольких предложений."
+)
+
+
+def _window_from_name(model_name: str) -> int:
+    # Окно указано в конце имени модели (mixtral-8x7b-32768, llama3-8b-8192)
+    match = re.search(r"-(\d{4,})$", model_name)
+    return int(match.group(1)) if match else DEFAULT_CONTEXT_WINDOW
+
+
+CONTEXT_WINDOWS: Dict[str, int] = {
+    key: _window_from_name(name) for key, name in GROQ_MODELS.items()
+}
+CONTEXT_WINDOWS["yandex"] = YANDEX_CONTEXT_WINDOW
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка: кириллица ~2 символа на токен, латиница ~4."""
+    cyrillic = len(_cyrillic.findall(text))
+    return cyrillic // 2 + (len(text) - cyrillic) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(model_key: str, max_tokens: int) -> int:
+    window = CONTEXT_WINDOWS.get(model_key, DEFAULT_CONTEXT_WINDOW)
+    budget = int(window * SAFETY_RATIO) - max_tokens - estimate_tokens(system_prompt)
+    # Последний вопрос пользователя должен попасть в контекст в любом случае
+    return max(budget, 256)
+
+
+def _load_summary(conn, user_id: int, model_key: str) -> Tuple[str, int]:
+    row = conn.execute(
+        'SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ? AND model = ?',
+        (user_id, model_key)
+    ).fetchone()
+    return (row['summary'], row['last_message_id']) if row else ('', 0)
+
+
+def build_context(conn, user_id: int, model_key: str, max_tokens: int) -> List[Dict[str, str]]:
+    """Возвращает контекст в формате провайдеров: [{"role", "text"}, ...]."""
+    budget = context_budget(model_key, max_tokens)
+    summary, summarized_id = _load_summary(conn, user_id, model_key)
+    summary_tokens = estimate_tokens(summary) if summary else 0
+    if summary_tokens > budget // 2:
+        summary, summary_tokens = '', 0
+
+    used = summary_tokens
+    messages: List[Dict[str, str]] = []
+    oldest_included_id: Optional[int] = None
+    truncated = False
+    cursor = conn.execute(
+        '''SELECT id, role, message
+        FROM chat_history
+        WHERE user_id = ? AND model = ?
+        ORDER BY id DESC''',
+        (user_id, model_key)
+    )
+    for row in cursor:
+        cost = estimate_tokens(row['message'])
+        if messages and used + cost > budget:
+            truncated = True
+            break
+        used += cost
+        messages.append({"role": row['role'], "text": row['message']})
+        oldest_included_id = row['id']
+    cursor.close()
+    messages.reverse()
+
+    if truncated:
+        _schedule_summary(conn, user_id, model_key, summarized_id, oldest_included_id)
+        # Резюме нужно, только если часть истории не поместилась в контекст
+        if summary:
+            messages.insert(0, {
+                "role": "system",
+                "text": f"Краткое содержание предыдущей части беседы: {summary}",
+            })
+    return messages
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+_in_progress: Set[Tuple[int, str]] = set()
+_in_progress_lock = threading.Lock()
+
+
+def _schedule_summary(conn, user_id: int, model_key: str, summarized_id: int,
+                      oldest_included_id: int) -> None:
+    # Сколько не вошедших в контекст сообщений ещё не попало в резюме
+    pending = conn.execute(
+        '''SELECT count(*) FROM (
+            SELECT id FROM chat_history
+            WHERE user_id = ? AND model = ? AND id > ? AND id < ?
+            LIMIT ?
+        )''',
+        (user_id, model_key, summarized_id, oldest_included_id, CHAT_SUMMARY_MIN_MESSAGES)
+    ).fetchone()[0]
+    if pending < CHAT_SUMMARY_MIN_MESSAGES:
+        return
+    key = (user_id, model_key)
+    with _in_progress_lock:
+        if key in _in_progress:
+            return
+        _in_progress.add(key)
+    _executor.submit(_refresh_summary, user_id, model_key, oldest_included_id)
+
+
+def _refresh_summary(user_id: int, model_key: str, upto_id: int) -> None:
+    try:
+        with db.connection() as conn:
+            summary, summarized_id = _load_summary(conn, user_id, model_key)
+            rows = conn.execute(
+                '''SELECT id, role, message FROM chat_history
+                WHERE user_id = ? AND model = ? AND id > ? AND id < ?
+                ORDER BY id DESC''',
+                (user_id, model_key, summarized_id, upto_id)
+            )
+            # Берём самые свежие из выпавших сообщений, сколько помещается в бюджет резюме
+            budget = context_budget(model_key, CHAT_SUMMARY_MAX_TOKENS) // 2
+            dropped: List[str] = []
+            last_id = None
+            used = 0
+            for row in rows:
+                last_id = last_id or row['id']
+                used += estimate_tokens(row['message'])
+                if dropped and used > budget:
+                    break
+                dropped.append(f"{row['role']}: {row['message']}")
+            rows.close()
+        if last_id is None:
+            return
+
+        dropped.reverse()
+        parts = [SUMMARY_PROMPT]
+        if summary:
+            parts.append(f"Предыдущее резюме: {summary}")
+        parts.append("Новые сообщения:\n" + "\n".join(dropped))
+        context = [{"role": "user", "text": "\n\n".join(parts)}]
+
+        if model_key in GROQ_MODELS:
+            new_summary, _ = _get_response_groq(
+                context, temperature=0.2, max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+                model=GROQ_MODELS[model_key],
+            )
+        else:
+            new_summary, _ = _get_response_yandex_gpt(
+                context, temperature=0.2, max_tokens=CHAT_SUMMARY_MAX_TOKENS
+            )
+        if not new_summary:
+            return
+
+        with db.connection() as conn:
+            conn.execute(
+                '''INSERT INTO chat_summaries (user_id, model, summary, last_message_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, model) DO UPDATE SET
+                    summary = excluded.summary,
+                    last_message_id = excluded.last_message_id,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE excluded.last_message_id > chat_summaries.last_message_id''',
+                (user_id, model_key, new_summary, last_id)
+            )
+    except Exception as e:
+        logger.error("Failed to refresh chat summary: %s", e, exc_info=True)
+    finally:
+        with _in_progress_lock:
+            _in_progress.discard((user_id, model_key))
+
+
+def clear_summaries(conn, user_id: int) -> None:
+    conn.execute('DELETE FROM chat_summaries WHERE user_id = ?', (user_id,))
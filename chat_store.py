@@ -0,0 +1,33 @@
+"""Хранение истории чата, общее для Flask-приложения и асинхронного шлюза."""
+import json
+from typing import Any, Dict, List
+
+import db
+from chat_context import build_context
+
+
+def save_user_message_and_get_context(
+    user_id: int, user_message: str, model_key: str, max_tokens: int
+) -> List[Dict[str, str]]:
+    with db.connection() as conn:
+        conn.execute(
+            'INSERT INTO chat_history (user_id, role, message, model) VALUES (?, ?, ?, ?)',
+            (user_id, 'user', user_message, model_key)
+        )
+        conn.commit()
+
+        return build_context(conn, user_id, model_key, max_tokens)
+
+
+def save_assistant_message(user_id: int, assistant_response: str, model_key: str) -> None:
+    with db.connection() as conn:
+        conn.execute(
+            'INSERT INTO chat_history (user_id, role, message, model) VALUES (?, ?, ?, ?)',
+            (user_id, 'assistant', assistant_response, model_key)
+        )
+        conn.commit()
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    # Одно событие Server-Sent Events для /ask_stream
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
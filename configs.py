@@ -1,11 +1,15 @@
 import os
 from typing import List, Tuple
 
+import dotenv
+
+dotenv.load_dotenv()
+
 # Определяем базовую директорию проекта
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 # Пути к директориям и файлам
-DATABASE = os.path.join(BASE_DIR, "db", "cards.db")
+DATABASE = os.getenv("DATABASE", os.path.join(BASE_DIR, "db", "cards.db"))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "card_images")
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
 
@@ -111,3 +115,196 @@ DEFAULT_PAIRS = [
     {"english_word": "eloquent", "russian_word": "красноречивый"},
     {"english_word": "tenacious", "russian_word": "упорный"},
 ]
+
+# Пул соединений SQLite (отдельный пул в каждом воркере gunicorn).
+# Внутри запроса может понадобиться два соединения (маршрут + load_user),
+# поэтому размер пула должен быть не меньше удвоенного числа потоков воркера.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+
+# Размер пачки при переносе данных в миграциях схемы
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+
+# Кеш объектов User для Flask-Login (в памяти каждого воркера)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Пагинация карточек на странице /study и в /api/cards
+STUDY_PAGE_SIZE = int(os.getenv("STUDY_PAGE_SIZE", "60"))
+CARDS_PAGE_MAX = int(os.getenv("CARDS_PAGE_MAX", "200"))
+
+# Общий секрет сессий: нужен всем воркерам gunicorn и асинхронному шлюзу LLM
+SECRET_KEY = os.getenv("SECRET_KEY")
+
+# Асинхронный шлюз LLM (llm_gateway.py). Пустой LLM_GATEWAY_URL означает,
+# что чат обращается к /ask и /ask_stream самого Flask-приложения.
+LLM_GATEWAY_URL = os.getenv("LLM_GATEWAY_URL", "").rstrip("/")
+GATEWAY_ALLOWED_ORIGINS = [
+    origin.strip() for origin in os.getenv("GATEWAY_ALLOWED_ORIGINS", "").split(",") if origin.strip()
+]
+
+# HTTP-клиенты провайдеров LLM (пул keep-alive соединений в каждом процессе)
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+# HTTP/2 для httpx (Groq и асинхронные вызовы); требует пакет h2
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+
+# Общий кеш ответов LLM (таблица llm_cache в основной базе)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+# Устаревшие и лишние записи удаляются раз в столько записей в кеш одного процесса
+LLM_CACHE_EVICT_EVERY = max(1, int(os.getenv("LLM_CACHE_EVICT_EVERY", "100")))
+# Запросы с более высокой температурой не кешируются: от них ждут разнообразия
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.7"))
+# Сколько последних сообщений диалога входит в ключ кеша
+LLM_CACHE_CONTEXT_MESSAGES = int(os.getenv("LLM_CACHE_CONTEXT_MESSAGES", "3"))
+
+# Окна контекста моделей (для Groq берётся из имени модели, если указано)
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+YANDEX_CONTEXT_WINDOW = int(os.getenv("YANDEX_CONTEXT_WINDOW", "8000"))
+# Скользящее резюме старой части диалога
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "6"))
+
+# Постраничная загрузка истории чата
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_PAGE_MAX = int(os.getenv("CHAT_HISTORY_PAGE_MAX", "200"))
+
+# Маршрутизация запросов к LLM: цепочки запасных моделей ("модель=запасная,запасная;...")
+LLM_FALLBACK_CHAINS = {
+    model.strip(): [fallback.strip() for fallback in chain.split(",") if fallback.strip()]
+    for model, _, chain in (
+        item.partition("=")
+        for item in os.getenv(
+            "LLM_FALLBACK_CHAINS",
+            "llama3-70b=llama3,yandex;mixtral=llama3-70b,yandex;gemma2=gemma,yandex;"
+            "gemma=llama3,yandex;llama3=yandex;yandex=llama3",
+        ).split(";")
+        if item.strip()
+    )
+}
+# Скользящее окно статистики задержек и ошибок по каждой модели
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+LLM_ROUTER_WINDOW_SECONDS = float(os.getenv("LLM_ROUTER_WINDOW_SECONDS", "300"))
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "5"))
+# Модель с большей долей ошибок в окне пробуется последней
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+# Хеджирование: если основная модель не ответила за p95 своей задержки,
+# параллельно запрашивается следующая модель цепочки
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))
+LLM_ROUTER_MAX_WORKERS = int(os.getenv("LLM_ROUTER_MAX_WORKERS", "16"))
+
+# Допуск запросов к LLM: токен-бакет на пользователя (запросов в минуту и запас на всплеск)
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "10"))
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "5"))
+# Одновременные запросы к каждому провайдеру на все воркеры и шлюз
+LLM_PROVIDER_CONCURRENCY = {
+    "groq": int(os.getenv("LLM_GROQ_CONCURRENCY", "8")),
+    "yandex": int(os.getenv("LLM_YANDEX_CONCURRENCY", "8")),
+}
+# Очередь ожидания свободного слота: общий размер и сколько ждёт один пользователь
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+LLM_QUEUE_PER_USER = int(os.getenv("LLM_QUEUE_PER_USER", "1"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "15"))
+# Слот освобождается сам, если воркер умер, не вернув его
+LLM_SLOT_TTL = float(os.getenv("LLM_SLOT_TTL", "120"))
+
+# Массовое заполнение карточек через LLM: модель, слов в одном промпте,
+# параллельных запросов к модели и предел размера одного списка
+ENRICH_MODEL = os.getenv("ENRICH_MODEL", "llama3-70b")
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "25"))
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "4"))
+ENRICH_MAX_JOBS = int(os.getenv("ENRICH_MAX_JOBS", "2"))
+ENRICH_MAX_WORDS = int(os.getenv("ENRICH_MAX_WORDS", "1000"))
+# Незавершённых заданий на одного пользователя: остальные получают 429
+ENRICH_MAX_ACTIVE_PER_USER = int(os.getenv("ENRICH_MAX_ACTIVE_PER_USER", "1"))
+PRONUNCIATION_BASE_URL = "https://dictionary.cambridge.org/dictionary/english-russian/"
+
+# Импорт и экспорт колоды: карточек в одной транзакции импорта и строк в одной порции экспорта
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+# Изображения карточек: ширины уменьшенных копий, форматы (avif — если Pillow его
+# поддерживает), качество сжатия и срок кеширования неизменяемых файлов в браузере
+IMAGE_WIDTHS = [int(width) for width in os.getenv("IMAGE_WIDTHS", "320,640,1280").split(",")]
+IMAGE_FORMATS = [fmt.strip() for fmt in os.getenv("IMAGE_FORMATS", "avif,webp").split(",")]
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+# Сборка статики: каталог с файлами, имена которых содержат хеш содержимого,
+# и пересборка при запуске, если исходники новее манифеста
+ASSETS_DIST = os.getenv("ASSETS_DIST", os.path.join(BASE_DIR, "static", "dist"))
+ASSETS_AUTO_BUILD = os.getenv("ASSETS_AUTO_BUILD", "1") == "1"
+
+# Интервальное повторение (SM-2): размер пачки карточек к повторению, начальная и
+# минимальная лёгкость и через сколько минут снова показать забытую карточку
+REVIEW_BATCH_SIZE = int(os.getenv("REVIEW_BATCH_SIZE", "20"))
+REVIEW_BATCH_MAX = int(os.getenv("REVIEW_BATCH_MAX", "100"))
+SRS_INITIAL_EASE = float(os.getenv("SRS_INITIAL_EASE", "2.5"))
+SRS_MIN_EASE = float(os.getenv("SRS_MIN_EASE", "1.3"))
+SRS_RELEARN_MINUTES = int(os.getenv("SRS_RELEARN_MINUTES", "10"))
+
+# Таблица рекордов: сколько мест хранится и показывается в каждом окне
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+
+# Выборка карточек для игр: размер пачки вопросов, число неверных вариантов,
+# пар в «Найди пару» и наибольший вес карточки при выборке по ошибкам
+GAME_BATCH_SIZE = int(os.getenv("GAME_BATCH_SIZE", "10"))
+GAME_BATCH_MAX = int(os.getenv("GAME_BATCH_MAX", "50"))
+GAME_DISTRACTORS = int(os.getenv("GAME_DISTRACTORS", "3"))
+MEMORY_GAME_PAIRS = int(os.getenv("MEMORY_GAME_PAIRS", "8"))
+SAMPLER_MAX_WEIGHT = int(os.getenv("SAMPLER_MAX_WEIGHT", "5"))
+
+# Поиск по карточкам: размер страницы, предел листания, число кандидатов
+# нечёткого поиска и минимальное сходство слова с запросом для них
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_PAGE_MAX = int(os.getenv("SEARCH_PAGE_MAX", "100"))
+SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "1000"))
+SEARCH_FUZZY_CANDIDATES = int(os.getenv("SEARCH_FUZZY_CANDIDATES", "50"))
+SEARCH_FUZZY_MIN_SIMILARITY = float(os.getenv("SEARCH_FUZZY_MIN_SIMILARITY", "0.6"))
+
+# Сжатие динамических ответов: минимальный размер тела и уровни сжатия brotli и gzip
+# (для ответов, собираемых на каждый запрос, выгоднее быстрые уровни)
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+
+# Метрики Prometheus (/metrics): каждый процесс копит приращения в памяти и раз в
+# METRICS_FLUSH_INTERVAL секунд добавляет их в общую таблицу SQLite. /metrics
+# требует заголовок Authorization: Bearer <METRICS_TOKEN> и без токена выключен
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Профилирование медленных запросов: доля запросов под сэмплирующим профилировщиком
+# (0 — выключено), порог в миллисекундах, после которого профиль пишется в лог и
+# в PROFILE_DIR (если задан), и период снятия стеков
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+# Логирование: записи уходят в очередь и пишутся отдельным потоком. LOG_FORMAT — json
+# или text; сообщения длиннее LOG_MAX_MESSAGE_CHARS обрезаются, переполненная очередь
+# отбрасывает записи. Полные запросы и ответы LLM пишутся только для доли
+# LOG_PAYLOAD_SAMPLE_RATE вызовов, не длиннее LOG_PAYLOAD_MAX_CHARS и без текста
+# сообщений, пока LOG_REDACT_CONTENT включён
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_REDACT_CONTENT = os.getenv("LOG_REDACT_CONTENT", "1") == "1"
@@ -0,0 +1,222 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+from configs import (DATABASE, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE,
+                     DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_STATEMENT_CACHE_SIZE, DB_SYNCHRONOUS)
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+# Наблюдатель с методами query(sql, seconds) и pool_wait(seconds), например metrics
+_observer: Optional[Any] = None
+
+
+def set_observer(observer: Optional[Any]) -> None:
+    global _observer
+    _observer = observer
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, которое сообщает наблюдателю время каждого выражения.
+
+    Для SELECT замеряется выполнение до первой строки: чтение остальных
+    строк происходит уже в fetch*.
+    """
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        observer = _observer
+        if observer is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observer.query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql: str, parameters: Any) -> sqlite3.Cursor:
+        observer = _observer
+        if observer is None:
+            return super().executemany(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            observer.query(sql, time.perf_counter() - started)
+
+
+class ConnectionPool:
+    """Пул соединений SQLite в режиме WAL для одного процесса.
+
+    Соединения создаются лениво до ``size`` штук и переиспользуются между
+    потоками воркера. Каждое соединение настраивается pragma-параметрами
+    один раз при создании и держит собственный кеш подготовленных выражений.
+    """
+
+    def __init__(self, database: str, size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT) -> None:
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "acquired": 0,
+            "reused": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "timeouts": 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.database,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        # Отрицательное значение cache_size задаётся в килобайтах
+        conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        self._stats["connections_created"] += 1
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+            self._stats["reused"] += 1
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                self._stats["waits"] += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No free SQLite connection after {self.timeout}s (pool size {self.size})"
+                    )
+                finally:
+                    self._stats["wait_time_total"] += time.perf_counter() - started
+                self._stats["reused"] += 1
+        self._stats["acquired"] += 1
+        observer = _observer
+        if observer is not None:
+            observer.pool_wait(time.perf_counter() - started)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        if broken:
+            self._discard(conn)
+            return
+        self._idle.put_nowait(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+        self._stats["connections_discarded"] += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдаёт соединение с семантикой ``with sqlite3.connect(...)``.
+
+        При успешном выходе транзакция фиксируется, при исключении
+        откатывается; затем соединение возвращается в пул.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            if isinstance(e, sqlite3.DatabaseError) and not isinstance(
+                e, (sqlite3.IntegrityError, sqlite3.OperationalError)
+            ):
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        stats.update(
+            pid=self.pid,
+            size=self.size,
+            open=self._created,
+            idle=self._idle.qsize(),
+            in_use=self._created - self._idle.qsize(),
+        )
+        return stats
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Возвращает пул текущего процесса, пересоздавая его после fork."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # Соединения родителя после fork не используем и не закрываем
+                _pool = ConnectionPool(DATABASE)
+            pool = _pool
+    return pool
+
+
+def connection() -> ContextManager[sqlite3.Connection]:
+    return get_pool().connection()
+
+
+def pool_stats() -> Dict[str, float]:
+    return get_pool().stats()
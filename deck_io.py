@@ -0,0 +1,228 @@
+"""Потоковый импорт и экспорт колоды карточек.
+
+Поддерживаются CSV (с заголовком), JSONL (объект на строку) и текстовый
+формат Anki (поля через табуляцию, строки-директивы начинаются с ``#``).
+Импорт читает файл построчно и пишет пачками по ``IMPORT_BATCH_SIZE`` в
+отдельных коротких транзакциях, поэтому память не растёт с размером файла,
+а другие запросы на запись не ждут окончания всего импорта. Перед записью
+файл целиком разбирается отдельным проходом: ошибка формата в середине
+файла не оставляет половину колоды. Если же прервётся сама запись, уже
+сохранённые пачки остаются, и ImportInterrupted сообщает их число.
+
+Каждая вставка запускает триггеры карточки (поиск, повторения, выборка,
+версия данных), поэтому импорт 100 тысяч строк занимает порядка 12 с. Экспорт читает
+строки страницами по id и сразу отдаёт их клиенту; между страницами
+соединение возвращается в пул.
+"""
+import csv
+import io
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import db
+from configs import EXPORT_FETCH_SIZE, IMPORT_BATCH_SIZE, PRONUNCIATION_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('english_word', 'russian_word', 'description', 'transcription', 'pronunciation_url')
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'anki': ('text/tab-separated-values; charset=utf-8', 'txt'),
+}
+# Заголовок текстового экспорта Anki: Front, Back и остальные поля в порядке FIELDS
+ANKI_HEADER = (
+    "#separator:tab\n#html:false\n"
+    "#columns:Front\tBack\tDescription\tTranscription\tURL\n"
+)
+MAX_ERRORS = 20
+
+Row = Dict[str, Any]
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportInterrupted(Exception):
+    """Запись прервалась: первые ``imported`` карточек уже сохранены."""
+
+    def __init__(self, imported: int, reason: Exception):
+        self.imported = imported
+        super().__init__(f"Import stopped after {imported} cards: {reason}")
+
+
+def detect_format(requested: Optional[str], filename: str = '') -> str:
+    fmt = (requested or '').lower()
+    if not fmt:
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        fmt = {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl',
+               'txt': 'anki', 'tsv': 'anki'}.get(extension, '')
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unsupported format: {requested or filename}")
+    return fmt
+
+
+def _read_csv(stream: io.TextIOBase) -> Iterator[Tuple[int, Row]]:
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or not {'english_word', 'russian_word'} <= set(reader.fieldnames):
+        raise ImportFormatError("CSV header must contain english_word and russian_word")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _read_jsonl(stream: io.TextIOBase) -> Iterator[Tuple[int, Row]]:
+    for line_num, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_num, {}
+            continue
+        yield line_num, row if isinstance(row, dict) else {}
+
+
+def _read_anki(stream: io.TextIOBase) -> Iterator[Tuple[int, Row]]:
+    for line_num, line in enumerate(stream, 1):
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        yield line_num, dict(zip(FIELDS, line.split('\t')))
+
+
+READERS = {'csv': _read_csv, 'jsonl': _read_jsonl, 'anki': _read_anki}
+
+
+def _clean(row: Row) -> Optional[Tuple[str, ...]]:
+    values = {field: str(row.get(field) or '').strip() for field in FIELDS}
+    if not values['english_word'] or not values['russian_word']:
+        return None
+    if not values['pronunciation_url']:
+        values['pronunciation_url'] = PRONUNCIATION_BASE_URL + values['english_word'].lower()
+    return tuple(values[field] or None for field in FIELDS)
+
+
+def _insert_batch(user_id: int, batch: List[Tuple[str, ...]]) -> None:
+    # Каждая пачка — своя короткая транзакция: блокировка записи не держится весь импорт
+    with db.connection() as conn:
+        conn.executemany(
+            '''INSERT INTO cards (
+                user_id, english_word, russian_word, description,
+                transcription, pronunciation_url
+            ) VALUES (?, ?, ?, ?, ?, ?)''',
+            [(user_id, *values) for values in batch]
+        )
+
+
+def _parse(binary_stream: Any, fmt: str) -> Iterator[Tuple[int, Optional[Tuple[str, ...]]]]:
+    stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    try:
+        for line_num, row in READERS[fmt](stream):
+            yield line_num, _clean(row)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportFormatError(f"Cannot parse file, no cards imported: {e}") from e
+    finally:
+        # Не даём обёртке закрыть поток загруженного файла
+        stream.detach()
+
+
+def import_cards(user_id: int, binary_stream: Any, fmt: str) -> Dict[str, Any]:
+    """Импортирует карточки из бинарного потока; возвращает счётчики и первые ошибки.
+
+    Поток читается дважды, поэтому должен поддерживать seek (загрузки
+    Werkzeug поддерживают).
+    """
+    skipped = 0
+    errors: List[str] = []
+    for line_num, values in _parse(binary_stream, fmt):
+        if values is None:
+            skipped += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"line {line_num}: english_word and russian_word are required")
+
+    binary_stream.seek(0)
+    imported = 0
+    batch: List[Tuple[str, ...]] = []
+    try:
+        for _, values in _parse(binary_stream, fmt):
+            if values is None:
+                continue
+            batch.append(values)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                _insert_batch(user_id, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            _insert_batch(user_id, batch)
+            imported += len(batch)
+    except (sqlite3.Error, db.PoolTimeoutError) as e:
+        logger.error("Import for user %s stopped after %d cards: %s", user_id, imported, e)
+        raise ImportInterrupted(imported, e) from e
+    logger.info("Imported %d cards for user %s, skipped %d", imported, user_id, skipped)
+    return {"imported": imported, "skipped": skipped, "errors": errors}
+
+
+def _export_rows(user_id: int) -> Iterator[List[Any]]:
+    # Страницы по id: соединение из пула возвращается после каждой страницы и не
+    # держится (вместе с транзакцией чтения), пока медленный клиент качает файл
+    last_id = 0
+    while True:
+        with db.connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, english_word, russian_word, description, transcription,
+                       pronunciation_url
+                FROM cards WHERE user_id = ? AND is_hidden = 0 AND id > ?
+                ORDER BY id LIMIT ?''',
+                (user_id, last_id, EXPORT_FETCH_SIZE)
+            ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        yield [tuple(row)[1:] for row in rows]
+
+
+def _format_csv(chunks: Iterable[List[Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for rows in chunks:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _format_jsonl(chunks: Iterable[List[Any]]) -> Iterator[str]:
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(FIELDS, tuple(row))), ensure_ascii=False) + '\n' for row in rows
+        )
+
+
+def _anki_field(value: Optional[str]) -> str:
+    # Табуляция и переводы строк внутри поля сломали бы разбор строки
+    return ' '.join((value or '').split())
+
+
+def _format_anki(chunks: Iterable[List[Any]]) -> Iterator[str]:
+    yield ANKI_HEADER
+    for rows in chunks:
+        yield ''.join('\t'.join(_anki_field(value) for value in row) + '\n' for row in rows)
+
+
+FORMATTERS = {'csv': _format_csv, 'jsonl': _format_jsonl, 'anki': _format_anki}
+
+
+def export_cards(user_id: int, fmt: str) -> Iterator[str]:
+    """Генератор частей файла экспорта.
+
+    Строки читаются страницами по EXPORT_FETCH_SIZE по возрастанию id, и между
+    страницами соединение возвращается в пул. Карточки, изменённые во время
+    выгрузки, могут попасть в файл уже в новом виде.
+    """
+    return FORMATTERS[fmt](_export_rows(user_id))
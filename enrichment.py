@@ -0,0 +1,261 @@
+"""Массовое создание карточек по списку английских слов.
+
+Пользователь присылает список слов, задание выполняется в фоне: слова,
+уже известные общему кешу ``word_cache``, берутся оттуда, остальные
+отправляются модели пачками по ``ENRICH_BATCH_SIZE`` слов в одном промпте,
+несколько пачек параллельно. Модель возвращает JSON с переводом, описанием
+и транскрипцией; карточки и записи кеша пишутся через ``executemany``.
+Прогресс хранится в ``enrichment_jobs``, поэтому его может отдать любой воркер.
+
+Запросы заданий к модели не проходят через ``admission``: их параллельность
+в процессе ограничена пулами ``ENRICH_MAX_JOBS`` и ``ENRICH_WORKERS``, а у
+пользователя может быть не больше ``ENRICH_MAX_ACTIVE_PER_USER`` незавершённых
+заданий.
+"""
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import db
+import llm_router
+from admission import AdmissionRejected
+from configs import (ENRICH_BATCH_SIZE, ENRICH_MAX_ACTIVE_PER_USER, ENRICH_MAX_JOBS,
+                     ENRICH_MAX_WORDS, ENRICH_MODEL, ENRICH_WORKERS, PRONUNCIATION_BASE_URL)
+
+logger = logging.getLogger(__name__)
+
+# Russian, description, transcription
+WordInfo = Tuple[str, str, str]
+
+# Ограничение числа параметров в одном запросе SQLite
+SQL_CHUNK = 500
+# Незавершённое задание без обновлений дольше этого срока осталось от
+# умершего воркера и не мешает запустить новое
+JOB_STALE_SECONDS = 600
+JOB_RETRY_AFTER = 30
+
+ENRICH_PROMPT = (
+    "Для каждого английского слова из списка дай перевод на русский, описание и "
+    "транскрипцию IPA. Описание — одно предложение по-русски и пример на английском "
+    'в формате: Определение. Пример: "Example sentence." '
+    "Ответь только JSON-массивом без пояснений, по объекту на слово: "
+    '[{"word": "...", "russian": "...", "description": "...", "transcription": "/.../"}]\n\n'
+    "Слова:\n"
+)
+
+_word_pattern = re.compile(r"^[a-z][a-z' -]{0,63}$")
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_pid: Optional[int] = None
+
+
+def _executor(name: str) -> ThreadPoolExecutor:
+    # Задания и запросы к модели — в разных пулах, чтобы задание не ждало само себя
+    global _executors_pid
+    if _executors_pid != os.getpid():
+        _executors.clear()
+        _executors_pid = os.getpid()
+    if name not in _executors:
+        workers = ENRICH_MAX_JOBS if name == "jobs" else ENRICH_WORKERS
+        _executors[name] = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"enrich-{name}"
+        )
+    return _executors[name]
+
+
+def normalize_words(raw: Iterable[str]) -> List[str]:
+    """Приводит слова к нижнему регистру и убирает дубликаты и мусор, сохраняя порядок."""
+    words: List[str] = []
+    seen = set()
+    for item in raw:
+        word = " ".join(item.strip().lower().split())
+        if word and word not in seen and _word_pattern.match(word):
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def split_words(text: str) -> List[str]:
+    return normalize_words(re.split(r"[\n,;\t]+", text))
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _stale_before() -> str:
+    # updated_at пишется CURRENT_TIMESTAMP, то есть в UTC и в этом формате
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - JOB_STALE_SECONDS))
+
+
+def start_job(user_id: int, words: List[str]) -> int:
+    """Создаёт задание и ставит его в очередь; возвращает id задания.
+
+    Если у пользователя уже ENRICH_MAX_ACTIVE_PER_USER незавершённых заданий,
+    поднимает AdmissionRejected.
+    """
+    words = normalize_words(words)[:ENRICH_MAX_WORDS]
+    with db.connection() as conn:
+        # Проверка и вставка в одной транзакции: параллельные запросы не проскочат предел
+        conn.execute('BEGIN IMMEDIATE')
+        active = conn.execute(
+            '''SELECT count(*) FROM enrichment_jobs
+            WHERE user_id = ? AND status IN ('queued', 'running') AND updated_at > ?''',
+            (user_id, _stale_before())
+        ).fetchone()[0]
+        if active >= ENRICH_MAX_ACTIVE_PER_USER:
+            raise AdmissionRejected("enrich_busy", JOB_RETRY_AFTER)
+        cursor = conn.execute(
+            'INSERT INTO enrichment_jobs (user_id, status, total) VALUES (?, ?, ?)',
+            (user_id, 'queued', len(words))
+        )
+        job_id = cursor.lastrowid
+    _executor("jobs").submit(_run_job, job_id, user_id, words)
+    return job_id
+
+
+def get_job(user_id: int, job_id: int) -> Optional[dict]:
+    with db.connection() as conn:
+        row = conn.execute(
+            '''SELECT id, status, total, processed, created, skipped, failed, error
+            FROM enrichment_jobs WHERE id = ? AND user_id = ?''',
+            (job_id, user_id)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def _update_job(job_id: int, status: Optional[str] = None, processed: int = 0, created: int = 0,
+                skipped: int = 0, failed: int = 0, error: Optional[str] = None) -> None:
+    with db.connection() as conn:
+        conn.execute(
+            '''UPDATE enrichment_jobs SET
+                status = COALESCE(?, status),
+                processed = processed + ?,
+                created = created + ?,
+                skipped = skipped + ?,
+                failed = failed + ?,
+                error = COALESCE(?, error),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?''',
+            (status, processed, created, skipped, failed, error, job_id)
+        )
+
+
+def _load_cached(words: List[str]) -> Dict[str, WordInfo]:
+    cached: Dict[str, WordInfo] = {}
+    with db.connection() as conn:
+        for chunk in _chunks(words, SQL_CHUNK):
+            rows = conn.execute(
+                f'''SELECT word, russian_word, description, transcription FROM word_cache
+                WHERE word IN ({", ".join("?" * len(chunk))})''',
+                chunk
+            )
+            for row in rows:
+                cached[row['word']] = (
+                    row['russian_word'], row['description'], row['transcription']
+                )
+    return cached
+
+
+def _save(user_id: int, infos: Dict[str, WordInfo], cache: bool) -> None:
+    with db.connection() as conn:
+        if cache:
+            conn.executemany(
+                '''INSERT INTO word_cache (word, russian_word, description, transcription)
+                VALUES (?, ?, ?, ?) ON CONFLICT (word) DO NOTHING''',
+                [(word, *info) for word, info in infos.items()]
+            )
+        conn.executemany(
+            '''INSERT INTO cards (
+                user_id, english_word, russian_word, description,
+                transcription, pronunciation_url
+            ) VALUES (?, ?, ?, ?, ?, ?)''',
+            [
+                (user_id, word, russian, description, transcription,
+                 PRONUNCIATION_BASE_URL + word.replace(" ", "-"))
+                for word, (russian, description, transcription) in infos.items()
+            ]
+        )
+
+
+def parse_batch(response: str, words: List[str]) -> Dict[str, WordInfo]:
+    """Достаёт из ответа модели JSON-массив и сопоставляет его с запрошенными словами."""
+    start, end = response.find("["), response.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+
+    requested = set(words)
+    result: Dict[str, WordInfo] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        word = " ".join(str(item.get("word", "")).strip().lower().split())
+        russian = str(item.get("russian") or "").strip()
+        if word in requested and russian:
+            result[word] = (
+                russian,
+                str(item.get("description") or "").strip(),
+                str(item.get("transcription") or "").strip(),
+            )
+    return result
+
+
+def enrich_batch(words: List[str]) -> Dict[str, WordInfo]:
+    context = [{"role": "user", "text": ENRICH_PROMPT + "\n".join(words)}]
+    response, _, _ = llm_router.route(
+        context, ENRICH_MODEL, temperature=0.2, max_tokens=80 * len(words) + 100
+    )
+    if not response:
+        return {}
+    return parse_batch(response, words)
+
+
+def _run_job(job_id: int, user_id: int, words: List[str]) -> None:
+    try:
+        _update_job(job_id, status='running')
+        with db.connection() as conn:
+            rows = conn.execute('SELECT english_word FROM cards WHERE user_id = ?', (user_id,))
+            existing = {row['english_word'].strip().lower() for row in rows}
+        new_words = [word for word in words if word not in existing]
+        if len(new_words) < len(words):
+            skipped = len(words) - len(new_words)
+            _update_job(job_id, processed=skipped, skipped=skipped)
+
+        cached = _load_cached(new_words)
+        if cached:
+            _save(user_id, cached, cache=False)
+            _update_job(job_id, processed=len(cached), created=len(cached))
+
+        missing = [word for word in new_words if word not in cached]
+        futures = {
+            _executor("llm").submit(enrich_batch, batch): batch
+            for batch in _chunks(missing, ENRICH_BATCH_SIZE)
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                infos = future.result()
+            except Exception as e:
+                logger.error("Enrichment batch failed: %s", e)
+                infos = {}
+            if infos:
+                _save(user_id, infos, cache=True)
+            _update_job(
+                job_id, processed=len(batch), created=len(infos), failed=len(batch) - len(infos)
+            )
+        _update_job(job_id, status='done')
+        logger.info(
+            "Enrichment job %s finished: %d words, %d from cache", job_id, len(words), len(cached)
+        )
+    except Exception as e:
+        logger.error("Enrichment job %s failed: %s", job_id, e, exc_info=True)
+        _update_job(job_id, status='failed', error=str(e))
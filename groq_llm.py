@@ -1,8 +1,11 @@
 import logging
 import os
+from typing import AsyncIterator, Iterator, Optional
 
 import dotenv
-from groq import Groq
+
+from llm_clients import StreamInterrupted, get_async_groq_client, get_groq_client
+from logging_setup import sample_payload
 
 dotenv.load_dotenv()
 logger = logging.getLogger(__name__)
@@ -17,6 +20,19 @@ GROQ_MODELS = {
 }
 
 
+def _build_messages(original_context: list[dict]) -> list[dict]:
+    messages = []
+    for msg in original_context:
+        messages.append(
+            {
+                "role": msg["role"].replace("assistant", "system"),
+                "content": msg["text"],
+            }
+        )
+    messages.insert(0, {"role": "system", "content": os.getenv("system_prompt")})
+    return messages
+
+
 def _get_response_groq(
     original_context: list[dict],
     temperature=0.7,
@@ -24,18 +40,12 @@ def _get_response_groq(
     model="mixtral-8x7b-32768",
 ):
     try:
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        messages = []
-        for msg in original_context:
-            messages.append(
-                {
-                    "role": msg["role"].replace("assistant", "system"),
-                    "content": msg["text"],
-                }
-            )
-        messages.insert(0, {"role": "system", "content": os.getenv("system_prompt")})
-
-        logger.info(f"Context for {model}: {messages}")
+        client = get_groq_client()
+        messages = _build_messages(original_context)
+
+        logger.info("Request to %s with %d messages", model, len(messages))
+        # Переписка целиком — только для выборки вызовов и без текста сообщений
+        sample_payload(logger, "Groq request", messages, model=model)
 
         chat_completion = client.chat.completions.create(
             messages=messages,
@@ -48,9 +58,141 @@ def _get_response_groq(
         )
 
         if chat_completion.choices:
-            return chat_completion.choices[0].message.content, len(messages)
+            usage = chat_completion.usage
+            tokens = usage.total_tokens if usage is not None else None
+            return chat_completion.choices[0].message.content, tokens
         return None, None
 
     except Exception as e:
-        logger.error(f"Error in {model} response: {str(e)}")
+        logger.error("Error in %s response: %s", model, e)
         return None, None
+
+
+def _stream_response_groq(
+    original_context: list[dict],
+    temperature=0.7,
+    max_tokens=2000,
+    model="mixtral-8x7b-32768",
+    usage: Optional[dict] = None,
+) -> Iterator[str]:
+    """Отдаёт ответ модели Groq по частям по мере генерации.
+
+    Закрытие генератора закрывает поток и HTTP-соединение с API. Если передан
+    ``usage``, в ``usage["total_tokens"]`` записывается расход токенов из
+    последнего фрагмента. Ответ полон, только если пришёл finish_reason;
+    обрыв после первого фрагмента поднимает StreamInterrupted.
+    """
+    stream = None
+    sent = False
+    finished = False
+    try:
+        client = get_groq_client()
+        messages = _build_messages(original_context)
+        logger.info("Streaming request to %s with %d messages", model, len(messages))
+        sample_payload(logger, "Groq stream request", messages, model=model)
+
+        stream = client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=0.9,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                sent = True
+                yield chunk.choices[0].delta.content
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finished = True
+            if usage is not None and chunk.x_groq and chunk.x_groq.usage:
+                usage["total_tokens"] = chunk.x_groq.usage.total_tokens
+
+    except Exception as e:
+        logger.error("Error in %s stream: %s", model, e)
+    finally:
+        if stream is not None:
+            stream.close()
+    if sent and not finished:
+        raise StreamInterrupted(f"{model} stream ended without finish_reason")
+
+
+async def _aget_response_groq(
+    original_context: list[dict],
+    temperature=0.7,
+    max_tokens=2000,
+    model="mixtral-8x7b-32768",
+):
+    """Асинхронный вариант _get_response_groq для шлюза на asyncio."""
+    try:
+        client = get_async_groq_client()
+        messages = _build_messages(original_context)
+        logger.info("Async request to %s with %d messages", model, len(messages))
+        sample_payload(logger, "Groq request", messages, model=model)
+
+        chat_completion = await client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=0.9,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+        )
+
+        if chat_completion.choices:
+            usage = chat_completion.usage
+            tokens = usage.total_tokens if usage is not None else None
+            return chat_completion.choices[0].message.content, tokens
+        return None, None
+
+    except Exception as e:
+        logger.error("Error in %s response: %s", model, e)
+        return None, None
+
+
+async def _astream_response_groq(
+    original_context: list[dict],
+    temperature=0.7,
+    max_tokens=2000,
+    model="mixtral-8x7b-32768",
+    usage: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """Асинхронный вариант _stream_response_groq."""
+    stream = None
+    sent = False
+    finished = False
+    try:
+        client = get_async_groq_client()
+        messages = _build_messages(original_context)
+        logger.info("Async streaming request to %s with %d messages", model, len(messages))
+        sample_payload(logger, "Groq stream request", messages, model=model)
+
+        stream = await client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=0.9,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                sent = True
+                yield chunk.choices[0].delta.content
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finished = True
+            if usage is not None and chunk.x_groq and chunk.x_groq.usage:
+                usage["total_tokens"] = chunk.x_groq.usage.total_tokens
+
+    except Exception as e:
+        logger.error("Error in %s stream: %s", model, e)
+    finally:
+        if stream is not None:
+            await stream.close()
+    if sent and not finished:
+        raise StreamInterrupted(f"{model} stream ended without finish_reason")
@@ -0,0 +1,181 @@
+"""Условные запросы и сжатие динамических ответов.
+
+``conditional(scope)`` строит слабый ETag из номера версии данных
+пользователя (``data_versions``, счётчики ведут триггеры миграции 14),
+версии шаблонов и статики и адреса запроса; для таблицы рекордов — ещё и из
+ключей текущих дня и недели. Если ETag совпал с
+If-None-Match, сразу отдаётся 304: обработчик и его запросы к базе не
+выполняются, проверка стоит одного чтения по первичному ключу.
+
+``init_app`` подключает сжатие ответов brotli или gzip (по Accept-Encoding)
+для текстовых ответов больше ``COMPRESS_MIN_SIZE``. Потоковые ответы (SSE,
+экспорт колоды) и уже сжатые файлы статики не трогаются. ETag слабый,
+поэтому остаётся верным для любого варианта сжатия.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Optional
+
+from flask import Flask, Response, current_app, make_response, request, session
+from flask_login import current_user
+
+import assets
+import db
+import leaderboard
+import metrics
+from configs import BASE_DIR, COMPRESS_BROTLI_QUALITY, COMPRESS_GZIP_LEVEL, COMPRESS_MIN_SIZE
+
+TEMPLATE_FOLDER = os.path.join(BASE_DIR, "templates")
+COMPRESSIBLE_TYPES = (
+    "text/html", "text/plain", "text/css", "text/csv",
+    "application/json", "application/javascript", "image/svg+xml",
+)
+
+# Запрос версии для каждого набора данных; leaderboard общий для всех пользователей
+VERSION_QUERIES = {
+    "cards": "SELECT version FROM data_versions WHERE user_id = ? AND scope = 'cards'",
+    "chat": "SELECT version FROM data_versions WHERE user_id = ? AND scope = 'chat'",
+    "leaderboard": "SELECT version FROM leaderboard_meta WHERE id = 1",
+}
+
+_stats = {"not_modified": 0, "compressed": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**values: int) -> None:
+    with _stats_lock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+def data_version(scope: str, user_id: int) -> int:
+    sql = VERSION_QUERIES[scope]
+    with db.connection() as conn:
+        row = conn.execute(sql, (user_id,) if "?" in sql else ()).fetchone()
+    return row[0] if row else 0
+
+
+def _release_hash() -> str:
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(TEMPLATE_FOLDER)):
+        with open(os.path.join(TEMPLATE_FOLDER, name), "rb") as f:
+            digest.update(name.encode() + f.read())
+    for name, built in sorted(assets.manifest().items()):
+        digest.update(f"{name}={built}".encode())
+    return digest.hexdigest()[:12]
+
+
+_cached_release_hash = lru_cache(maxsize=1)(_release_hash)
+
+
+def release() -> str:
+    """Версия шаблонов и статики: после выкладки старые ETag перестают совпадать."""
+    return _release_hash() if current_app.debug else _cached_release_hash()
+
+
+def _period(scope: str) -> str:
+    # Доски дня и недели сменяются в полночь без нового результата, то есть без смены версии
+    if scope == "leaderboard":
+        return ",".join(leaderboard.board_keys(datetime.now()).values())
+    return ""
+
+
+def etag(scope: str, user_id: int) -> str:
+    key = (f"{scope}|{user_id}|{data_version(scope, user_id)}|{_period(scope)}|{release()}|"
+           f"{request.full_path}")
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def conditional(scope: str) -> Callable:
+    """Декоратор GET-обработчика, ответ которого зависит только от данных ``scope``.
+
+    Ставится под ``login_required``. Ответ получает слабый ETag и
+    ``Cache-Control: private, no-cache``: браузер хранит копию, но каждый раз
+    сверяет её с сервером.
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Страница с flash-сообщением должна их показать, а не взять копию из кеша
+            if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+                return view(*args, **kwargs)
+            user_id = current_user.id if current_user.is_authenticated else 0
+            tag = etag(scope, user_id)
+            if request.if_none_match.contains_weak(tag):
+                _count(not_modified=1)
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
+
+
+def _negotiate() -> Optional[str]:
+    accepted = request.accept_encodings
+    if accepted["br"] and assets._brotli() is not None:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compressible(response: Response) -> bool:
+    return (
+        response.status_code == 200
+        and not response.is_streamed
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_TYPES
+        and (response.content_length or 0) >= COMPRESS_MIN_SIZE
+    )
+
+
+def compress(response: Response) -> Response:
+    if request.method == "HEAD" or not _compressible(response):
+        return response
+    # Ответ зависит от Accept-Encoding, даже если этот клиент сжатие не принял
+    response.vary.add("Accept-Encoding")
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if encoding == "br":
+        brotli = assets._brotli()
+        body = brotli.compress(data, mode=brotli.MODE_TEXT, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+    response.set_data(body)
+    response.content_encoding = encoding
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        # Строгий ETag обещает побайтно одинаковое тело, а сжатое тело другое
+        response.set_etag(tag, weak=True)
+    _count(compressed=1, bytes_in=len(data), bytes_out=len(body))
+    return response
+
+
+def init_app(app: Flask) -> None:
+    app.after_request(compress)
+
+
+def stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.watch_counters("http_cache_events_total",
+                       lambda: {key: _stats[key] for key in ("not_modified", "compressed")})
+metrics.watch_counters("http_compression_bytes_total",
+                       lambda: {"in": _stats["bytes_in"], "out": _stats["bytes_out"]},
+                       label="stage")
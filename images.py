@@ -0,0 +1,170 @@
+"""Загрузка изображений карточек.
+
+Файл сохраняется под именем из хеша содержимого, поэтому одна и та же
+картинка хранится один раз, а её URL никогда не меняет смысла и может
+кешироваться браузером навсегда. Уменьшенные копии (WebP, а также AVIF,
+если его поддерживает Pillow) строятся в фоновом потоке; пока их нет,
+отдаётся оригинал. Без Pillow загрузка работает, но без уменьшенных копий.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+from configs import (ALLOWED_EXTENSIONS, IMAGE_FORMATS, IMAGE_MAX_BYTES, IMAGE_QUALITY,
+                     IMAGE_WIDTHS, IMAGE_WORKERS, UPLOAD_FOLDER)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Имена файлов, которые можно отдавать с бессрочным кешированием
+FINGERPRINTED_NAME = re.compile(r"^[0-9a-f]{32}(_\d+)?\.[a-z0-9]+$")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def allowed_file(filename: str) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+@lru_cache(maxsize=None)
+def _pillow() -> Any:
+    try:
+        from PIL import Image, ImageOps, features
+    except ImportError:
+        logger.warning("Pillow is not installed, card image thumbnails are disabled")
+        return None
+    return Image, ImageOps, features
+
+
+@lru_cache(maxsize=None)
+def output_formats() -> Tuple[str, ...]:
+    pillow = _pillow()
+    if pillow is None:
+        return ()
+    features = pillow[2]
+    supported = tuple(
+        fmt for fmt in IMAGE_FORMATS if fmt in features.modules and features.check_module(fmt)
+    )
+    if len(supported) < len(IMAGE_FORMATS):
+        unsupported = set(IMAGE_FORMATS) - set(supported)
+        logger.info("Image formats not supported by Pillow: %s", unsupported)
+    return supported
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=IMAGE_WORKERS, thread_name_prefix="images"
+            )
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def variant_name(image_hash: str, width: int, fmt: str) -> str:
+    return f"{image_hash}_{width}.{fmt}"
+
+
+def save_upload(file: Any) -> Tuple[str, str]:
+    """Сохраняет загруженный файл; возвращает (image_path, хеш содержимого)."""
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(UPLOAD_FOLDER, f".upload-{os.getpid()}-{threading.get_ident()}")
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as tmp:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise ImageTooLarge(f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+                digest.update(chunk)
+                tmp.write(chunk)
+        image_hash = digest.hexdigest()[:32]
+        filename = f"{image_hash}.{ext}"
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if os.path.exists(path):
+            # Такая картинка уже загружена — второй копии не будет
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    with db.connection() as conn:
+        inserted = conn.execute(
+            'INSERT OR IGNORE INTO images (hash, filename, status) VALUES (?, ?, ?)',
+            (image_hash, filename, 'pending')
+        ).rowcount
+    if inserted:
+        _get_executor().submit(process_image, image_hash, path)
+    return f"card_images/{filename}", image_hash
+
+
+def process_image(image_hash: str, path: str) -> None:
+    """Строит уменьшенные копии и обновляет версии карточек с этой картинкой."""
+    pillow = _pillow()
+    variants: List[Tuple[str, int]] = []
+    width = height = None
+    status = 'ready'
+    try:
+        if pillow is not None:
+            Image, ImageOps, _ = pillow
+            with Image.open(path) as original:
+                image = ImageOps.exif_transpose(original)
+                width, height = image.size
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                # Копии не крупнее оригинала; самая маленькая строится всегда
+                widths = [w for w in IMAGE_WIDTHS if w < width] or [min(IMAGE_WIDTHS + [width])]
+                for target in widths:
+                    resized = image.resize(
+                        (target, max(1, round(height * target / width))), Image.LANCZOS
+                    )
+                    for fmt in output_formats():
+                        name = variant_name(image_hash, target, fmt)
+                        tmp_path = os.path.join(UPLOAD_FOLDER, f".{name}.tmp")
+                        resized.save(tmp_path, format=fmt.upper(), quality=IMAGE_QUALITY)
+                        os.replace(tmp_path, os.path.join(UPLOAD_FOLDER, name))
+                        variants.append((fmt, target))
+    except Exception as e:
+        logger.error("Failed to process image %s: %s", image_hash, e)
+        status = 'failed'
+
+    with db.connection() as conn:
+        conn.execute(
+            '''UPDATE images SET status = ?, width = ?, height = ?, variants = ?
+            WHERE hash = ?''',
+            (status, width, height, json.dumps(variants), image_hash)
+        )
+        # Новая версия карточки сбрасывает ETag деталей, и клиент получит srcset
+        conn.execute(
+            'UPDATE cards SET image_path = image_path WHERE image_hash = ?', (image_hash,)
+        )
+
+
+def srcsets(variants_json: Optional[str], image_hash: str, url_for_file: Any) -> Dict[str, str]:
+    """{формат: srcset} по готовым копиям; url_for_file строит URL по имени файла."""
+    result: Dict[str, List[str]] = {}
+    for fmt, width in json.loads(variants_json or '[]'):
+        result.setdefault(fmt, []).append(
+            f"{url_for_file(variant_name(image_hash, width, fmt))} {width}w"
+        )
+    return {fmt: ', '.join(items) for fmt, items in result.items()}
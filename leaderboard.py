@@ -0,0 +1,173 @@
+"""Таблица рекордов с заранее посчитанными первыми местами.
+
+При записи результата в той же транзакции обновляются:
+
+* ``leaderboard_top`` — первые ``LEADERBOARD_SIZE`` мест за всё время,
+  за текущий день и за текущую неделю (лишние места сразу удаляются);
+* ``user_best_scores`` — лучший результат каждого пользователя;
+* ``leaderboard_meta.version`` — номер версии таблицы рекордов.
+
+Чтение берёт не больше ``LEADERBOARD_SIZE`` строк по индексу, поэтому его
+стоимость не зависит от числа сыгранных игр. Готовые списки кешируются в
+процессе по ключу (окно, версия): новый результат в любом воркере меняет
+версию, и устаревшие записи кеша больше не используются.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import db
+import metrics
+from cache import TTLCache
+from configs import LEADERBOARD_SIZE
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = ('all', 'day', 'week', 'users')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_cache = TTLCache(maxsize=32, ttl=3600)
+metrics.watch_cache("leaderboard", _cache)
+
+
+def board_keys(now: datetime) -> Dict[str, str]:
+    """Ключи досок, в которые попадает результат, записанный в момент ``now``."""
+    year, week, _ = now.isocalendar()
+    return {
+        'all': 'all',
+        'day': f"day:{now:%Y-%m-%d}",
+        'week': f"week:{year}-W{week:02d}",
+    }
+
+
+def window_start(window: str, now: datetime) -> Optional[str]:
+    """Начало окна в формате колонки highscores.date; None — за всё время."""
+    if window == 'day':
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif window == 'week':
+        start = (now - timedelta(days=now.weekday())).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+    else:
+        return None
+    return start.strftime(DATE_FORMAT)
+
+
+def _trim(conn, board: str) -> None:
+    conn.execute(
+        '''DELETE FROM leaderboard_top WHERE board = ? AND highscore_id IN (
+            SELECT highscore_id FROM leaderboard_top WHERE board = ?
+            ORDER BY score DESC, highscore_id LIMIT -1 OFFSET ?
+        )''',
+        (board, board, LEADERBOARD_SIZE)
+    )
+
+
+def rebuild(conn, now: Optional[datetime] = None) -> None:
+    """Заново заполняет доски текущих окон и лучшие результаты из highscores."""
+    now = now or datetime.now()
+    keys = board_keys(now)
+    conn.execute('DELETE FROM leaderboard_top')
+    for window, board in keys.items():
+        start = window_start(window, now)
+        conn.execute(
+            f'''INSERT INTO leaderboard_top (board, highscore_id, score)
+            SELECT ?, id, score FROM highscores
+            {"WHERE date >= ?" if start else ""}
+            ORDER BY score DESC, id LIMIT ?''',
+            (board, start, LEADERBOARD_SIZE) if start else (board, LEADERBOARD_SIZE)
+        )
+    conn.execute('DELETE FROM user_best_scores')
+    # Голая колонка рядом с max() в SQLite берётся из строки с максимумом
+    conn.execute(
+        '''INSERT INTO user_best_scores (user_id, highscore_id, score)
+        SELECT user_id, id, max(score) FROM highscores GROUP BY user_id'''
+    )
+    conn.execute('UPDATE leaderboard_meta SET version = version + 1 WHERE id = 1')
+
+
+def record_score(user_id: int, player_name: str, score: int,
+                 now: Optional[datetime] = None) -> int:
+    """Записывает результат игры и обновляет доски; возвращает id результата."""
+    now = now or datetime.now()
+    keys = board_keys(now)
+    with db.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        highscore_id = conn.execute(
+            'INSERT INTO highscores (user_id, player_name, score, date) VALUES (?, ?, ?, ?)',
+            (user_id, player_name, score, now.strftime(DATE_FORMAT))
+        ).lastrowid
+        # Доски прошедших дней и недель больше не читаются
+        conn.execute(
+            f'''DELETE FROM leaderboard_top
+            WHERE board NOT IN ({", ".join("?" * len(keys))})''',
+            tuple(keys.values())
+        )
+        for board in keys.values():
+            conn.execute(
+                'INSERT INTO leaderboard_top (board, highscore_id, score) VALUES (?, ?, ?)',
+                (board, highscore_id, score)
+            )
+            _trim(conn, board)
+        conn.execute(
+            '''INSERT INTO user_best_scores (user_id, highscore_id, score) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                highscore_id = excluded.highscore_id, score = excluded.score
+            WHERE excluded.score > user_best_scores.score''',
+            (user_id, highscore_id, score)
+        )
+        conn.execute('UPDATE leaderboard_meta SET version = version + 1 WHERE id = 1')
+    return highscore_id
+
+
+def _version(conn) -> int:
+    return conn.execute('SELECT version FROM leaderboard_meta WHERE id = 1').fetchone()[0]
+
+
+def top(window: str = 'all', now: Optional[datetime] = None) -> List[dict]:
+    """Первые места окна: all, day, week или users (лучший результат каждого игрока)."""
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown leaderboard window: {window}")
+    now = now or datetime.now()
+    board = board_keys(now).get(window, window)
+    with db.connection() as conn:
+        key = (board, _version(conn))
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+        if window == 'users':
+            rows = conn.execute(
+                '''SELECT h.player_name, h.score, h.date, u.username
+                FROM user_best_scores b
+                JOIN highscores h ON h.id = b.highscore_id
+                JOIN users u ON u.id = b.user_id
+                ORDER BY b.score DESC, b.highscore_id LIMIT ?''',
+                (LEADERBOARD_SIZE,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                '''SELECT h.player_name, h.score, h.date, u.username
+                FROM leaderboard_top t
+                JOIN highscores h ON h.id = t.highscore_id
+                JOIN users u ON u.id = h.user_id
+                WHERE t.board = ?
+                ORDER BY t.score DESC, t.highscore_id LIMIT ?''',
+                (board, LEADERBOARD_SIZE)
+            ).fetchall()
+    result = [dict(row) for row in rows]
+    _cache.set(key, result)
+    return result
+
+
+def user_best(user_id: int) -> Optional[dict]:
+    with db.connection() as conn:
+        row = conn.execute(
+            '''SELECT h.player_name, h.score, h.date FROM user_best_scores b
+            JOIN highscores h ON h.id = b.highscore_id WHERE b.user_id = ?''',
+            (user_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def stats() -> Dict[str, float]:
+    return _cache.stats()
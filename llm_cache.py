@@ -0,0 +1,145 @@
+"""Общий для всех воркеров кеш ответов LLM.
+
+Ключ строится из модели, системного промпта, нормализованного хвоста
+диалога, корзины температуры и max_tokens. Записи живут ``LLM_CACHE_TTL``
+секунд, а при превышении ``LLM_CACHE_MAX_ENTRIES`` вытесняются давно не
+использованные (LRU по ``last_access``). Размер таблицы проверяется не при
+каждой записи, а раз в ``LLM_CACHE_EVICT_EVERY`` записей процесса, поэтому
+между проверками он может ненадолго превысить предел.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+import metrics
+from configs import (LLM_CACHE_CONTEXT_MESSAGES, LLM_CACHE_ENABLED, LLM_CACHE_EVICT_EVERY,
+                     LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_TEMPERATURE, LLM_CACHE_TTL)
+
+logger = logging.getLogger(__name__)
+
+# last_access обновляется не чаще раза в минуту, чтобы чтения почти не писали в базу
+TOUCH_INTERVAL = 60
+
+_counters = {
+    "hits": 0,
+    "misses": 0,
+    "bypassed": 0,
+    "stores": 0,
+    "evictions": 0,
+}
+
+_whitespace = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _whitespace.sub(" ", text).strip().casefold()
+
+
+def cache_key(model_key: str, context: List[Dict[str, str]], temperature: float,
+              max_tokens: int) -> str:
+    payload = {
+        "model": model_key,
+        "system_prompt": _normalize(os.getenv("system_prompt") or ""),
+        "context": [
+            [msg["role"], _normalize(msg["text"])]
+            for msg in context[-LLM_CACHE_CONTEXT_MESSAGES:]
+        ],
+        "temperature": round(temperature, 1),
+        "max_tokens": max_tokens,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def is_cacheable(temperature: float) -> bool:
+    return LLM_CACHE_ENABLED and temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+
+def lookup(model_key: str, context: List[Dict[str, str]], temperature: float,
+           max_tokens: int) -> Optional[Tuple[str, Any]]:
+    """Возвращает (ответ, токены) из кеша или None."""
+    if not is_cacheable(temperature):
+        _counters["bypassed"] += 1
+        return None
+    key = cache_key(model_key, context, temperature, max_tokens)
+    now = time.time()
+    try:
+        with db.connection() as conn:
+            row = conn.execute(
+                'SELECT response, tokens FROM llm_cache WHERE key = ? AND expires_at > ?',
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    '''UPDATE llm_cache SET last_access = ?, hits = hits + 1
+                    WHERE key = ? AND last_access < ?''',
+                    (now, key, now - TOUCH_INTERVAL)
+                )
+    except Exception as e:
+        logger.error("Failed to read LLM response cache: %s", e)
+        row = None
+    if row is None:
+        _counters["misses"] += 1
+        return None
+    _counters["hits"] += 1
+    return row['response'], row['tokens']
+
+
+def store(model_key: str, context: List[Dict[str, str]], temperature: float,
+          max_tokens: int, response: str, tokens: Any = None) -> None:
+    if not is_cacheable(temperature) or not response:
+        return
+    key = cache_key(model_key, context, temperature, max_tokens)
+    now = time.time()
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO llm_cache
+                (key, model, response, tokens, created_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (key, model_key, response, tokens, now, now + LLM_CACHE_TTL, now)
+            )
+            _counters["stores"] += 1
+            # count(*) обходит всю таблицу, поэтому вытеснение — раз в несколько записей
+            if _counters["stores"] % LLM_CACHE_EVICT_EVERY == 0:
+                _evict(conn, now)
+    except Exception as e:
+        # Кеш не должен ломать ответ пользователю
+        logger.error("Failed to store LLM response in cache: %s", e)
+
+
+def _evict(conn: Any, now: float) -> None:
+    expired = conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,)).rowcount
+    overflow = conn.execute('SELECT count(*) FROM llm_cache').fetchone()[0] - LLM_CACHE_MAX_ENTRIES
+    evicted = 0
+    if overflow > 0:
+        evicted = conn.execute(
+            '''DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_access LIMIT ?
+            )''',
+            (overflow,)
+        ).rowcount
+    _counters["evictions"] += expired + evicted
+
+
+def counters() -> Dict[str, int]:
+    """Накопительные счётчики процесса без запросов к базе, для metrics."""
+    return dict(_counters)
+
+
+metrics.watch_counters("cache_events_total", counters, cache="llm")
+
+
+def stats() -> Dict[str, Any]:
+    lookups = _counters["hits"] + _counters["misses"]
+    result: Dict[str, Any] = dict(_counters)
+    result["hit_rate"] = _counters["hits"] / lookups if lookups else 0.0
+    with db.connection() as conn:
+        result["entries"] = conn.execute('SELECT count(*) FROM llm_cache').fetchone()[0]
+    result["max_entries"] = LLM_CACHE_MAX_ENTRIES
+    return result
@@ -0,0 +1,206 @@
+"""Долгоживущие HTTP-клиенты провайдеров LLM с пулами keep-alive соединений.
+
+Клиенты создаются лениво, по одному на процесс (асинхронные — по одному на
+event loop), и пересоздаются в дочернем процессе после fork, чтобы воркеры
+gunicorn не делили между собой сокеты родителя.
+"""
+import asyncio
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import requests
+from groq import AsyncGroq, Groq
+from requests.adapters import HTTPAdapter
+
+from configs import (LLM_CONNECT_TIMEOUT, LLM_HTTP2, LLM_KEEPALIVE_EXPIRY, LLM_POOL_MAXSIZE,
+                     LLM_READ_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+
+class StreamInterrupted(Exception):
+    """Поток ответа оборвался после первых токенов, ответ неполный.
+
+    До первого токена провайдеры просто завершают поток без ответа, и
+    маршрутизатор пробует запасную модель; после — переключаться уже поздно,
+    а частичный ответ нельзя ни сохранять, ни кешировать.
+    """
+
+
+_lock = threading.Lock()
+_yandex_session: Optional[requests.Session] = None
+_groq_client: Optional[Groq] = None
+_async_clients: Dict[Tuple[int, str], Any] = {}
+_counters = {
+    "requests": 0,
+    "connections_opened": 0,
+}
+
+
+def _reset_after_fork() -> None:
+    global _yandex_session, _groq_client, _lock
+    _lock = threading.Lock()
+    _yandex_session = None
+    _groq_client = None
+    _async_clients.clear()
+    for key in _counters:
+        _counters[key] = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@lru_cache(maxsize=None)
+def _http2_enabled() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("LLM_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAXSIZE,
+        max_keepalive_connections=LLM_POOL_MAXSIZE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+# Счётчики переиспользования соединений httpx через trace-расширение httpcore
+def _trace(event_name: str, info: dict) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        _counters["connections_opened"] += 1
+
+
+async def _atrace(event_name: str, info: dict) -> None:
+    _trace(event_name, info)
+
+
+def _on_request(request: httpx.Request) -> None:
+    _counters["requests"] += 1
+    request.extensions["trace"] = _trace
+
+
+async def _aon_request(request: httpx.Request) -> None:
+    _counters["requests"] += 1
+    request.extensions["trace"] = _atrace
+
+
+def _http_client() -> httpx.Client:
+    return httpx.Client(
+        http2=_http2_enabled(),
+        limits=_limits(),
+        timeout=_timeout(),
+        event_hooks={"request": [_on_request]},
+    )
+
+
+def _async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_enabled(),
+        limits=_limits(),
+        timeout=_timeout(),
+        event_hooks={"request": [_aon_request]},
+    )
+
+
+def get_yandex_session() -> requests.Session:
+    """Сессия requests для YandexGPT (HTTP/1.1 keep-alive, requests не поддерживает HTTP/2)."""
+    global _yandex_session
+    if _yandex_session is None:
+        with _lock:
+            if _yandex_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _yandex_session = session
+    return _yandex_session
+
+
+def yandex_timeout() -> Tuple[float, float]:
+    return LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT
+
+
+def get_groq_client() -> Groq:
+    global _groq_client
+    if _groq_client is None:
+        with _lock:
+            if _groq_client is None:
+                _groq_client = Groq(
+                    api_key=os.getenv("GROQ_API_KEY"),
+                    timeout=_timeout(),
+                    http_client=_http_client(),
+                )
+    return _groq_client
+
+
+def _loop_client(name: str, factory: Any) -> Any:
+    # Асинхронные клиенты привязаны к event loop, в котором созданы
+    key = (id(asyncio.get_running_loop()), name)
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients[key] = factory()
+    return client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    return _loop_client("http", _async_http_client)
+
+
+def get_async_groq_client() -> AsyncGroq:
+    return _loop_client(
+        "groq",
+        lambda: AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            timeout=_timeout(),
+            http_client=_async_http_client(),
+        ),
+    )
+
+
+async def close_async_clients() -> None:
+    """Закрывает асинхронные клиенты текущего event loop (при остановке шлюза)."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _async_clients if key[0] == loop_id]:
+        client = _async_clients.pop(key)
+        # У httpx.AsyncClient метод закрытия называется aclose, у AsyncGroq — close
+        await (client.aclose() if isinstance(client, httpx.AsyncClient) else client.close())
+
+
+def stats() -> Dict[str, Any]:
+    result: Dict[str, Any] = {"pid": os.getpid(), "http2": _http2_enabled()}
+
+    requests_total = _counters["requests"]
+    opened = _counters["connections_opened"]
+    result["httpx"] = {
+        "requests": requests_total,
+        "connections_opened": opened,
+        "reuse_rate": 1 - opened / requests_total if requests_total else 0.0,
+    }
+
+    if _yandex_session is not None:
+        requests_total = opened = 0
+        adapter = _yandex_session.get_adapter("https://")
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            requests_total += pool.num_requests
+            opened += pool.num_connections
+        result["yandex"] = {
+            "requests": requests_total,
+            "connections_opened": opened,
+            "reuse_rate": 1 - opened / requests_total if requests_total else 0.0,
+        }
+    return result
@@ -0,0 +1,297 @@
+"""Асинхронный шлюз LLM.
+
+Обслуживает /ask и /ask_stream с тем же контрактом, что и Flask-приложение,
+но ожидание ответа провайдера не занимает поток gunicorn: сотни чатов
+могут одновременно ждать upstream в одном event loop. Пользователь
+определяется по cookie сессии Flask, поэтому приложению и шлюзу нужен общий
+SECRET_KEY. Браузер обращается к шлюзу, если задан LLM_GATEWAY_URL.
+
+Запуск::
+
+    python -m aiohttp.web -H 0.0.0.0 -P 8080 llm_gateway:init_app
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Optional
+
+from aiohttp import web
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+import admission
+import db
+import llm_cache
+import llm_router
+import logging_setup
+import metrics
+import migrations
+from cache import TTLCache
+from chat_store import save_assistant_message, save_user_message_and_get_context, sse_event
+from configs import (DATABASE, GATEWAY_ALLOWED_ORIGINS, METRICS_ENABLED, SECRET_KEY,
+                     USER_CACHE_SIZE, USER_CACHE_TTL)
+from llm_clients import StreamInterrupted, close_async_clients
+
+logger = logging.getLogger(__name__)
+
+# Имена пользователей по id: проверка существования без запроса к SQLite на каждый вызов
+usernames = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+metrics.watch_cache("gateway_user", usernames)
+
+
+def _session_interface() -> tuple:
+    flask_app = Flask(__name__)
+    flask_app.secret_key = SECRET_KEY
+    interface = SecureCookieSessionInterface()
+    return (
+        interface.get_signing_serializer(flask_app),
+        flask_app.config['SESSION_COOKIE_NAME'],
+        int(flask_app.permanent_session_lifetime.total_seconds()),
+    )
+
+
+def _load_username(user_id: int) -> Optional[str]:
+    with db.connection() as conn:
+        row = conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()
+    return row['username'] if row else None
+
+
+async def authenticate(request: web.Request) -> Optional[int]:
+    serializer, cookie_name, max_age = request.app['session']
+    cookie = request.cookies.get(cookie_name)
+    if not cookie:
+        return None
+    try:
+        session = serializer.loads(cookie, max_age=max_age)
+        user_id = int(session['_user_id'])
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+    if usernames.get(user_id) is None:
+        username = await asyncio.to_thread(_load_username, user_id)
+        if username is None:
+            return None
+        usernames.set(user_id, username)
+    return user_id
+
+
+async def parse_ask_request(request: web.Request) -> tuple:
+    # Простую форму или text/plain браузер отправит с чужого сайта без preflight
+    if request.content_type != 'application/json':
+        raise web.HTTPUnsupportedMediaType(
+            text=json.dumps({"response": "Content-Type must be application/json"}),
+            content_type='application/json',
+        )
+    data = await request.json()
+    return (
+        data.get('message'),
+        data.get('model', 'yandex'),
+        float(data.get('temperature', 0.7)),
+        int(data.get('max_tokens', 2000)),
+    )
+
+
+async def get_assistant_response(context: list, model_key: str, temperature: float,
+                                 max_tokens: int) -> tuple:
+    cached = await asyncio.to_thread(llm_cache.lookup, model_key, context, temperature, max_tokens)
+    if cached:
+        return cached
+
+    assistant_response, tokens, answered_by = await llm_router.aroute(
+        context, model_key, temperature, max_tokens
+    )
+
+    # Ответ запасной модели не кешируем под ключом запрошенной
+    if assistant_response and answered_by == model_key:
+        await asyncio.to_thread(
+            llm_cache.store, model_key, context, temperature, max_tokens, assistant_response, tokens
+        )
+    return assistant_response, tokens
+
+
+def too_many_requests(e: admission.AdmissionRejected) -> web.Response:
+    return web.json_response(
+        {"response": e.message}, status=429, headers={'Retry-After': str(e.retry_after)}
+    )
+
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def ask(request: web.Request) -> web.Response:
+    user_id = await authenticate(request)
+    if user_id is None:
+        return web.json_response({"response": "Unauthorized"}, status=401)
+    try:
+        user_message, model_key, temperature, max_tokens = await parse_ask_request(request)
+
+        logger.info("Gateway chat request", extra={"user_id": user_id, "model": model_key})
+
+        if not user_message:
+            return web.json_response({"response": "Message cannot be empty"}, status=400)
+
+        slot = await admission.aacquire(user_id, model_key)
+        try:
+            context = await asyncio.to_thread(
+                save_user_message_and_get_context, user_id, user_message, model_key, max_tokens
+            )
+
+            assistant_response, tokens = await get_assistant_response(
+                context, model_key, temperature, max_tokens
+            )
+        finally:
+            await asyncio.to_thread(admission.release, slot)
+
+        if assistant_response:
+            await asyncio.to_thread(save_assistant_message, user_id, assistant_response, model_key)
+            return web.json_response({"response": assistant_response})
+        return web.json_response({"response": "Извините, не удалось получить ответ."}, status=500)
+
+    except admission.AdmissionRejected as e:
+        return too_many_requests(e)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in gateway ask: %s", e, exc_info=True)
+        return web.json_response({"response": f"Произошла ошибка: {str(e)}"}, status=500)
+
+
+async def ask_stream(request: web.Request) -> web.StreamResponse:
+    user_id = await authenticate(request)
+    if user_id is None:
+        return web.json_response({"response": "Unauthorized"}, status=401)
+    try:
+        user_message, model_key, temperature, max_tokens = await parse_ask_request(request)
+    except (AttributeError, TypeError, ValueError):
+        return web.json_response({"response": "Invalid request"}, status=400)
+    if not user_message:
+        return web.json_response({"response": "Message cannot be empty"}, status=400)
+
+    logger.info("Gateway chat stream request", extra={"user_id": user_id, "model": model_key})
+    try:
+        slot = await admission.aacquire(user_id, model_key)
+    except admission.AdmissionRejected as e:
+        return too_many_requests(e)
+    try:
+        return await _stream_answer(
+            request, user_id, user_message, model_key, temperature, max_tokens
+        )
+    finally:
+        await asyncio.to_thread(admission.release, slot)
+
+
+async def _stream_answer(request: web.Request, user_id: int, user_message: str, model_key: str,
+                         temperature: float, max_tokens: int) -> web.StreamResponse:
+    context = await asyncio.to_thread(
+        save_user_message_and_get_context, user_id, user_message, model_key, max_tokens
+    )
+
+    route_info = {}
+    cached = await asyncio.to_thread(llm_cache.lookup, model_key, context, temperature, max_tokens)
+    if cached:
+        # Ответ из кеша отдаём одним событием
+        chunks = _single_chunk(cached[0])
+    else:
+        chunks = llm_router.astream(
+            context, model_key, temperature, max_tokens, route_info=route_info
+        )
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            await response.write(sse_event('token', {"text": chunk}).encode())
+        assistant_response = ''.join(parts)
+        if assistant_response:
+            # В историю попадает только полностью полученный ответ
+            await asyncio.to_thread(save_assistant_message, user_id, assistant_response, model_key)
+            if route_info.get("model") == model_key:
+                await asyncio.to_thread(
+                    llm_cache.store, model_key, context, temperature, max_tokens, assistant_response
+                )
+            await response.write(sse_event('done', {"response": assistant_response}).encode())
+        else:
+            await response.write(
+                sse_event('error', {"response": "Извините, не удалось получить ответ."}).encode()
+            )
+    except StreamInterrupted as e:
+        # Неполный ответ не сохраняем и не кешируем
+        logger.warning("Interrupted gateway stream: %s", e)
+        await response.write(
+            sse_event('error', {"response": "Ответ модели оборвался, попробуйте ещё раз."}).encode()
+        )
+    except ConnectionResetError:
+        logger.info("Client disconnected from gateway stream")
+    finally:
+        # При отключении клиента aiohttp отменяет задачу; закрываем и запрос к провайдеру
+        await chunks.aclose()
+    return response
+
+
+async def preflight(request: web.Request) -> web.Response:
+    allowed = request.headers.get('Origin') in GATEWAY_ALLOWED_ORIGINS
+    return web.Response(status=204 if allowed else 403)
+
+
+async def add_cors_headers(request: web.Request, response: web.StreamResponse) -> None:
+    # Сигнал срабатывает до отправки заголовков, в том числе для потоковых ответов
+    origin = request.headers.get('Origin')
+    if origin in GATEWAY_ALLOWED_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Expose-Headers'] = 'Retry-After'
+        response.headers['Vary'] = 'Origin'
+
+
+@web.middleware
+async def record_metrics(request: web.Request, handler) -> web.StreamResponse:
+    # Обработчик потока возвращается после отправки последнего события
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "<unmatched>"
+        metrics.observe_request(request.method, route, status, time.perf_counter() - started,
+                                server="gateway")
+
+
+async def close_clients(app: web.Application) -> None:
+    await close_async_clients()
+
+
+def init_app(argv: Optional[list] = None) -> web.Application:
+    if not SECRET_KEY:
+        raise EnvironmentError("SECRET_KEY must be set to share sessions with the Flask app")
+    logging_setup.setup_logging()
+    # Шлюз может стартовать раньше Flask-приложения, поэтому схему доводит сам
+    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
+    logger.info("Database schema version: %s", migrations.migrate())
+    metrics.install()
+    app = web.Application(middlewares=[record_metrics] if METRICS_ENABLED else [])
+    app['session'] = _session_interface()
+    app.on_response_prepare.append(add_cors_headers)
+    app.on_cleanup.append(close_clients)
+    for path, handler in (('/ask', ask), ('/ask_stream', ask_stream)):
+        app.router.add_post(path, handler)
+        app.router.add_route('OPTIONS', path, preflight)
+    return app
@@ -0,0 +1,386 @@
+"""Маршрутизация запросов к моделям LLM.
+
+Для каждой модели в процессе ведётся скользящее окно задержек и ошибок.
+Запрос идёт по цепочке: запрошенная модель, затем запасные из
+``LLM_FALLBACK_CHAINS``; модели с высокой долей ошибок пробуются последними.
+При ``LLM_HEDGE_ENABLED`` следующая модель цепочки запрашивается
+параллельно, если текущая не ответила за p95 своей задержки, и берётся
+первый успешный ответ.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+from configs import (LLM_FALLBACK_CHAINS, LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_ENABLED,
+                     LLM_HEDGE_MIN_DELAY, LLM_ROUTER_MAX_ERROR_RATE, LLM_ROUTER_MAX_WORKERS,
+                     LLM_ROUTER_MIN_SAMPLES, LLM_ROUTER_WINDOW, LLM_ROUTER_WINDOW_SECONDS)
+from groq_llm import (GROQ_MODELS, _aget_response_groq, _astream_response_groq,
+                      _get_response_groq, _stream_response_groq)
+from llm_clients import StreamInterrupted
+from yandex_gpt import (_aget_response_yandex_gpt, _astream_response_yandex_gpt,
+                        _get_response_yandex_gpt, _stream_response_yandex_gpt)
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStats:
+    """Последние вызовы модели: (время, задержка или None для потоков, успех)."""
+
+    def __init__(self, maxlen: int = LLM_ROUTER_WINDOW,
+                 max_age: float = LLM_ROUTER_WINDOW_SECONDS):
+        self.samples: Deque[Tuple[float, Optional[float], bool]] = deque(maxlen=maxlen)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+    def record(self, latency: Optional[float], ok: bool) -> None:
+        with self.lock:
+            self.samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self) -> List[Tuple[float, Optional[float], bool]]:
+        # Старые замеры выпадают, чтобы восстановившаяся модель снова получала запросы
+        cutoff = time.monotonic() - self.max_age
+        with self.lock:
+            while self.samples and self.samples[0][0] < cutoff:
+                self.samples.popleft()
+            return list(self.samples)
+
+    def error_rate(self) -> Optional[float]:
+        samples = self._recent()
+        if len(samples) < LLM_ROUTER_MIN_SAMPLES:
+            return None
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(
+            latency for _, latency, ok in self._recent() if ok and latency is not None
+        )
+        if len(latencies) < LLM_ROUTER_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self._recent()),
+            "error_rate": self.error_rate(),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+_stats: Dict[str, ModelStats] = {}
+_stats_lock = threading.Lock()
+_counters = {
+    "requests": 0,
+    "fallbacks": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "failures": 0,
+}
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+
+def model_stats(model_key: str) -> ModelStats:
+    stats = _stats.get(model_key)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.setdefault(model_key, ModelStats())
+    return stats
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Потоки не переживают fork, поэтому пул создаётся заново в каждом воркере
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(
+            max_workers=LLM_ROUTER_MAX_WORKERS, thread_name_prefix="llm-router"
+        )
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _provider_key(model_key: str) -> str:
+    return model_key if model_key in GROQ_MODELS else "yandex"
+
+
+def plan(model_key: str) -> List[str]:
+    """Порядок опроса моделей: сначала здоровые, затем остальные."""
+    primary = _provider_key(model_key)
+    candidates: List[str] = []
+    for candidate in [primary] + LLM_FALLBACK_CHAINS.get(primary, []):
+        candidate = _provider_key(candidate)
+        if candidate not in candidates:
+            candidates.append(candidate)
+
+    def unhealthy(candidate: str) -> bool:
+        rate = model_stats(candidate).error_rate()
+        return rate is not None and rate > LLM_ROUTER_MAX_ERROR_RATE
+
+    return [c for c in candidates if not unhealthy(c)] + [c for c in candidates if unhealthy(c)]
+
+
+def hedge_delay(model_key: str) -> float:
+    p95 = model_stats(model_key).percentile(0.95)
+    if p95 is None:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(p95, LLM_HEDGE_MIN_DELAY)
+
+
+def _observe(model_key: str, mode: str, started: float, ok: bool, tokens: Any = None) -> None:
+    # Проигравший хедж-запрос тоже учитывается: его токены оплачены
+    outcome = "ok" if ok else "error"
+    metrics.observe("llm_request_duration_seconds", time.monotonic() - started,
+                    model=model_key, mode=mode, outcome=outcome)
+    metrics.inc("llm_requests_total", model=model_key, mode=mode, outcome=outcome)
+    if tokens:
+        metrics.inc("llm_tokens_total", int(tokens), model=model_key)
+
+
+def _call(model_key: str, context: list, temperature: float, max_tokens: int) -> tuple:
+    started = time.monotonic()
+    if model_key in GROQ_MODELS:
+        response, tokens = _get_response_groq(
+            context, temperature=temperature, max_tokens=max_tokens, model=GROQ_MODELS[model_key]
+        )
+    else:
+        response, tokens = _get_response_yandex_gpt(
+            context, temperature=temperature, max_tokens=max_tokens
+        )
+    model_stats(model_key).record(time.monotonic() - started, bool(response))
+    _observe(model_key, "complete", started, bool(response), tokens)
+    return response, tokens
+
+
+async def _acall(model_key: str, context: list, temperature: float, max_tokens: int) -> tuple:
+    started = time.monotonic()
+    if model_key in GROQ_MODELS:
+        response, tokens = await _aget_response_groq(
+            context, temperature=temperature, max_tokens=max_tokens, model=GROQ_MODELS[model_key]
+        )
+    else:
+        response, tokens = await _aget_response_yandex_gpt(
+            context, temperature=temperature, max_tokens=max_tokens
+        )
+    model_stats(model_key).record(time.monotonic() - started, bool(response))
+    _observe(model_key, "complete", started, bool(response), tokens)
+    return response, tokens
+
+
+def _finish(requested: str, model_key: Optional[str], hedged: bool) -> None:
+    if model_key is None:
+        _counters["failures"] += 1
+        logger.error("All models failed for %s", requested)
+    elif model_key != _provider_key(requested):
+        _counters["fallbacks"] += 1
+        logger.warning("Answered by %s instead of %s", model_key, requested)
+    if hedged and model_key is not None:
+        _counters["hedge_wins"] += 1
+
+
+def route(context: list, model_key: str, temperature: float, max_tokens: int) -> tuple:
+    """Возвращает (ответ, токены, модель, которая ответила)."""
+    _counters["requests"] += 1
+    untried = deque(plan(model_key))
+
+    if not LLM_HEDGE_ENABLED:
+        # Без хеджирования модели опрашиваются по очереди прямо в потоке запроса
+        while untried:
+            candidate = untried.popleft()
+            response, tokens = _call(candidate, context, temperature, max_tokens)
+            if response:
+                _finish(model_key, candidate, False)
+                return response, tokens, candidate
+        _finish(model_key, None, False)
+        return None, None, None
+
+    executor = _get_executor()
+    pending: Dict[Future, Tuple[str, float, bool]] = {}
+
+    def launch(hedged: bool) -> None:
+        candidate = untried.popleft()
+        future = executor.submit(_call, candidate, context, temperature, max_tokens)
+        pending[future] = (candidate, time.monotonic(), hedged)
+
+    launch(False)
+    while pending:
+        timeout = None
+        if untried and len(pending) == 1:
+            candidate, started, _ = next(iter(pending.values()))
+            timeout = max(0.0, hedge_delay(candidate) - (time.monotonic() - started))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            _counters["hedges"] += 1
+            launch(True)
+            continue
+        for future in done:
+            candidate, _, hedged = pending.pop(future)
+            response, tokens = future.result()
+            if response:
+                # Проигравший запрос дорабатывает в фоне и только пополняет статистику
+                _finish(model_key, candidate, hedged)
+                return response, tokens, candidate
+        if not pending and untried:
+            launch(False)
+    _finish(model_key, None, False)
+    return None, None, None
+
+
+async def aroute(context: list, model_key: str, temperature: float, max_tokens: int) -> tuple:
+    """Асинхронный вариант route для шлюза; проигравший запрос отменяется."""
+    _counters["requests"] += 1
+    untried = deque(plan(model_key))
+    pending: Dict[asyncio.Task, Tuple[str, float, bool]] = {}
+
+    def launch(hedged: bool) -> None:
+        candidate = untried.popleft()
+        task = asyncio.create_task(_acall(candidate, context, temperature, max_tokens))
+        pending[task] = (candidate, time.monotonic(), hedged)
+
+    launch(False)
+    try:
+        while pending:
+            timeout = None
+            if LLM_HEDGE_ENABLED and untried and len(pending) == 1:
+                candidate, started, _ = next(iter(pending.values()))
+                timeout = max(0.0, hedge_delay(candidate) - (time.monotonic() - started))
+            done, _ = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                _counters["hedges"] += 1
+                launch(True)
+                continue
+            for task in done:
+                candidate, _, hedged = pending.pop(task)
+                response, tokens = task.result()
+                if response:
+                    _finish(model_key, candidate, hedged)
+                    return response, tokens, candidate
+            if not pending and untried:
+                launch(False)
+    finally:
+        for task in pending:
+            task.cancel()
+    _finish(model_key, None, False)
+    return None, None, None
+
+
+def _open_stream(model_key: str, context: list, temperature: float, max_tokens: int,
+                 usage: dict) -> Iterator[str]:
+    if model_key in GROQ_MODELS:
+        return _stream_response_groq(
+            context, temperature=temperature, max_tokens=max_tokens, model=GROQ_MODELS[model_key],
+            usage=usage,
+        )
+    return _stream_response_yandex_gpt(
+        context, temperature=temperature, max_tokens=max_tokens, usage=usage
+    )
+
+
+def _aopen_stream(model_key: str, context: list, temperature: float, max_tokens: int,
+                  usage: dict) -> AsyncIterator[str]:
+    if model_key in GROQ_MODELS:
+        return _astream_response_groq(
+            context, temperature=temperature, max_tokens=max_tokens, model=GROQ_MODELS[model_key],
+            usage=usage,
+        )
+    return _astream_response_yandex_gpt(
+        context, temperature=temperature, max_tokens=max_tokens, usage=usage
+    )
+
+
+def stream(context: list, model_key: str, temperature: float, max_tokens: int,
+           route_info: Optional[dict] = None) -> Iterator[str]:
+    """Потоковый ответ с переходом на запасную модель, пока не пришёл первый токен.
+
+    После первого токена модель уже не меняется. Ответившая модель
+    записывается в ``route_info["model"]``.
+    """
+    _counters["requests"] += 1
+    for candidate in plan(model_key):
+        usage: dict = {}
+        started = time.monotonic()
+        chunks = _open_stream(candidate, context, temperature, max_tokens, usage)
+        first = None
+        interrupted = False
+        try:
+            first = next(chunks, None)
+            # Задержка потока (время до первого токена) не смешивается с задержкой /ask
+            model_stats(candidate).record(None, first is not None)
+            if first is None:
+                continue
+            metrics.observe("llm_time_to_first_token_seconds", time.monotonic() - started,
+                            model=candidate)
+            _finish(model_key, candidate, False)
+            if route_info is not None:
+                route_info["model"] = candidate
+            yield first
+            yield from chunks
+            return
+        except StreamInterrupted:
+            # Обрыв на стороне провайдера: ответ неполный, вызывающий код сообщит об ошибке
+            interrupted = True
+            raise
+        finally:
+            chunks.close()
+            # Оборванный клиентом поток считается успешным: модель ответила
+            _observe(candidate, "stream", started, first is not None and not interrupted,
+                     usage.get("total_tokens"))
+    _finish(model_key, None, False)
+
+
+async def astream(context: list, model_key: str, temperature: float, max_tokens: int,
+                  route_info: Optional[dict] = None) -> AsyncIterator[str]:
+    """Асинхронный вариант stream."""
+    _counters["requests"] += 1
+    for candidate in plan(model_key):
+        usage: dict = {}
+        started = time.monotonic()
+        chunks = _aopen_stream(candidate, context, temperature, max_tokens, usage)
+        first = None
+        interrupted = False
+        try:
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            model_stats(candidate).record(None, first is not None)
+            if first is None:
+                continue
+            metrics.observe("llm_time_to_first_token_seconds", time.monotonic() - started,
+                            model=candidate)
+            _finish(model_key, candidate, False)
+            if route_info is not None:
+                route_info["model"] = candidate
+            yield first
+            async for chunk in chunks:
+                yield chunk
+            return
+        except StreamInterrupted:
+            interrupted = True
+            raise
+        finally:
+            await chunks.aclose()
+            _observe(candidate, "stream", started, first is not None and not interrupted,
+                     usage.get("total_tokens"))
+    _finish(model_key, None, False)
+
+
+def counters() -> Dict[str, int]:
+    return dict(_counters)
+
+
+metrics.watch_counters("llm_router_events_total", counters)
+
+
+def stats() -> Dict[str, Any]:
+    result: Dict[str, Any] = dict(_counters)
+    result["hedging"] = LLM_HEDGE_ENABLED
+    result["models"] = {model_key: model_stats(model_key).snapshot() for model_key in list(_stats)}
+    return result
@@ -0,0 +1,205 @@
+"""Неблокирующее структурированное логирование.
+
+``setup_logging`` ставит на корневой логгер обработчик, который только кладёт
+запись в ограниченную очередь. Подстановка аргументов, сборка JSON и запись
+в поток выполняются отдельным потоком ``QueueListener``, поэтому запрос не
+ждёт ни форматирования, ни диска. Если очередь полна, запись отбрасывается и
+учитывается в метрике ``log_events_total{event="dropped"}``.
+
+Сообщения пишутся с аргументами (``logger.info("... %s", value)``), а не
+f-строками: при отключённом уровне строка не собирается вовсе. Аргументы
+форматируются позже в другом потоке, поэтому изменяемые объекты, которые
+запрос ещё будет менять, передавать нельзя.
+
+Запросы и ответы LLM целиком попадают в лог только через ``sample_payload``:
+для доли вызовов, с обрезкой и без текста сообщений пользователя.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+import metrics
+from configs import (LOG_FORMAT, LOG_LEVEL, LOG_MAX_MESSAGE_CHARS, LOG_PAYLOAD_MAX_CHARS,
+                     LOG_PAYLOAD_SAMPLE_RATE, LOG_QUEUE_SIZE, LOG_REDACT_CONTENT)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Ключи с текстом пользователя и модели в запросах и ответах YandexGPT и Groq
+REDACTED_KEYS = {"text", "content", "message", "response", "system_prompt"}
+# Поля, которые есть у любой записи; остальные пришли через extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName"
+}
+
+_counters = {"dropped": 0, "sampled_payloads": 0}
+_counters_lock = threading.Lock()
+_handler: Optional["NonBlockingQueueHandler"] = None
+_listener: Optional[QueueListener] = None
+
+
+def _count(event: str) -> None:
+    with _counters_lock:
+        _counters[event] += 1
+
+
+def counters() -> Dict[str, int]:
+    with _counters_lock:
+        return dict(_counters)
+
+
+metrics.watch_counters("log_events_total", counters)
+
+
+def truncate(text: str, limit: int = LOG_MAX_MESSAGE_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def redact(value: Any) -> Any:
+    """Копия запроса или ответа, где тексты сообщений заменены их длиной."""
+    if isinstance(value, dict):
+        return {
+            key: f"<{len(item)} chars>" if key in REDACTED_KEYS and isinstance(item, str)
+            else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def _redact_text(text: str) -> Any:
+    """Редактирует сырое тело ответа: JSON — как redact, иначе только длина."""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return f"<{len(text)} chars>"
+    return redact(value) if isinstance(value, (dict, list)) else f"<{len(text)} chars>"
+
+
+class Preview:
+    """Откладывает сериализацию и обрезку значения до записи в лог."""
+
+    def __init__(self, value: Any, limit: int = LOG_PAYLOAD_MAX_CHARS) -> None:
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        value = self.value
+        if LOG_REDACT_CONTENT:
+            value = _redact_text(value) if isinstance(value, str) else redact(value)
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        return truncate(value, self.limit)
+
+
+def sample_payload(logger: logging.Logger, label: str, payload: Any, **fields: Any) -> None:
+    """Пишет запрос или ответ LLM для доли LOG_PAYLOAD_SAMPLE_RATE вызовов.
+
+    ``fields`` попадают в запись отдельными полями, как ``extra``.
+    """
+    if LOG_PAYLOAD_SAMPLE_RATE <= 0 or random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    _count("sampled_payloads")
+    # Содержимое копируется сейчас: словарь запроса может измениться до записи
+    logger.info("%s payload: %s", label, str(Preview(payload)), extra=fields)
+
+
+def _extra(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in record.__dict__.items()
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_")}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        entry.update(_extra(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        fields = "".join(f" {key}={value}" for key, value in _extra(record).items())
+        record.message = truncate(record.message) + fields
+        return super().formatMessage(record)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Кладёт запись в очередь без форматирования и без ожидания места."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler.prepare собирает сообщение в потоке запроса; здесь это делает слушатель
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count("dropped")
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "text":
+        return TextFormatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    return JsonFormatter()
+
+
+def _start_listener(output: logging.Handler) -> None:
+    global _listener
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    # Поток слушателя не переживает fork, а блокировка очереди могла остаться захваченной
+    if _listener is not None:
+        _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _start_listener(_listener.handlers[0])
+
+
+def _stop_listener() -> None:
+    # Дописываем то, что осталось в очереди
+    if _listener is not None:
+        _listener.stop()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def setup_logging(level: str = LOG_LEVEL) -> None:
+    """Направляет корневой логгер через очередь; повторный вызов ничего не меняет."""
+    global _handler
+    if _handler is not None:
+        return
+    output = logging.StreamHandler()
+    output.setFormatter(_formatter())
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _start_listener(output)
+    atexit.register(_stop_listener)
@@ -0,0 +1,328 @@
+"""Метрики в формате Prometheus, общие для всех воркеров.
+
+Каждый процесс (воркеры gunicorn и шлюз LLM) копит в памяти только
+приращения счётчиков и гистограмм с последнего сброса. Фоновый поток раз в
+``METRICS_FLUSH_INTERVAL`` секунд прибавляет их к таблице ``metrics``
+(миграция 15) одной транзакцией, а ``render()`` читает из неё сумму по всем
+процессам. Поэтому ответ /metrics не зависит от того, какой воркер его
+отдал, а перезапуск воркера не обнуляет счётчики; теряется не больше
+одного интервала данных упавшего процесса.
+
+Счётчики, которые модули уже ведут сами (кеши, пул соединений, допуск к
+LLM), подключаются через ``watch``: при сбросе берётся разница с прошлым
+значением.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+
+import db
+import profiler
+from configs import METRICS_ENABLED, METRICS_FLUSH_INTERVAL, PROFILE_SLOW_MS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+# Семейства метрик: (тип, описание, границы корзин для гистограмм)
+FAMILIES: Dict[str, Tuple[str, str, Sequence[float]]] = {
+    "http_request_duration_seconds": (
+        "histogram", "Request latency by route, until the response body is sent",
+        LATENCY_BUCKETS),
+    "http_requests_total": ("counter", "Requests by route and status code", ()),
+    "http_slow_requests_total": ("counter", "Requests slower than PROFILE_SLOW_MS", ()),
+    "db_query_duration_seconds": ("histogram", "SQLite statement execution time", DB_BUCKETS),
+    "db_queries_total": ("counter", "SQLite statements executed, by statement", ()),
+    "db_query_seconds_total": ("counter", "SQLite execution time, by statement", ()),
+    "db_pool_wait_seconds": (
+        "histogram", "Time to get a connection from the pool", DB_BUCKETS),
+    "db_pool_events_total": ("counter", "Connection pool events", ()),
+    "llm_request_duration_seconds": (
+        "histogram", "LLM call latency by model, full answer", LLM_BUCKETS),
+    "llm_time_to_first_token_seconds": (
+        "histogram", "Time to the first streamed token by model", LLM_BUCKETS),
+    "llm_requests_total": ("counter", "LLM calls by model, mode and outcome", ()),
+    "llm_tokens_total": ("counter", "Tokens reported by the provider, by model", ()),
+    "llm_router_events_total": ("counter", "Fallbacks, hedges and failures of the router", ()),
+    "admission_events_total": ("counter", "LLM admission decisions", ()),
+    "cache_events_total": ("counter", "In-process and LLM cache lookups and evictions", ()),
+    "http_cache_events_total": ("counter", "Conditional GET and compression events", ()),
+    "http_compression_bytes_total": ("counter", "Body bytes before and after compression", ()),
+    "log_events_total": ("counter", "Log records dropped on a full queue and sampled payloads", ()),
+}
+SUFFIXES = ("_bucket", "_sum", "_count")
+
+Labels = Tuple[Tuple[str, str], ...]
+Collector = Callable[[], Dict[Tuple[str, Labels], float]]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+# Приращения гистограмм: (счётчики по корзинам, сумма, количество)
+_histograms: Dict[Tuple[str, Labels], List] = {}
+_collectors: List[Collector] = []
+_collected: Dict[Tuple[str, Labels], float] = {}
+_flusher_pid: Optional[int] = None
+
+
+def _reset_after_fork() -> None:
+    # Несброшенные приращения родителя сбросит сам родитель
+    global _lock, _flusher_pid
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _flusher_pid = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(family: str, value: float = 1, **labels: object) -> None:
+    if not METRICS_ENABLED:
+        return
+    key = (family, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _ensure_flusher()
+
+
+def observe(family: str, value: float, **labels: object) -> None:
+    if not METRICS_ENABLED:
+        return
+    buckets = FAMILIES[family][2]
+    key = (family, _labels(labels))
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        # Последняя корзина — +Inf
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+    _ensure_flusher()
+
+
+def watch(collector: Collector) -> None:
+    """Подключает накопительные счётчики процесса: {(семейство, метки): значение}."""
+    _collectors.append(collector)
+
+
+def counter_samples(family: str, values: Dict[str, float], label: str = "event",
+                    **labels: object) -> Dict[Tuple[str, Labels], float]:
+    """Словарь счётчиков модуля в формате collector: ключ словаря становится меткой."""
+    return {(family, _labels({**labels, label: key})): value for key, value in values.items()}
+
+
+def watch_counters(family: str, counters: Callable[[], Dict[str, float]],
+                   label: str = "event", **labels: object) -> None:
+    """Подключает функцию, которая возвращает словарь счётчиков модуля."""
+    watch(lambda: counter_samples(family, counters(), label, **labels))
+
+
+CACHE_EVENTS = ("hits", "misses", "evictions", "expirations", "invalidations")
+POOL_EVENTS = ("connections_created", "connections_discarded", "acquired", "reused", "waits",
+               "timeouts")
+
+
+def watch_cache(name: str, cache) -> None:
+    """Подключает счётчики TTLCache; доля попаданий считается в Prometheus по hits и misses."""
+    watch_counters("cache_events_total",
+                   lambda: {event: getattr(cache, event) for event in CACHE_EVENTS}, cache=name)
+
+
+# Число подставленных значений в IN (...) и VALUES не должно порождать новые метки
+_placeholders = re.compile(r"\?(?:\s*,\s*\?)+")
+_spaces = re.compile(r"\s+")
+STATEMENT_MAX_LENGTH = 200
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    statement = _placeholders.sub("?, ...", _spaces.sub(" ", sql).strip())
+    return statement[:STATEMENT_MAX_LENGTH]
+
+
+class _DatabaseObserver:
+    def query(self, sql: str, seconds: float) -> None:
+        statement = statement_label(sql)
+        inc("db_queries_total", statement=statement)
+        inc("db_query_seconds_total", seconds, statement=statement)
+        observe("db_query_duration_seconds", seconds)
+
+    def pool_wait(self, seconds: float) -> None:
+        observe("db_pool_wait_seconds", seconds)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float,
+                    server: str = "app") -> None:
+    # server отличает /ask шлюза от /ask Flask-приложения
+    observe("http_request_duration_seconds", seconds, server=server, method=method, route=route)
+    inc("http_requests_total", server=server, method=method, route=route, status=status)
+    if seconds * 1000 >= PROFILE_SLOW_MS:
+        inc("http_slow_requests_total", server=server, method=method, route=route)
+
+
+def _start_request() -> None:
+    g.metrics_started = time.perf_counter()
+    g.profile = profiler.start()
+
+
+def _finish_request(response: Response) -> Response:
+    started = g.get("metrics_started")
+    if started is None:
+        return response
+    # Шаблон маршрута, а не путь: иначе каждый id карточки стал бы отдельной меткой
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    method, status, profile = request.method, response.status_code, g.get("profile")
+
+    def record() -> None:
+        # Потоковые ответы закрываются после отправки тела, так что время включает и его
+        seconds = time.perf_counter() - started
+        observe_request(method, route, status, seconds)
+        if profile is not None:
+            profiler.stop(profile, f"{method} {route}", seconds)
+
+    response.call_on_close(record)
+    return response
+
+
+def init_app(app: Flask) -> None:
+    install()
+    if METRICS_ENABLED:
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
+
+
+def _take() -> List[Tuple[str, str, float]]:
+    """Забирает накопленные приращения в виде строк (имя, метки JSON, значение)."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: [list(state[0]), state[1], state[2]]
+                      for key, state in _histograms.items()}
+        _counters.clear()
+        _histograms.clear()
+    for collector in _collectors:
+        try:
+            current = collector()
+        except Exception as e:
+            logger.warning("Metrics collector failed: %s", e)
+            continue
+        for key, value in current.items():
+            delta = value - _collected.get(key, 0)
+            _collected[key] = value
+            if delta > 0:
+                counters[key] = counters.get(key, 0) + delta
+
+    rows = [(family, json.dumps(dict(labels)), value)
+            for (family, labels), value in counters.items()]
+    for (family, labels), (counts, total, count) in histograms.items():
+        cumulative = 0
+        for bound, bucket_count in zip(list(FAMILIES[family][2]) + [math.inf], counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == math.inf else repr(bound)
+            rows.append((f"{family}_bucket", json.dumps({**dict(labels), "le": le}), cumulative))
+        rows.append((f"{family}_sum", json.dumps(dict(labels)), total))
+        rows.append((f"{family}_count", json.dumps(dict(labels)), count))
+    return rows
+
+
+def flush() -> None:
+    rows = _take()
+    if not rows:
+        return
+    try:
+        with db.connection() as conn:
+            conn.executemany(
+                '''INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)
+                ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value''',
+                rows
+            )
+    except Exception as e:
+        # Метрики не должны ломать запросы: приращения этого интервала теряются
+        logger.warning("Failed to flush %d metric samples: %s", len(rows), e)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_flusher() -> None:
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def install() -> None:
+    """Включает замеры запросов к SQLite и сброс метрик при выходе процесса."""
+    if METRICS_ENABLED:
+        db.set_observer(_DatabaseObserver())
+        watch_counters("db_pool_events_total",
+                       lambda: {event: db.pool_stats()[event] for event in POOL_EVENTS})
+        atexit.register(flush)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _family(name: str) -> str:
+    for suffix in SUFFIXES:
+        base = name[:-len(suffix)]
+        if name.endswith(suffix) and FAMILIES.get(base, ("",))[0] == "histogram":
+            return base
+    return name
+
+
+def _sample_order(sample: Tuple[str, Dict[str, str], float]) -> tuple:
+    name, labels, _ = sample
+    rest = sorted((key, value) for key, value in labels.items() if key != "le")
+    le = labels.get("le")
+    # Корзины гистограммы идут по возрастанию границы, затем _count и _sum
+    return (rest, name.endswith("_bucket") is False, float(le) if le else 0.0, name)
+
+
+def render() -> str:
+    """Текст для /metrics: сумма приращений всех процессов, включая текущий."""
+    flush()
+    with db.connection() as conn:
+        rows = conn.execute('SELECT name, labels, value FROM metrics').fetchall()
+    families: Dict[str, List[Tuple[str, Dict[str, str], float]]] = {}
+    for name, labels, value in rows:
+        families.setdefault(_family(name), []).append((name, json.loads(labels), value))
+    lines = []
+    for family in sorted(families):
+        kind, description, _ = FAMILIES.get(family, ("untyped", "", ()))
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in sorted(families[family], key=_sample_order):
+            number = int(value) if float(value).is_integer() else value
+            lines.append(f"{name}{_format_labels(labels)} {number}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,900 @@
+"""Версионированные миграции схемы SQLite.
+
+Применённая версия хранится в ``PRAGMA user_version``. Миграция без
+переноса данных выполняется в одной транзакции ``BEGIN IMMEDIATE``, и
+воркеры gunicorn, стартующие одновременно, не применяют её повторно.
+Перенос данных (``batched_update``) идёт пачками по ``MIGRATION_BATCH_SIZE``
+строк с фиксацией после каждой пачки. Между пачками блокировка записи
+отпускается, и другой воркер может начать ту же миграцию, пока
+``user_version`` ещё не обновлён; прерванная миграция тоже повторяется
+целиком при следующем запуске. Поэтому миграции обязаны быть
+идемпотентными.
+
+Запуск вручную::
+
+    python migrations.py          # применить миграции
+    python migrations.py --check  # проверить планы горячих запросов
+"""
+import logging
+import re
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from werkzeug.security import generate_password_hash
+
+import db
+from configs import LEADERBOARD_SIZE, MIGRATION_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+MigrationFunc = Callable[[sqlite3.Connection], None]
+MIGRATIONS: List[Tuple[int, str, MigrationFunc]] = []
+
+# Запросы горячего пути: (SQL, пример параметров). Для каждого из них
+# check_query_plans() требует поиск по индексу без полного сканирования.
+HOT_QUERIES: Dict[str, Tuple[str, Sequence]] = {
+    'load_user': ('SELECT * FROM users WHERE id = ?', (1,)),
+    'login': ('SELECT * FROM users WHERE username = ?', ('admin',)),
+    'visible_cards': ('SELECT * FROM cards WHERE user_id = ? AND is_hidden = 0', (1,)),
+    'cards_page': (
+        '''SELECT id, english_word, russian_word FROM cards
+        WHERE user_id = ? AND is_hidden = 0 AND id > ? ORDER BY id LIMIT ?''',
+        (1, 0, 61),
+    ),
+    'card_by_id': (
+        '''SELECT cards.*, images.variants AS image_variants
+        FROM cards LEFT JOIN images ON images.hash = cards.image_hash
+        WHERE cards.id = ? AND cards.user_id = ?''',
+        (1, 1),
+    ),
+    'card_details': (
+        '''SELECT cards.id, english_word, russian_word, description, transcription,
+        pronunciation_url, image_path, image_hash, version, updated_at,
+        images.variants AS image_variants
+        FROM cards LEFT JOIN images ON images.hash = cards.image_hash
+        WHERE cards.user_id = ? AND cards.id IN (?, ?, ?)''',
+        (1, 1, 2, 3),
+    ),
+    'cards_by_image': ('SELECT id FROM cards WHERE image_hash = ?', ('hash',)),
+    'restore_all': ('UPDATE cards SET is_hidden = 0 WHERE user_id = ?', (1,)),
+    'chat_context': (
+        '''SELECT id, role, message FROM chat_history
+        WHERE user_id = ? AND model = ? ORDER BY id DESC''',
+        (1, 'yandex'),
+    ),
+    'chat_summary': (
+        'SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ? AND model = ?',
+        (1, 'yandex'),
+    ),
+    'chat_history_page': (
+        '''SELECT id, role, message, model FROM chat_history
+        WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?''',
+        (1, 1000, 51),
+    ),
+    'chat_history_model_page': (
+        '''SELECT id, role, message, model FROM chat_history
+        WHERE user_id = ? AND model = ? ORDER BY id DESC LIMIT ?''',
+        (1, 'yandex', 51),
+    ),
+    'chat_history_delta': (
+        '''SELECT id, role, message, model FROM chat_history
+        WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?''',
+        (1, 0, 51),
+    ),
+    'clear_chat_history': ('DELETE FROM chat_history WHERE user_id = ?', (1,)),
+    'llm_rate_bucket': (
+        'SELECT tokens, updated_at FROM llm_rate_buckets WHERE user_id = ?', (1,),
+    ),
+    'llm_slots_active': (
+        '''SELECT user_id, count(*) FROM llm_slots
+        WHERE provider = ? AND expires_at >= ? GROUP BY user_id''',
+        ('groq', 0.0),
+    ),
+    'llm_slots_provider': (
+        'SELECT count(*) FROM llm_slots WHERE provider = ? AND expires_at >= ?', ('groq', 0.0),
+    ),
+    'llm_slots_expired': ('SELECT id FROM llm_slots WHERE expires_at < ?', (0.0,)),
+    'llm_queue': (
+        'SELECT id, user_id, heartbeat FROM llm_queue WHERE provider = ? ORDER BY id',
+        ('groq',),
+    ),
+    'llm_queue_ticket': ('SELECT heartbeat FROM llm_queue WHERE id = ?', (1,)),
+    'llm_queue_stale': ('SELECT id FROM llm_queue WHERE heartbeat < ?', (0.0,)),
+    'word_cache_lookup': (
+        'SELECT word, russian_word, description, transcription FROM word_cache WHERE word IN (?, ?)',
+        ('apple', 'pear'),
+    ),
+    'enrichment_job': (
+        '''SELECT id, status, total, processed, created, skipped, failed, error
+        FROM enrichment_jobs WHERE id = ? AND user_id = ?''',
+        (1, 1),
+    ),
+    'enrichment_active_jobs': (
+        '''SELECT count(*) FROM enrichment_jobs
+        WHERE user_id = ? AND status IN ('queued', 'running') AND updated_at > ?''',
+        (1, '2024-01-01 00:00:00'),
+    ),
+    'cards_export': (
+        '''SELECT id, english_word, russian_word, description, transcription,
+        pronunciation_url
+        FROM cards WHERE user_id = ? AND is_hidden = 0 AND id > ?
+        ORDER BY id LIMIT ?''',
+        (1, 0, 1000),
+    ),
+    'user_card_words': ('SELECT english_word FROM cards WHERE user_id = ?', (1,)),
+    'review_queue': (
+        '''SELECT cards.id, english_word, russian_word, description, transcription,
+        pronunciation_url, card_reviews.due_at, card_reviews.repetitions
+        FROM card_reviews JOIN cards ON cards.id = card_reviews.card_id
+        WHERE card_reviews.user_id = ? AND card_reviews.suspended = 0
+            AND card_reviews.due_at <= ?
+        ORDER BY card_reviews.due_at LIMIT ?''',
+        (1, 0, 20),
+    ),
+    'review_next_due': (
+        '''SELECT min(due_at) FROM card_reviews
+        WHERE user_id = ? AND suspended = 0''',
+        (1,),
+    ),
+    'review_state': (
+        'SELECT * FROM card_reviews WHERE card_id = ? AND user_id = ?', (1, 1),
+    ),
+    'deck_size': ('SELECT size FROM deck_sizes WHERE user_id = ?', (1,)),
+    'sample_slots': (
+        '''SELECT cards.id, english_word, russian_word, card_reviews.lapses
+        FROM cards LEFT JOIN card_reviews ON card_reviews.card_id = cards.id
+        WHERE cards.user_id = ? AND cards.sample_slot IN (?, ?, ?)''',
+        (1, 0, 1, 2),
+    ),
+    'card_search': (
+        '''SELECT cards.id, cards.english_word, cards.russian_word, cards.is_hidden
+        FROM cards_fts JOIN cards ON cards.id = cards_fts.rowid
+        WHERE cards_fts MATCH ? AND cards.user_id = ?
+        ORDER BY cards_fts.rank LIMIT ? OFFSET ?''',
+        ('"appl"*', 1, 21, 0),
+    ),
+    'card_search_fuzzy': (
+        '''SELECT cards.id, cards.english_word, cards.russian_word, cards.is_hidden
+        FROM cards_trigram JOIN cards ON cards.id = cards_trigram.rowid
+        WHERE cards_trigram MATCH ? AND cards.user_id = ?
+        ORDER BY cards_trigram.rank LIMIT ?''',
+        ('"app" OR "ppl"', 1, 50),
+    ),
+    'llm_cache_lookup': (
+        'SELECT response, tokens FROM llm_cache WHERE key = ? AND expires_at > ?',
+        ('key', 0.0),
+    ),
+    'llm_cache_evict_lru': (
+        'SELECT key FROM llm_cache ORDER BY last_access LIMIT ?',
+        (100,),
+    ),
+    'leaderboard_top': (
+        '''SELECT h.player_name, h.score, h.date, u.username
+        FROM leaderboard_top t
+        JOIN highscores h ON h.id = t.highscore_id
+        JOIN users u ON u.id = h.user_id
+        WHERE t.board = ?
+        ORDER BY t.score DESC, t.highscore_id LIMIT ?''',
+        ('all', 10),
+    ),
+    'leaderboard_users': (
+        '''SELECT h.player_name, h.score, h.date, u.username
+        FROM user_best_scores b
+        JOIN highscores h ON h.id = b.highscore_id
+        JOIN users u ON u.id = b.user_id
+        ORDER BY b.score DESC, b.highscore_id LIMIT ?''',
+        (10,),
+    ),
+    'leaderboard_version': ('SELECT version FROM leaderboard_meta WHERE id = 1', ()),
+    'user_best_score': (
+        '''SELECT h.player_name, h.score, h.date FROM user_best_scores b
+        JOIN highscores h ON h.id = b.highscore_id WHERE b.user_id = ?''',
+        (1,),
+    ),
+    'data_version': (
+        'SELECT version FROM data_versions WHERE user_id = ? AND scope = ?', (1, 'cards'),
+    ),
+}
+
+
+FTS_MATCH_PLAN = re.compile(r'VIRTUAL TABLE INDEX \d+:M')
+
+
+class QueryPlanError(Exception):
+    """Горячий запрос выполняется полным сканированием таблицы."""
+
+
+def migration(version: int, name: str) -> Callable[[MigrationFunc], MigrationFunc]:
+    def decorator(func: MigrationFunc) -> MigrationFunc:
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def execute_script(conn: sqlite3.Connection, script: str) -> None:
+    # executescript() фиксирует открытую транзакцию, поэтому выполняем по одному выражению.
+    # complete_statement() не даёт разрезать тела триггеров по внутренним ';'
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                conn.execute(statement)
+            statement = ''
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    existing = _columns(conn, table)
+    for column, ddl in columns.items():
+        if column not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+def batched_update(conn: sqlite3.Connection, table: str, assignment: str,
+                   where: str, params: Sequence = ()) -> int:
+    """Обновляет строки ``table`` пачками, фиксируя транзакцию после каждой.
+
+    Условие ``where`` должно перестать выполняться для обновлённых строк,
+    иначе цикл не завершится; так перенос можно безопасно продолжить
+    после прерывания.
+    """
+    total = 0
+    while True:
+        cursor = conn.execute(
+            f'''UPDATE {table} SET {assignment}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)''',
+            (*params, MIGRATION_BATCH_SIZE),
+        )
+        conn.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < MIGRATION_BATCH_SIZE:
+            return total
+
+
+@migration(1, 'base schema')
+def _base_schema(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            english_word TEXT NOT NULL,
+            russian_word TEXT NOT NULL,
+            description TEXT,
+            transcription TEXT,
+            pronunciation_url TEXT,
+            image_path TEXT,
+            is_hidden INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS highscores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            player_name TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            message TEXT NOT NULL,
+            model TEXT NOT NULL DEFAULT 'yandex',
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    ''')
+
+    # Базы, созданные до появления пользователей, дополняем недостающими колонками
+    owner = 'INTEGER REFERENCES users(id)'
+    _add_missing_columns(conn, 'cards', {
+        'user_id': owner,
+        'description': 'TEXT',
+        'transcription': 'TEXT',
+        'pronunciation_url': 'TEXT',
+        'image_path': 'TEXT',
+        'is_hidden': 'INTEGER DEFAULT 0',
+    })
+    _add_missing_columns(conn, 'highscores', {'user_id': owner})
+    _add_missing_columns(conn, 'chat_history', {
+        'user_id': owner,
+        'model': "TEXT NOT NULL DEFAULT 'yandex'",
+    })
+
+    conn.execute(
+        'INSERT OR IGNORE INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+        ('admin', 'admin@example.com', generate_password_hash('Admin123')),
+    )
+    admin_id = conn.execute(
+        "SELECT id FROM users WHERE username = 'admin' OR email = 'admin@example.com'"
+    ).fetchone()[0]
+    conn.commit()
+
+    # Данные без владельца привязываем к admin
+    for table in ('cards', 'highscores', 'chat_history'):
+        moved = batched_update(conn, table, 'user_id = ?', 'user_id IS NULL', (admin_id,))
+        if moved:
+            logger.info("Assigned %d orphan rows in %s to admin", moved, table)
+
+
+@migration(2, 'hot path indexes')
+def _hot_path_indexes(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_cards_user_hidden
+            ON cards(user_id, is_hidden);
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user_model_ts
+            ON chat_history(user_id, model, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts
+            ON chat_history(user_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_highscores_score
+            ON highscores(score DESC);
+    ''')
+
+
+@migration(3, 'card versions')
+def _card_versions(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, 'cards', {
+        'version': 'INTEGER NOT NULL DEFAULT 1',
+        'updated_at': 'TIMESTAMP',
+    })
+    conn.commit()
+    batched_update(conn, 'cards', 'updated_at = CURRENT_TIMESTAMP', 'updated_at IS NULL')
+    # Версия карточки растёт при изменении полей, которые отдаются в деталях
+    execute_script(conn, '''
+        CREATE TRIGGER IF NOT EXISTS trg_cards_set_updated_at
+        AFTER INSERT ON cards
+        WHEN NEW.updated_at IS NULL
+        BEGIN
+            UPDATE cards SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_bump_version
+        AFTER UPDATE OF english_word, russian_word, description, transcription,
+                        pronunciation_url, image_path ON cards
+        BEGIN
+            UPDATE cards
+            SET version = OLD.version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.id;
+        END;
+    ''')
+
+
+@migration(4, 'llm response cache')
+def _llm_response_cache(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            tokens INTEGER,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access);
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache(expires_at);
+    ''')
+
+
+@migration(5, 'chat context by id and rolling summaries')
+def _chat_summaries(conn: sqlite3.Connection) -> None:
+    # Контекст чата теперь выбирается по id, а не по секундному timestamp
+    execute_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user_model
+            ON chat_history(user_id, model);
+        DROP INDEX IF EXISTS idx_chat_history_user_model_ts;
+
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, model),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    ''')
+
+
+@migration(6, 'chat history id cursor')
+def _chat_history_cursor(conn: sqlite3.Connection) -> None:
+    # Индекс по user_id неявно содержит rowid, поэтому страницы по id идут без сортировки
+    execute_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user
+            ON chat_history(user_id);
+        DROP INDEX IF EXISTS idx_chat_history_user_ts;
+    ''')
+
+
+@migration(7, 'llm admission control')
+def _llm_admission(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+            user_id INTEGER PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS llm_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_slots_provider_user ON llm_slots(provider, user_id);
+        CREATE INDEX IF NOT EXISTS idx_llm_slots_expires_at ON llm_slots(expires_at);
+
+        CREATE TABLE IF NOT EXISTS llm_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            enqueued_at REAL NOT NULL,
+            heartbeat REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_queue_provider ON llm_queue(provider);
+        CREATE INDEX IF NOT EXISTS idx_llm_queue_heartbeat ON llm_queue(heartbeat);
+    ''')
+
+
+@migration(8, 'word enrichment')
+def _word_enrichment(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS word_cache (
+            word TEXT PRIMARY KEY,
+            russian_word TEXT NOT NULL,
+            description TEXT,
+            transcription TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS enrichment_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            processed INTEGER NOT NULL DEFAULT 0,
+            created INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+    ''')
+
+
+@migration(9, 'content-addressed card images')
+def _card_images(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, 'cards', {'image_hash': 'TEXT'})
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS images (
+            hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            variants TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_cards_image_hash ON cards(image_hash);
+    ''')
+
+
+@migration(10, 'spaced repetition state')
+def _card_reviews(conn: sqlite3.Connection) -> None:
+    # Состояние повторения живёт в отдельной таблице; частичный индекс содержит
+    # только не скрытые карточки, поэтому очередь не перебирает скрытые
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS card_reviews (
+            card_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            due_at INTEGER NOT NULL,
+            interval_days REAL NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            lapses INTEGER NOT NULL DEFAULT 0,
+            last_reviewed_at INTEGER,
+            suspended INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (card_id) REFERENCES cards(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_card_reviews_due
+            ON card_reviews(user_id, due_at) WHERE suspended = 0;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_review_state
+        AFTER INSERT ON cards
+        BEGIN
+            INSERT OR IGNORE INTO card_reviews (card_id, user_id, due_at, suspended)
+            VALUES (NEW.id, NEW.user_id, CAST(strftime('%s', 'now') AS INTEGER),
+                    COALESCE(NEW.is_hidden, 0));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_review_suspend
+        AFTER UPDATE OF is_hidden ON cards
+        WHEN COALESCE(OLD.is_hidden, 0) != COALESCE(NEW.is_hidden, 0)
+        BEGIN
+            UPDATE card_reviews SET suspended = COALESCE(NEW.is_hidden, 0)
+            WHERE card_id = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_review_delete
+        AFTER DELETE ON cards
+        BEGIN
+            DELETE FROM card_reviews WHERE card_id = OLD.id;
+        END;
+    ''')
+    conn.commit()
+
+    # Существующие карточки становятся новыми и сразу доступными к повторению
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id FROM cards WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, MIGRATION_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            '''INSERT OR IGNORE INTO card_reviews (card_id, user_id, due_at, suspended)
+            SELECT id, user_id, CAST(strftime('%s', 'now') AS INTEGER), COALESCE(is_hidden, 0)
+            FROM cards WHERE id > ? AND id <= ?''',
+            (last_id, rows[-1][0]),
+        )
+        conn.commit()
+        last_id = rows[-1][0]
+
+
+@migration(11, 'leaderboard')
+def _leaderboard(conn: sqlite3.Connection) -> None:
+    # Результаты, сохранённые строкой, сортировались как текст
+    batched_update(
+        conn, 'highscores', 'score = CAST(score AS INTEGER)', "typeof(score) != 'integer'"
+    )
+    execute_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_highscores_date ON highscores(date);
+
+        CREATE TABLE IF NOT EXISTS leaderboard_top (
+            board TEXT NOT NULL,
+            highscore_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            PRIMARY KEY (board, highscore_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_top_score
+            ON leaderboard_top(board, score DESC, highscore_id);
+
+        CREATE TABLE IF NOT EXISTS user_best_scores (
+            user_id INTEGER PRIMARY KEY,
+            highscore_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_best_scores_score
+            ON user_best_scores(score DESC, highscore_id);
+
+        CREATE TABLE IF NOT EXISTS leaderboard_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO leaderboard_meta (id, version) VALUES (1, 0);
+    ''')
+    # Заполнение досок повторяет leaderboard.rebuild на момент миграции, но не
+    # вызывает его: миграция не должна меняться вместе с кодом приложения
+    now = datetime.now()
+    year, week, _ = now.isocalendar()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = day_start - timedelta(days=now.weekday())
+    conn.execute('DELETE FROM leaderboard_top')
+    conn.execute(
+        '''INSERT INTO leaderboard_top (board, highscore_id, score)
+        SELECT 'all', id, score FROM highscores ORDER BY score DESC, id LIMIT ?''',
+        (LEADERBOARD_SIZE,)
+    )
+    for board, start in ((f"day:{now:%Y-%m-%d}", day_start),
+                         (f"week:{year}-W{week:02d}", week_start)):
+        conn.execute(
+            '''INSERT INTO leaderboard_top (board, highscore_id, score)
+            SELECT ?, id, score FROM highscores WHERE date >= ?
+            ORDER BY score DESC, id LIMIT ?''',
+            (board, start.strftime('%Y-%m-%d %H:%M:%S'), LEADERBOARD_SIZE)
+        )
+    conn.execute('DELETE FROM user_best_scores')
+    # Голая колонка рядом с max() в SQLite берётся из строки с максимумом
+    conn.execute(
+        '''INSERT INTO user_best_scores (user_id, highscore_id, score)
+        SELECT user_id, id, max(score) FROM highscores GROUP BY user_id'''
+    )
+    conn.execute('UPDATE leaderboard_meta SET version = version + 1 WHERE id = 1')
+
+
+@migration(12, 'dense card sample slots')
+def _card_sample_slots(conn: sqlite3.Connection) -> None:
+    # Видимые карточки пользователя занимают номера 0..size-1 без пропусков:
+    # скрытая или удалённая карточка отдаёт свой номер последней карточке колоды.
+    # Так случайный номер даёт равномерно случайную карточку за один поиск по индексу.
+    # Номера раздаются одной транзакцией, иначе прерванная миграция оставила бы дыры.
+    _add_missing_columns(conn, 'cards', {'sample_slot': 'INTEGER'})
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS deck_sizes (
+            user_id INTEGER PRIMARY KEY,
+            size INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+
+        UPDATE cards SET sample_slot = NULL;
+        UPDATE cards SET sample_slot = ranked.slot
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY id) - 1 AS slot
+            FROM cards WHERE COALESCE(is_hidden, 0) = 0
+        ) AS ranked
+        WHERE cards.id = ranked.id;
+
+        DELETE FROM deck_sizes;
+        INSERT INTO deck_sizes (user_id, size)
+        SELECT user_id, count(*) FROM cards
+        WHERE sample_slot IS NOT NULL GROUP BY user_id;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_cards_user_sample_slot
+            ON cards(user_id, sample_slot) WHERE sample_slot IS NOT NULL;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_slot_insert
+        AFTER INSERT ON cards
+        WHEN COALESCE(NEW.is_hidden, 0) = 0
+        BEGIN
+            INSERT OR IGNORE INTO deck_sizes (user_id, size) VALUES (NEW.user_id, 0);
+            UPDATE cards SET sample_slot = (
+                SELECT size FROM deck_sizes WHERE user_id = NEW.user_id
+            ) WHERE id = NEW.id;
+            UPDATE deck_sizes SET size = size + 1 WHERE user_id = NEW.user_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_slot_unhide
+        AFTER UPDATE OF is_hidden ON cards
+        WHEN COALESCE(OLD.is_hidden, 0) != 0 AND COALESCE(NEW.is_hidden, 0) = 0
+        BEGIN
+            INSERT OR IGNORE INTO deck_sizes (user_id, size) VALUES (NEW.user_id, 0);
+            UPDATE cards SET sample_slot = (
+                SELECT size FROM deck_sizes WHERE user_id = NEW.user_id
+            ) WHERE id = NEW.id;
+            UPDATE deck_sizes SET size = size + 1 WHERE user_id = NEW.user_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_slot_hide
+        AFTER UPDATE OF is_hidden ON cards
+        WHEN COALESCE(OLD.is_hidden, 0) = 0 AND COALESCE(NEW.is_hidden, 0) != 0
+            AND OLD.sample_slot IS NOT NULL
+        BEGIN
+            UPDATE cards SET sample_slot = NULL WHERE id = NEW.id;
+            UPDATE deck_sizes SET size = size - 1 WHERE user_id = NEW.user_id;
+            UPDATE cards SET sample_slot = OLD.sample_slot
+            WHERE user_id = NEW.user_id AND sample_slot = (
+                SELECT size FROM deck_sizes WHERE user_id = NEW.user_id
+            );
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_slot_delete
+        AFTER DELETE ON cards
+        WHEN OLD.sample_slot IS NOT NULL
+        BEGIN
+            UPDATE deck_sizes SET size = size - 1 WHERE user_id = OLD.user_id;
+            UPDATE cards SET sample_slot = OLD.sample_slot
+            WHERE user_id = OLD.user_id AND sample_slot = (
+                SELECT size FROM deck_sizes WHERE user_id = OLD.user_id
+            );
+        END;
+    ''')
+
+
+# Буква ё в индексе и в запросах приводится к е: пишут её не всегда
+def _fold(column: str) -> str:
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+@migration(13, 'card full-text search')
+def _card_search(conn: sqlite3.Connection) -> None:
+    # Обе таблицы читают текст из cards (external content), а в индекс попадает
+    # текст после _fold, поэтому команда 'rebuild' FTS5 для них не подходит:
+    # индекс заполняется теми же выражениями, что и в триггерах
+    columns = ('english_word', 'russian_word', 'description')
+    new = {column: _fold(f'NEW.{column}') for column in columns}
+    old = {column: _fold(f'OLD.{column}') for column in columns}
+    # Индексы с внешним содержимым (content='cards') очищаются только командой
+    # delete-all: обычный DELETE сверяется со строками cards и портит индекс,
+    # если карточки уже есть
+    execute_script(conn, f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+            english_word, russian_word, description,
+            content='cards', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        INSERT INTO cards_fts (cards_fts, rank) VALUES ('rank', 'bm25(10.0, 10.0, 1.0)');
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS cards_trigram USING fts5(
+            english_word, russian_word,
+            content='cards', content_rowid='id', tokenize='trigram'
+        );
+
+        INSERT INTO cards_fts (cards_fts) VALUES ('delete-all');
+        INSERT INTO cards_trigram (cards_trigram) VALUES ('delete-all');
+        INSERT INTO cards_fts (rowid, english_word, russian_word, description)
+        SELECT id, {_fold('english_word')}, {_fold('russian_word')}, {_fold('description')}
+        FROM cards;
+        INSERT INTO cards_trigram (rowid, english_word, russian_word)
+        SELECT id, {_fold('english_word')}, {_fold('russian_word')} FROM cards;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_search_insert
+        AFTER INSERT ON cards
+        BEGIN
+            INSERT INTO cards_fts (rowid, english_word, russian_word, description)
+            VALUES (NEW.id, {new['english_word']}, {new['russian_word']}, {new['description']});
+            INSERT INTO cards_trigram (rowid, english_word, russian_word)
+            VALUES (NEW.id, {new['english_word']}, {new['russian_word']});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_search_delete
+        AFTER DELETE ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, english_word, russian_word, description)
+            VALUES ('delete', OLD.id, {old['english_word']}, {old['russian_word']},
+                    {old['description']});
+            INSERT INTO cards_trigram (cards_trigram, rowid, english_word, russian_word)
+            VALUES ('delete', OLD.id, {old['english_word']}, {old['russian_word']});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_cards_search_update
+        AFTER UPDATE OF english_word, russian_word, description ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, english_word, russian_word, description)
+            VALUES ('delete', OLD.id, {old['english_word']}, {old['russian_word']},
+                    {old['description']});
+            INSERT INTO cards_fts (rowid, english_word, russian_word, description)
+            VALUES (NEW.id, {new['english_word']}, {new['russian_word']}, {new['description']});
+            INSERT INTO cards_trigram (cards_trigram, rowid, english_word, russian_word)
+            VALUES ('delete', OLD.id, {old['english_word']}, {old['russian_word']});
+            INSERT INTO cards_trigram (rowid, english_word, russian_word)
+            VALUES (NEW.id, {new['english_word']}, {new['russian_word']});
+        END;
+    ''')
+
+
+# Наборы данных пользователя, у которых есть счётчик версий в data_versions
+DATA_SCOPES = {'cards': 'cards', 'chat': 'chat_history'}
+
+
+@migration(14, 'per-user data versions')
+def _data_versions(conn: sqlite3.Connection) -> None:
+    # Счётчик растёт при любом изменении карточек или истории чата пользователя;
+    # из него строятся ETag, и проверка свежести не перечитывает сами данные
+    triggers = []
+    for scope, table in DATA_SCOPES.items():
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            triggers.append(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO data_versions (user_id, scope, version)
+                    VALUES ({row}.user_id, '{scope}', 1)
+                    ON CONFLICT (user_id, scope) DO UPDATE SET version = version + 1;
+                END;
+            ''')
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (user_id, scope)
+        ) WITHOUT ROWID;
+    ''' + ''.join(triggers))
+
+
+@migration(15, 'prometheus metrics')
+def _metrics(conn: sqlite3.Connection) -> None:
+    # Сумма приращений от всех процессов; labels — JSON с отсортированными ключами
+    execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS metrics (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, labels)
+        ) WITHOUT ROWID;
+    ''')
+
+
+@migration(16, 'active enrichment jobs index')
+def _enrichment_jobs_index(conn: sqlite3.Connection) -> None:
+    execute_script(conn, '''
+        CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_user_status
+            ON enrichment_jobs(user_id, status);
+    ''')
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate() -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы.
+
+    Миграции с batched_update фиксируют транзакцию между пачками, поэтому
+    параллельный воркер может применить такую миграцию ещё раз; это
+    безопасно, только пока миграция идемпотентна.
+    """
+    with db.connection() as conn:
+        for version, name, func in MIGRATIONS:
+            if current_version(conn) >= version:
+                continue
+            # Блокируем запись, чтобы параллельно стартующие воркеры ждали друг друга
+            # (до первой фиксации внутри batched_update)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if current_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                logger.info("Applying migration %s: %s", version, name)
+                func(conn)
+                if not conn.in_transaction:
+                    conn.execute('BEGIN IMMEDIATE')
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return current_version(conn)
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: Sequence = ()) -> List[str]:
+    return [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans() -> Dict[str, List[str]]:
+    """Проверяет, что горячие запросы не сканируют таблицы целиком.
+
+    Полное сканирование (``SCAN <table>`` без индекса) и сортировка через
+    временное B-дерево считаются регрессией и приводят к QueryPlanError.
+    """
+    plans = {}
+    problems = []
+    with db.connection() as conn:
+        for name, (sql, params) in HOT_QUERIES.items():
+            details = explain(conn, sql, params)
+            plans[name] = details
+            for detail in details:
+                # Поиск FTS5 по MATCH показывается как SCAN виртуальной таблицы с индексом M
+                full_scan = (detail.startswith('SCAN') and 'USING' not in detail
+                             and not FTS_MATCH_PLAN.search(detail))
+                if full_scan or 'TEMP B-TREE' in detail:
+                    problems.append(f"{name}: {detail}")
+    if problems:
+        raise QueryPlanError('Hot queries regressed: ' + '; '.join(problems))
+    return plans
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    print(f"Schema version: {migrate()}")
+    if '--check' in sys.argv:
+        try:
+            for query, plan in check_query_plans().items():
+                print(f"{query}: {' | '.join(plan)}")
+        except QueryPlanError as e:
+            print(e)
+            sys.exit(1)
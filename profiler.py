@@ -0,0 +1,100 @@
+"""Сэмплирующий профилировщик медленных запросов.
+
+Для доли ``PROFILE_SAMPLE_RATE`` запросов фоновый поток раз в
+``PROFILE_INTERVAL_MS`` снимает стек потока, который обрабатывает запрос.
+Если запрос занял больше ``PROFILE_SLOW_MS``, самые частые стеки пишутся в
+лог, а при заданном ``PROFILE_DIR`` — ещё и в файл ``.folded`` (формат
+flamegraph.pl и speedscope). Остальные профили выбрасываются, так что
+накладные расходы ограничены долей профилируемых запросов.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from configs import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS
+
+logger = logging.getLogger(__name__)
+
+TOP_STACKS = 5
+MAX_DEPTH = 64
+
+_lock = threading.Lock()
+# Профилируемые потоки: идентификатор потока -> счётчик свёрнутых стеков
+_active: Dict[int, Counter] = {}
+_sampler_pid: Optional[int] = None
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_loop() -> None:
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        time.sleep(interval)
+        with _lock:
+            if not _active:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in _active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[_collapse(frame)] += 1
+
+
+def _ensure_sampler() -> None:
+    # Поток не переживает fork, поэтому в каждом воркере запускается свой
+    global _sampler_pid
+    if _sampler_pid == os.getpid():
+        return
+    _sampler_pid = os.getpid()
+    threading.Thread(target=_sample_loop, name="profiler", daemon=True).start()
+
+
+def start() -> Optional[int]:
+    """Начинает профилировать текущий поток, если запрос попал в выборку."""
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    ident = threading.get_ident()
+    with _lock:
+        _ensure_sampler()
+        _active[ident] = Counter()
+    return ident
+
+
+def stop(ident: int, label: str, seconds: float) -> None:
+    """Заканчивает профиль; медленный запрос сохраняется в лог и PROFILE_DIR."""
+    with _lock:
+        stacks = _active.pop(ident, None)
+    if not stacks or seconds * 1000 < PROFILE_SLOW_MS:
+        return
+    total = sum(stacks.values())
+    top = "\n".join(f"  {count / total:6.1%} {stack}"
+                    for stack, count in stacks.most_common(TOP_STACKS))
+    logger.warning("Slow request %s took %.0f ms, %d samples, top stacks:\n%s",
+                   label, seconds * 1000, total, top)
+    if PROFILE_DIR:
+        _save(stacks, label)
+
+
+def _save(stacks: Counter, label: str) -> None:
+    safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "request"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                     f"{safe_label[:60]}.folded")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+    except OSError as e:
+        logger.warning("Failed to save profile to %s: %s", path, e)
@@ -0,0 +1,129 @@
+"""Случайная выборка карточек для игр без чтения всей колоды.
+
+Видимые карточки пользователя пронумерованы плотно: ``cards.sample_slot``
+принимает значения 0..size-1, размер колоды хранится в ``deck_sizes``, а
+триггеры сохраняют нумерацию при добавлении, скрытии и удалении карточек.
+Поэтому случайный номер — это равномерно случайная карточка, которая
+находится по индексу ``(user_id, sample_slot)``; стоимость выборки зависит
+только от числа нужных карточек.
+
+Выборка по ошибкам делается отбором: кандидат принимается с вероятностью
+``вес / SAMPLER_MAX_WEIGHT``, где вес растёт с числом забываний карточки
+при повторении.
+"""
+import random
+from typing import Dict, List, Optional, Sequence, Set
+
+from configs import DEFAULT_PAIRS, GAME_DISTRACTORS, SAMPLER_MAX_WEIGHT
+
+# Во сколько раз больше номеров запрашивается за раунд при выборке по весу
+OVERSAMPLE = 2
+MAX_ROUNDS = 8
+
+Card = Dict[str, object]
+
+
+def deck_size(conn, user_id: int) -> int:
+    row = conn.execute('SELECT size FROM deck_sizes WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def weight(card: Card) -> int:
+    return min(1 + (card.get('lapses') or 0), SAMPLER_MAX_WEIGHT)
+
+
+def _cards_at(conn, user_id: int, slots: Sequence[int]) -> List[Card]:
+    rows = conn.execute(
+        f'''SELECT cards.id, cards.sample_slot, english_word, russian_word, card_reviews.lapses
+        FROM cards LEFT JOIN card_reviews ON card_reviews.card_id = cards.id
+        WHERE cards.user_id = ? AND cards.sample_slot IN ({", ".join("?" * len(slots))})''',
+        (user_id, *slots)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _random_slots(size: int, count: int, seen: Set[int]) -> List[int]:
+    available = size - len(seen)
+    if available <= count:
+        # Маленькая колода: проще взять все оставшиеся номера
+        return [slot for slot in range(size) if slot not in seen]
+    slots: List[int] = []
+    while len(slots) < count:
+        slot = random.randrange(size)
+        if slot not in seen:
+            seen.add(slot)
+            slots.append(slot)
+    return slots
+
+
+def sample_cards(conn, user_id: int, count: int, weighted: bool = False,
+                 exclude: Optional[Set[int]] = None) -> List[Card]:
+    """До ``count`` разных карточек в случайном порядке, кроме id из ``exclude``."""
+    exclude = exclude or set()
+    size = deck_size(conn, user_id)
+    chosen: List[Card] = []
+    rejected: List[Card] = []
+    seen: Set[int] = set()
+    for _ in range(MAX_ROUNDS):
+        needed = count - len(chosen)
+        if needed <= 0 or len(seen) >= size:
+            break
+        wanted = needed * (OVERSAMPLE if weighted else 1) + len(exclude)
+        slots = _random_slots(size, wanted, seen)
+        seen.update(slots)
+        cards = _cards_at(conn, user_id, slots)
+        random.shuffle(cards)
+        for card in cards:
+            if card['id'] in exclude or len(chosen) == count:
+                continue
+            if weighted and random.random() * SAMPLER_MAX_WEIGHT >= weight(card):
+                # Отвергнутая карточка может выпасть снова в следующем раунде
+                seen.discard(card['sample_slot'])
+                rejected.append(card)
+                continue
+            chosen.append(card)
+    # Если отбор по весу не набрал нужное число, добираем отвергнутыми
+    chosen_ids = {card['id'] for card in chosen}
+    for card in rejected:
+        if len(chosen) >= count:
+            break
+        if card['id'] not in chosen_ids:
+            chosen_ids.add(card['id'])
+            chosen.append(card)
+    return chosen
+
+
+def _unique_words(cards: List[Card], words: Set[str]) -> List[Card]:
+    result: List[Card] = []
+    for card in cards:
+        if card['english_word'] not in words and card['russian_word'] not in words:
+            words.update((card['english_word'], card['russian_word']))
+            result.append(card)
+    return result
+
+
+def distractors(conn, user_id: int, answer: Card, count: int = GAME_DISTRACTORS) -> List[Card]:
+    """Неверные варианты ответа: карточки колоды, а при нехватке — DEFAULT_PAIRS."""
+    words = {answer['english_word'], answer['russian_word']}
+    result = _unique_words(
+        sample_cards(conn, user_id, count * 2, exclude={answer['id']}), words
+    )[:count]
+    if len(result) < count:
+        padding = _unique_words(random.sample(DEFAULT_PAIRS, len(DEFAULT_PAIRS)), words)
+        result.extend(dict(pair) for pair in padding[:count - len(result)])
+    return result
+
+
+def pairs(conn, user_id: int, count: int) -> List[Card]:
+    """Пары для «Найди пару» без повторяющихся слов; при нехватке — из DEFAULT_PAIRS."""
+    words: Set[str] = set()
+    result = _unique_words(sample_cards(conn, user_id, count), words)
+    if len(result) < count:
+        padding = _unique_words(random.sample(DEFAULT_PAIRS, len(DEFAULT_PAIRS)), words)
+        result.extend(dict(pair) for pair in padding[:count - len(result)])
+    return result[:count]
+
+
+def public(card: Card) -> Card:
+    """Поля карточки, которые отдаются играм."""
+    return {key: card[key] for key in ('id', 'english_word', 'russian_word') if key in card}
@@ -0,0 +1,108 @@
+"""Поиск по карточкам пользователя.
+
+Основной поиск идёт по FTS5-таблице ``cards_fts`` (английское слово,
+перевод и описание): каждое слово запроса ищется как префикс, результаты
+ранжируются по bm25, переводы и слова весят больше описания. Если на первой
+странице мало результатов, запрос дополняется нечётким поиском по
+триграммам ``cards_trigram``: кандидаты с общими триграммами
+пересортировываются по сходству с запросом, что находит слова с опечатками.
+Индексы поддерживают триггеры на ``cards`` (миграция 13).
+"""
+import re
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+import db
+from configs import SEARCH_FUZZY_CANDIDATES, SEARCH_FUZZY_MIN_SIMILARITY, SEARCH_MAX_OFFSET
+
+# Слова запроса: буквы и цифры обоих языков, внутри слова допустимы апостроф и дефис
+_term_pattern = re.compile(r"[\w][\w'-]*")
+MAX_TERMS = 8
+TRIGRAM = 3
+
+Result = Dict[str, object]
+
+
+def fold(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+
+def terms(query: str) -> List[str]:
+    return _term_pattern.findall(fold(query))[:MAX_TERMS]
+
+
+def _quote(term: str) -> str:
+    # Кавычки превращают слово в строку FTS5, поэтому операторы в запросе не работают
+    return '"' + term.replace('"', '""') + '"'
+
+
+def fts_query(words: List[str]) -> str:
+    return ' AND '.join(f'{_quote(word)}*' for word in words)
+
+
+def trigram_query(words: List[str]) -> Optional[str]:
+    trigrams = {
+        word[i:i + TRIGRAM] for word in words for i in range(len(word) - TRIGRAM + 1)
+    }
+    if not trigrams:
+        return None
+    return ' OR '.join(_quote(trigram) for trigram in sorted(trigrams))
+
+
+def similarity(words: List[str], card: Result) -> float:
+    """Среднее по словам запроса лучшее сходство с английским словом или переводом."""
+    card_words = terms(f"{card['english_word']} {card['russian_word']}")
+    if not card_words:
+        return 0.0
+    return sum(
+        max(SequenceMatcher(None, word, card_word).ratio() for card_word in card_words)
+        for word in words
+    ) / len(words)
+
+
+def _fuzzy(conn, user_id: int, words: List[str], exclude: set, limit: int) -> List[Result]:
+    match = trigram_query(words)
+    if match is None:
+        return []
+    rows = conn.execute(
+        '''SELECT cards.id, cards.english_word, cards.russian_word, cards.is_hidden
+        FROM cards_trigram JOIN cards ON cards.id = cards_trigram.rowid
+        WHERE cards_trigram MATCH ? AND cards.user_id = ?
+        ORDER BY cards_trigram.rank LIMIT ?''',
+        (match, user_id, SEARCH_FUZZY_CANDIDATES)
+    ).fetchall()
+    scored = []
+    for row in rows:
+        if row['id'] in exclude:
+            continue
+        card = dict(row)
+        score = similarity(words, card)
+        if score >= SEARCH_FUZZY_MIN_SIMILARITY:
+            scored.append((score, card))
+    scored.sort(key=lambda item: -item[0])
+    return [dict(card, fuzzy=True) for _, card in scored[:limit]]
+
+
+def search(user_id: int, query: str, limit: int,
+           offset: int = 0) -> Tuple[List[Result], Optional[int]]:
+    """Возвращает (страница результатов, смещение следующей страницы или None)."""
+    words = terms(query)
+    offset = min(max(offset, 0), SEARCH_MAX_OFFSET)
+    if not words:
+        return [], None
+    with db.connection() as conn:
+        rows = conn.execute(
+            '''SELECT cards.id, cards.english_word, cards.russian_word, cards.is_hidden
+            FROM cards_fts JOIN cards ON cards.id = cards_fts.rowid
+            WHERE cards_fts MATCH ? AND cards.user_id = ?
+            ORDER BY cards_fts.rank LIMIT ? OFFSET ?''',
+            (fts_query(words), user_id, limit + 1, offset)
+        ).fetchall()
+        results = [dict(row) for row in rows[:limit]]
+        has_more = len(rows) > limit
+        # Нечёткие совпадения добавляются только к первой неполной странице
+        if offset == 0 and not has_more and len(results) < limit:
+            exclude = {result['id'] for result in results}
+            results.extend(_fuzzy(conn, user_id, words, exclude, limit - len(results)))
+    next_offset = offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    return results, next_offset
@@ -0,0 +1,110 @@
+"""Интервальное повторение карточек по алгоритму SM-2.
+
+Состояние каждой карточки (срок, интервал, лёгкость, число повторений)
+хранится в ``card_reviews``; строку создаёт триггер при вставке карточки.
+Очередь читается по частичному индексу ``(user_id, due_at)`` только для
+не скрытых карточек, поэтому следующая пачка и запись оценки стоят
+O(log n) независимо от размера колоды.
+
+Оценки — как в SM-2, от 0 до 5: ниже 3 карточка считается забытой и
+возвращается через ``SRS_RELEARN_MINUTES`` минут.
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+from configs import SRS_INITIAL_EASE, SRS_MIN_EASE, SRS_RELEARN_MINUTES
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+MIN_GRADE = 0
+MAX_GRADE = 5
+PASSING_GRADE = 3
+
+REVIEW_FIELDS = ('due_at', 'interval_days', 'ease', 'repetitions', 'lapses', 'last_reviewed_at')
+
+
+class CardNotFound(LookupError):
+    pass
+
+
+def schedule(state: Dict[str, Any], grade: int, now: int) -> Dict[str, Any]:
+    """Новое состояние карточки после оценки ``grade``; исходное не меняется."""
+    if not MIN_GRADE <= grade <= MAX_GRADE:
+        raise ValueError(f"Grade must be between {MIN_GRADE} and {MAX_GRADE}")
+    ease = state['ease'] if state['last_reviewed_at'] is not None else SRS_INITIAL_EASE
+    repetitions = state['repetitions']
+    lapses = state['lapses']
+
+    # Лёгкость меняется при любой оценке, но не опускается ниже SRS_MIN_EASE
+    ease = max(SRS_MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < PASSING_GRADE:
+        if repetitions:
+            lapses += 1
+        repetitions = 0
+        interval_days = 0.0
+        due_at = now + SRS_RELEARN_MINUTES * 60
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = round(state['interval_days'] * ease, 2)
+        due_at = now + int(interval_days * DAY)
+
+    return {
+        'due_at': due_at,
+        'interval_days': interval_days,
+        'ease': round(ease, 3),
+        'repetitions': repetitions,
+        'lapses': lapses,
+        'last_reviewed_at': now,
+    }
+
+
+def due_cards(user_id: int, limit: int,
+              now: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+    """Возвращает (карточки к повторению по сроку, ближайший срок, если их нет)."""
+    now = int(time.time()) if now is None else now
+    with db.connection() as conn:
+        rows = conn.execute(
+            '''SELECT cards.id, english_word, russian_word, description, transcription,
+            pronunciation_url, card_reviews.due_at, card_reviews.repetitions
+            FROM card_reviews JOIN cards ON cards.id = card_reviews.card_id
+            WHERE card_reviews.user_id = ? AND card_reviews.suspended = 0
+                AND card_reviews.due_at <= ?
+            ORDER BY card_reviews.due_at LIMIT ?''',
+            (user_id, now, limit)
+        ).fetchall()
+        next_due_at = None
+        if not rows:
+            next_due_at = conn.execute(
+                'SELECT min(due_at) FROM card_reviews WHERE user_id = ? AND suspended = 0',
+                (user_id,)
+            ).fetchone()[0]
+    return [dict(row) for row in rows], next_due_at
+
+
+def record_review(user_id: int, card_id: int, grade: int,
+                  now: Optional[int] = None) -> Dict[str, Any]:
+    """Записывает оценку и возвращает новое состояние карточки."""
+    now = int(time.time()) if now is None else now
+    with db.connection() as conn:
+        # Чтение и запись в одной транзакции: две быстрые оценки не потеряют друг друга
+        conn.execute('BEGIN IMMEDIATE')
+        state = conn.execute(
+            'SELECT * FROM card_reviews WHERE card_id = ? AND user_id = ?', (card_id, user_id)
+        ).fetchone()
+        if state is None:
+            raise CardNotFound(f"Card {card_id} not found")
+        new_state = schedule(dict(state), grade, now)
+        conn.execute(
+            f'''UPDATE card_reviews SET {", ".join(f"{field} = ?" for field in REVIEW_FIELDS)}
+            WHERE card_id = ?''',
+            (*(new_state[field] for field in REVIEW_FIELDS), card_id)
+        )
+    return new_state
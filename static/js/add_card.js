@@ -0,0 +1,87 @@
+function updatePronunciationUrl() {
+    const englishWord = document.getElementById('englishWord').value.trim().toLowerCase();
+    const baseUrl = 'https://dictionary.cambridge.org/dictionary/english-russian/';
+    
+    // Просто добавляем слово к базовому URL
+    document.getElementById('pronunciationUrl').value = englishWord ? baseUrl + englishWord : '';
+}
+
+async function startEnrichment(event) {
+    event.preventDefault();
+    const button = document.getElementById('enrichButton');
+    const status = document.getElementById('enrichStatus');
+    button.disabled = true;
+    document.getElementById('enrichProgress').hidden = false;
+    status.textContent = 'Отправляем список...';
+
+    try {
+        const response = await fetch('/enrich', {
+            method: 'POST',
+            body: new FormData(document.getElementById('enrichForm')),
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Ошибка сервера');
+        }
+        pollEnrichment(data.status_url);
+    } catch (error) {
+        status.textContent = `Ошибка: ${error.message}`;
+        button.disabled = false;
+    }
+}
+
+async function importDeck(event) {
+    event.preventDefault();
+    const button = document.getElementById('importButton');
+    const status = document.getElementById('importStatus');
+    button.disabled = true;
+    status.textContent = 'Импортируем...';
+    try {
+        const response = await fetch(document.getElementById('importForm').action, {
+            method: 'POST',
+            body: new FormData(document.getElementById('importForm')),
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || 'Ошибка сервера');
+        }
+        status.textContent = `Добавлено карточек: ${result.imported}, пропущено строк: ${result.skipped}`;
+        if (result.errors.length) {
+            console.warn('Import errors:', result.errors);
+        }
+    } catch (error) {
+        status.textContent = `Ошибка: ${error.message}`;
+    } finally {
+        button.disabled = false;
+    }
+}
+
+// Опрашиваем прогресс задания, пока оно не завершится
+async function pollEnrichment(statusUrl) {
+    const status = document.getElementById('enrichStatus');
+    const bar = document.getElementById('enrichBar');
+    try {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        bar.max = job.total || 1;
+        bar.value = job.processed;
+        status.textContent = `Обработано ${job.processed} из ${job.total}: создано ${job.created}, уже были ${job.skipped}, не удалось ${job.failed}`;
+        if (job.status === 'done' || job.status === 'failed') {
+            if (job.status === 'failed') {
+                status.textContent += ` (ошибка: ${job.error})`;
+            }
+            document.getElementById('enrichButton').disabled = false;
+            return;
+        }
+    } catch (error) {
+        console.error('Error polling enrichment job:', error);
+    }
+    setTimeout(() => pollEnrichment(statusUrl), 1000);
+}
+
+// Добавляем стили для readonly поля
+document.addEventListener('DOMContentLoaded', function() {
+    const pronunciationUrl = document.getElementById('pronunciationUrl');
+    pronunciationUrl.style.backgroundColor = '#f5f5f5';
+    pronunciationUrl.style.cursor = 'default';
+});
@@ -0,0 +1,251 @@
+// Если настроен асинхронный шлюз LLM, запросы к модели идут через него
+const GATEWAY_URL = JSON.parse(document.getElementById('pageData').textContent).gateway_url;
+
+// Добавляем функцию очистки истории
+async function clearChatHistory() {
+    try {
+        const response = await fetch('/clear_chat_history', {
+            method: 'POST',
+        });
+        
+        if (response.ok) {
+            resetMessages();
+            prevHistoryCursor = null;
+        } else {
+            addMessage('Ошибка при очистке истории.', 'system');
+        }
+    } catch (error) {
+        console.error('Error clearing chat history:', error);
+        addMessage('Ошибка при очистке истории.', 'system');
+    }
+}
+
+// История грузится страницами: сначала последняя, затем только новые сообщения
+let lastHistoryId = 0;
+let prevHistoryCursor = null;
+
+function renderHistoryMessage(msg) {
+    return addMessage(msg.message, msg.role, msg.role === 'assistant');
+}
+
+function resetMessages() {
+    // Очищаем контейнер сообщений, оставляя только приветственное сообщение
+    const messagesContainer = document.getElementById('chatMessages');
+    const welcomeMessage = messagesContainer.firstElementChild;
+    messagesContainer.innerHTML = '';
+    messagesContainer.appendChild(welcomeMessage);
+    return messagesContainer;
+}
+
+function updateLoadOlderButton() {
+    const messagesContainer = document.getElementById('chatMessages');
+    let button = document.getElementById('loadOlderBtn');
+    if (!prevHistoryCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadOlderBtn';
+        button.className = 'common-btn load-older-btn';
+        button.textContent = 'Показать более ранние сообщения';
+        button.addEventListener('click', loadOlderHistory);
+        messagesContainer.insertBefore(button, messagesContainer.children[1] || null);
+    }
+}
+
+async function loadLatestHistory() {
+    try {
+        const response = await fetch('/get_chat_history');
+        const page = await response.json();
+        resetMessages();
+        page.messages.forEach(renderHistoryMessage);
+        lastHistoryId = page.last_id;
+        prevHistoryCursor = page.prev_cursor;
+        updateLoadOlderButton();
+    } catch (error) {
+        console.error('Error loading chat history:', error);
+    }
+}
+
+async function loadOlderHistory() {
+    if (!prevHistoryCursor) return;
+    try {
+        const response = await fetch(`/get_chat_history?before=${prevHistoryCursor}`);
+        const page = await response.json();
+        const messagesContainer = document.getElementById('chatMessages');
+        const button = document.getElementById('loadOlderBtn');
+        const scrollBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop;
+        // Вставляем более ранние сообщения сразу после кнопки, сохраняя позицию прокрутки
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(msg => {
+            const messageDiv = renderHistoryMessage(msg);
+            fragment.appendChild(messageDiv);
+        });
+        button.after(fragment);
+        messagesContainer.scrollTop = messagesContainer.scrollHeight - scrollBottom;
+        prevHistoryCursor = page.prev_cursor;
+        updateLoadOlderButton();
+    } catch (error) {
+        console.error('Error loading older chat history:', error);
+    }
+}
+
+// Догружает сообщения новее lastHistoryId (например, из другой вкладки).
+// render = false только сдвигает курсор: свои сообщения уже показаны.
+async function syncHistory(render = true) {
+    try {
+        let hasMore = true;
+        while (hasMore) {
+            const response = await fetch(`/get_chat_history?after=${lastHistoryId}`);
+            const page = await response.json();
+            if (render) {
+                page.messages.forEach(renderHistoryMessage);
+            }
+            lastHistoryId = page.last_id;
+            hasMore = page.has_more;
+        }
+    } catch (error) {
+        console.error('Error syncing chat history:', error);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', loadLatestHistory);
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') {
+        syncHistory();
+    }
+});
+
+function addMessage(text, type, useMarkdown = false) {
+    const messagesContainer = document.getElementById('chatMessages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${type}`;
+    
+    // Если нужно использовать markdown и это ответ ассистента
+    if (useMarkdown && type === 'assistant') {
+        // Используем marked для преобразования markdown в HTML
+        messageDiv.innerHTML = marked.parse(text);
+    } else {
+        messageDiv.textContent = text;
+    }
+    
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    
+    return messageDiv; // Возвращаем созданный элемент
+}
+
+async function sendMessage(event) {
+    event.preventDefault();
+    
+    const messageInput = document.getElementById('userMessage');
+    const message = messageInput.value.trim();
+    if (!message) return;
+    
+    const model = document.getElementById('modelSelect').value;
+    const temperature = parseFloat(document.getElementById('temperature').value);
+    const maxTokens = parseInt(document.getElementById('maxTokens').value);
+    
+    // Добавляем сообщение пользователя
+    addMessage(message, 'user');
+    messageInput.value = '';
+    messageInput.disabled = true; // Блокируем ввод на время ожидания ответа
+    
+    // Добавляем индикатор загрузки и сохраняем ссылку на него
+    const loadingMessage = addMessage('Печатает...', 'system');
+    
+    let assistantMessage = null;
+    let assistantText = '';
+
+    try {
+        const response = await fetch(`${GATEWAY_URL}/ask_stream`, {
+            method: 'POST',
+            credentials: 'include',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ 
+                message: message,
+                model: model,
+                temperature: temperature,
+                max_tokens: maxTokens
+            })
+        });
+        
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.response || 'Ошибка сервера');
+        }
+        
+        // Читаем Server-Sent Events и дописываем ответ по мере получения токенов
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finished = false;
+        
+        while (!finished) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const rawEvent of events) {
+                const { event, data } = parseSseEvent(rawEvent);
+                if (event === 'token') {
+                    if (!assistantMessage) {
+                        // Удаляем индикатор загрузки при первом токене
+                        if (loadingMessage && loadingMessage.parentNode) {
+                            loadingMessage.remove();
+                        }
+                        assistantMessage = addMessage('', 'assistant', true);
+                    }
+                    assistantText += data.text;
+                    assistantMessage.innerHTML = marked.parse(assistantText);
+                    const messagesContainer = document.getElementById('chatMessages');
+                    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                } else if (event === 'done') {
+                    finished = true;
+                } else if (event === 'error') {
+                    throw new Error(data.response || 'Ошибка сервера');
+                }
+            }
+        }
+        
+        if (!assistantText) {
+            throw new Error('Пустой ответ от сервера');
+        }
+        await syncHistory(false);
+    } catch (error) {
+        // Удаляем индикатор загрузки и незавершённый ответ в случае ошибки
+        if (loadingMessage && loadingMessage.parentNode) {
+            loadingMessage.remove();
+        }
+        if (assistantMessage && assistantMessage.parentNode) {
+            assistantMessage.remove();
+        }
+        addMessage(`Ошибка: ${error.message}. Пожалуйста, попробуйте позже.`, 'system');
+    } finally {
+        messageInput.disabled = false; // Разблокируем ввод
+    }
+}
+
+function parseSseEvent(rawEvent) {
+    let event = 'message';
+    const dataLines = [];
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+}
+
+// Добавляем обработчик изменения значения temperature
+document.getElementById('temperature').addEventListener('input', function(e) {
+    document.getElementById('temperatureValue').textContent = e.target.value;
+});
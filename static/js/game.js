@@ -0,0 +1,136 @@
+(function() {
+    // Вопросы с вариантами ответа приходят с сервера небольшими пачками
+    const batchSize = Number(document.getElementById('options').dataset.batchSize) || 10;
+    let questions = [];
+    let isLoading = null;
+
+    function loadQuestions() {
+        if (!isLoading) {
+            isLoading = fetch(`/api/game/questions?count=${batchSize}&weighted=1`)
+                .then(response => response.ok ? response.json() : { questions: [] })
+                .then(data => { questions.push(...data.questions); })
+                .catch(() => {})
+                .finally(() => { isLoading = null; });
+        }
+        return isLoading;
+    }
+
+    function showEmptyDeck() {
+        document.getElementById('questionWord').textContent = 'Нет доступных карточек для игры';
+        document.getElementById('startButton').style.display = 'none';
+    }
+
+    loadQuestions().then(() => {
+        if (questions.length === 0) {
+            showEmptyDeck();
+        }
+    });
+
+    let currentQuestion = null;
+    let score = 0;
+    let timeLeft = 30;
+    let gameTimer = null;
+    let isGameActive = false;
+
+    window.startGame = function() {
+        score = 0;
+        timeLeft = 30;
+        isGameActive = true;
+        document.getElementById('score').textContent = score;
+        document.getElementById('startButton').style.display = 'none';
+        document.getElementById('saveScore').style.display = 'none';
+        
+        updateTimer();
+        gameTimer = setInterval(() => {
+            timeLeft--;
+            updateTimer();
+            if (timeLeft <= 0) {
+                endGame();
+            }
+        }, 1000);
+        
+        nextQuestion();
+    };
+
+    window.checkAnswer = checkAnswer;
+
+    function updateTimer() {
+        document.getElementById('timer').textContent = timeLeft;
+    }
+
+    function endGame() {
+        clearInterval(gameTimer);
+        isGameActive = false;
+        document.getElementById('questionWord').textContent = `Игра окончена! Ваш счет: ${score}`;
+        document.getElementById('options').innerHTML = '';
+        document.getElementById('startButton').style.display = 'block';
+        document.getElementById('startButton').textContent = 'Играть снова';
+        
+        const saveScoreDiv = document.getElementById('saveScore');
+        const finalScoreInput = document.getElementById('finalScore');
+        saveScoreDiv.style.display = 'block';
+        finalScoreInput.value = score;
+        document.getElementById('finalScoreDisplay').textContent = score;
+    }
+
+    async function nextQuestion() {
+        if (!isGameActive) return;
+
+        if (questions.length === 0) {
+            await loadQuestions();
+            if (questions.length === 0) {
+                endGame();
+                return;
+            }
+        }
+        currentQuestion = questions.shift();
+        // Следующую пачку запрашиваем заранее, чтобы игра не ждала сети
+        if (questions.length < 3) {
+            loadQuestions();
+        }
+        
+        const isEnglishQuestion = Math.random() < 0.5;
+        
+        document.getElementById('questionWord').textContent = isEnglishQuestion 
+            ? currentQuestion.english_word 
+            : currentQuestion.russian_word;
+        
+        let options = [currentQuestion, ...currentQuestion.distractors].map(card =>
+            isEnglishQuestion ? card.russian_word : card.english_word
+        );
+        
+        options.sort(() => Math.random() - 0.5);
+        
+        const optionsContainer = document.getElementById('options');
+        optionsContainer.innerHTML = '';
+        options.forEach(option => {
+            const button = document.createElement('button');
+            button.textContent = option;
+            button.className = 'option-btn common-btn';
+            button.addEventListener('click', function() {
+                checkAnswer(option, isEnglishQuestion);
+            });
+            optionsContainer.appendChild(button);
+        });
+    }
+
+    function checkAnswer(selectedOption, isEnglishQuestion) {
+        if (!isGameActive) return;
+        
+        const correctAnswer = isEnglishQuestion 
+            ? currentQuestion.russian_word 
+            : currentQuestion.english_word;
+        
+        if (selectedOption === correctAnswer) {
+            score += 10;
+            document.getElementById('score').textContent = score;
+            timeLeft = Math.min(timeLeft + 5, timeLeft);
+            updateTimer();
+        } else {
+            score = Math.max(0, score - 10);
+            document.getElementById('score').textContent = score;
+        }
+        
+        nextQuestion();
+    }
+})();
@@ -0,0 +1,135 @@
+// Пары выбираются на сервере заново для каждой игры
+let cards = [];
+let gameCards = [];
+let selectedCards = [];
+let pairsFound = 0;
+let timeLeft = 120;
+let gameTimer = null;
+let isGameActive = false;
+
+function createGameCards() {
+    gameCards = [];
+    // Добавляем английские слова
+    cards.forEach(card => {
+        gameCards.push({
+            word: card.english_word,
+            isEnglish: true,
+            paired: false,
+            id: Math.random()
+        });
+    });
+    // Добавляем русские слова
+    cards.forEach(card => {
+        gameCards.push({
+            word: card.russian_word,
+            isEnglish: false,
+            paired: false,
+            id: Math.random()
+        });
+    });
+    // Перемешиваем карточки
+    gameCards.sort(() => Math.random() - 0.5);
+}
+
+async function startMemoryGame() {
+    try {
+        const response = await fetch('/api/memory_game/pairs');
+        if (response.ok) {
+            cards = (await response.json()).pairs;
+        }
+    } catch (error) {
+        console.error('Не удалось загрузить пары:', error);
+    }
+    if (cards.length === 0) return;
+    document.getElementById('pairsTotal').textContent = cards.length;
+
+    pairsFound = 0;
+    timeLeft = 120;
+    isGameActive = true;
+    selectedCards = [];
+    document.getElementById('pairsFound').textContent = '0';
+    document.getElementById('gameOverMessage').style.display = 'none';
+    document.getElementById('startButton').style.display = 'none';
+    
+    createGameCards();
+    renderGrid();
+    
+    if (gameTimer) clearInterval(gameTimer);
+    gameTimer = setInterval(() => {
+        timeLeft--;
+        document.getElementById('timer').textContent = timeLeft;
+        if (timeLeft <= 0 || pairsFound === cards.length) {
+            endMemoryGame();
+        }
+    }, 1000);
+}
+
+function renderGrid() {
+    const grid = document.getElementById('gameGrid');
+    grid.innerHTML = '';
+    
+    gameCards.forEach((card, index) => {
+        const cardElement = document.createElement('div');
+        cardElement.className = `memory-card ${card.paired ? 'paired' : ''}`;
+        cardElement.textContent = card.paired ? card.word : '?';
+        cardElement.onclick = () => !card.paired && selectCard(index);
+        grid.appendChild(cardElement);
+    });
+}
+
+function selectCard(index) {
+    if (!isGameActive || selectedCards.length >= 2) return;
+    
+    const card = gameCards[index];
+    if (card.paired) return;
+    
+    // Показываем карточку
+    const cardElement = document.querySelector(`#gameGrid .memory-card:nth-child(${index + 1})`);
+    cardElement.textContent = card.word;
+    
+    selectedCards.push({ index, card });
+    
+    if (selectedCards.length === 2) {
+        checkPair();
+    }
+}
+
+function checkPair() {
+    const [first, second] = selectedCards;
+    const firstCard = cards.find(c => 
+        (first.card.isEnglish && c.english_word === first.card.word) ||
+        (!first.card.isEnglish && c.russian_word === first.card.word)
+    );
+    
+    const isMatch = firstCard && (
+        (first.card.isEnglish && !second.card.isEnglish && firstCard.russian_word === second.card.word) ||
+        (!first.card.isEnglish && second.card.isEnglish && firstCard.english_word === second.card.word)
+    );
+    
+    setTimeout(() => {
+        if (isMatch) {
+            gameCards[first.index].paired = true;
+            gameCards[second.index].paired = true;
+            pairsFound++;
+            document.getElementById('pairsFound').textContent = pairsFound;
+            
+            if (pairsFound === cards.length) {
+                endMemoryGame();
+            }
+        }
+        
+        selectedCards = [];
+        renderGrid();
+    }, 1000);
+}
+
+function endMemoryGame() {
+    isGameActive = false;
+    clearInterval(gameTimer);
+    
+    const timeSpent = 120 - timeLeft;
+    document.getElementById('gameOverMessage').style.display = 'block';
+    document.getElementById('finalPairs').textContent = pairsFound;
+    document.getElementById('timeSpent').textContent = timeSpent;
+    document.getElementById('startButton').style.display = 'block';
+}
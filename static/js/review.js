@@ -0,0 +1,92 @@
+    // Очередь повторения: карточки приходят пачками, оценка отправляется сразу
+    const reviewArea = document.getElementById('reviewArea');
+    const batchSize = Number(reviewArea.dataset.batchSize) || 20;
+    let queue = [];
+    let current = null;
+    let isLoading = false;
+    // Оценки в пути: пока запрос не дошёл, карточка ещё числится к повторению
+    const grading = new Set();
+
+    function toggleReviewCard() {
+        if (!current) return;
+        document.getElementById('reviewCard').classList.toggle('flipped');
+        document.getElementById('reviewDescription').hidden = !current.description;
+        document.getElementById('reviewGrades').hidden = false;
+    }
+
+    function showStatus(text) {
+        document.getElementById('reviewStatus').textContent = text;
+    }
+
+    function showNext() {
+        current = queue.shift() || null;
+        const card = document.getElementById('reviewCard');
+        card.classList.remove('flipped');
+        document.getElementById('reviewGrades').hidden = true;
+        document.getElementById('reviewDescription').hidden = true;
+        if (!current) {
+            reviewArea.hidden = true;
+            loadBatch();
+            return;
+        }
+        reviewArea.hidden = false;
+        document.getElementById('reviewFront').textContent = current.english_word;
+        document.getElementById('reviewBack').textContent = current.russian_word;
+        document.getElementById('reviewDescription').textContent = current.description || '';
+        // Следующую пачку запрашиваем заранее, чтобы не ждать на последней карточке
+        if (queue.length < 3) {
+            loadBatch();
+        }
+    }
+
+    async function loadBatch() {
+        if (isLoading) return;
+        isLoading = true;
+        try {
+            const response = await fetch(`/api/review/next?limit=${batchSize}`);
+            if (!response.ok) {
+                throw new Error('Ошибка сервера');
+            }
+            const data = await response.json();
+            const known = new Set([...grading, ...queue.map(card => card.id)]);
+            if (current) known.add(current.id);
+            queue.push(...data.cards.filter(card => !known.has(card.id)));
+            if (!current && queue.length) {
+                showNext();
+            } else if (!current) {
+                const nextDue = data.next_due_at
+                    ? new Date(data.next_due_at * 1000).toLocaleString()
+                    : null;
+                showStatus(nextDue
+                    ? `Все карточки повторены. Следующее повторение: ${nextDue}`
+                    : 'Нет карточек для повторения');
+            }
+        } catch (error) {
+            showStatus(`Ошибка: ${error.message}`);
+        } finally {
+            isLoading = false;
+        }
+    }
+
+    async function gradeCard(grade) {
+        if (!current) return;
+        const card = current;
+        grading.add(card.id);
+        showNext();
+        try {
+            const response = await fetch(`/api/review/${card.id}`, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({grade}),
+            });
+            if (!response.ok) {
+                throw new Error('Оценка не сохранена');
+            }
+        } catch (error) {
+            showStatus(`Ошибка: ${error.message}`);
+        } finally {
+            grading.delete(card.id);
+        }
+    }
+
+    loadBatch();
@@ -0,0 +1,227 @@
+    let isFlippedMode = false;
+
+    function toggleCard(card) {
+        card.classList.toggle('flipped');
+    }
+
+    // Подгружаем следующие страницы карточек по мере прокрутки
+    const sentinel = document.getElementById('flashcardsSentinel');
+    let nextCursor = sentinel.dataset.nextCursor;
+    let isLoadingCards = false;
+
+    function createCardElement(card) {
+        const cardDiv = document.createElement('div');
+        cardDiv.className = isFlippedMode ? 'card flipped' : 'card';
+        cardDiv.dataset.cardId = card.id;
+        cardDiv.onclick = function() { toggleCard(this); };
+
+        const front = document.createElement('div');
+        front.className = 'front';
+        front.textContent = card.english_word;
+
+        const back = document.createElement('div');
+        back.className = 'back';
+        back.textContent = card.russian_word;
+
+        const hideForm = document.createElement('form');
+        hideForm.action = `/hide_card/${card.id}`;
+        hideForm.method = 'post';
+        hideForm.className = 'hide-form';
+        hideForm.innerHTML = '<button type="submit" class="hide-btn">✖</button>';
+
+        const infoBtn = document.createElement('div');
+        infoBtn.className = 'info-btn';
+        infoBtn.textContent = '?';
+        infoBtn.onclick = (event) => showCardInfo(event, card.id);
+
+        cardDiv.append(front, back, hideForm, infoBtn);
+        return cardDiv;
+    }
+
+    async function loadMoreCards() {
+        if (isLoadingCards || !nextCursor) return;
+        isLoadingCards = true;
+        try {
+            const response = await fetch(`/api/cards?after=${nextCursor}`);
+            const data = await response.json();
+            const container = document.getElementById('flashcards');
+            data.cards.forEach(card => {
+                const cardElement = createCardElement(card);
+                container.appendChild(cardElement);
+                detailsObserver.observe(cardElement);
+            });
+            nextCursor = data.next_cursor;
+        } catch (error) {
+            console.error('Error loading cards:', error);
+        } finally {
+            isLoadingCards = false;
+        }
+        if (!nextCursor) {
+            cardsObserver.disconnect();
+        }
+    }
+
+    const cardsObserver = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMoreCards();
+        }
+    }, { rootMargin: '600px' });
+
+    if (nextCursor) {
+        cardsObserver.observe(sentinel);
+    }
+
+    // Поиск по всей колоде на сервере; пока строка поиска не пуста, сетка скрыта
+    const searchInput = document.getElementById('cardSearch');
+    const searchResults = document.getElementById('searchResults');
+    let searchOffset = null;
+    let searchTimer = null;
+    let searchRequest = 0;
+
+    async function searchCards(more = false) {
+        const query = searchInput.value.trim();
+        const flashcards = document.getElementById('flashcards');
+        if (!query) {
+            searchResults.style.display = 'none';
+            document.getElementById('searchMore').style.display = 'none';
+            flashcards.style.display = '';
+            return;
+        }
+        const requestId = ++searchRequest;
+        const offset = more ? searchOffset : 0;
+        try {
+            const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&offset=${offset || 0}`);
+            const data = await response.json();
+            // Ответ на устаревший запрос не должен перезаписать более новый
+            if (requestId !== searchRequest) return;
+            if (!more) {
+                searchResults.innerHTML = '';
+            }
+            data.results.forEach(card => searchResults.appendChild(createCardElement(card)));
+            if (!searchResults.children.length) {
+                searchResults.textContent = 'Ничего не найдено';
+            }
+            searchOffset = data.next_offset;
+            document.getElementById('searchMore').style.display = searchOffset === null ? 'none' : '';
+            flashcards.style.display = 'none';
+            searchResults.style.display = '';
+        } catch (error) {
+            console.error('Error searching cards:', error);
+        }
+    }
+
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => searchCards(), 250);
+    });
+
+    function flipAllCards() {
+        isFlippedMode = !isFlippedMode;
+        const cards = document.querySelectorAll('.card');
+        cards.forEach(card => {
+            if (isFlippedMode) {
+                card.classList.add('flipped');
+            } else {
+                card.classList.remove('flipped');
+            }
+        });
+        
+        const btn = document.querySelector('.flip-all-btn');
+        btn.textContent = isFlippedMode ? 'Вернуть на английский' : 'Перевернуть все карточки';
+    }
+
+    // Детали карточек подгружаются пачками для видимой области экрана
+    const cardDetails = new Map();
+    const pendingDetailIds = new Set();
+    let detailsTimer = null;
+
+    async function fetchCardDetails(ids) {
+        const missing = ids.filter(id => !cardDetails.has(id));
+        if (missing.length === 0) return;
+        missing.sort((a, b) => a - b);
+        const response = await fetch(`/api/cards/details?ids=${missing.join(',')}`, {
+            cache: 'no-cache',
+        });
+        const data = await response.json();
+        Object.entries(data.cards).forEach(([id, details]) => {
+            cardDetails.set(Number(id), details);
+        });
+    }
+
+    function scheduleDetailsPrefetch(cardId) {
+        if (cardDetails.has(cardId)) return;
+        pendingDetailIds.add(cardId);
+        clearTimeout(detailsTimer);
+        detailsTimer = setTimeout(() => {
+            const ids = Array.from(pendingDetailIds);
+            pendingDetailIds.clear();
+            fetchCardDetails(ids).catch(error => console.error('Error prefetching cards:', error));
+        }, 150);
+    }
+
+    const detailsObserver = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                scheduleDetailsPrefetch(Number(entry.target.dataset.cardId));
+                detailsObserver.unobserve(entry.target);
+            }
+        });
+    });
+    document.querySelectorAll('#flashcards .card').forEach(card => detailsObserver.observe(card));
+
+    // Добавляем функцию для отображения информации о карточке
+    async function showCardInfo(event, cardId) {
+        event.stopPropagation(); // Предотвращаем переворот карточки
+
+        if (!cardDetails.has(cardId)) {
+            await fetchCardDetails([cardId]);
+        }
+        const data = cardDetails.get(cardId);
+        if (!data) return;
+
+        const modal = document.getElementById('cardInfoModal');
+        const modalTitle = document.getElementById('modalTitle');
+        const modalTranscription = document.getElementById('modalTranscription');
+        const modalPronunciation = document.getElementById('modalPronunciation');
+        const modalDescription = document.getElementById('modalDescription');
+        const modalImage = document.getElementById('modalImage');
+        
+        modalTitle.textContent = data.english_word;
+        modalTranscription.textContent = data.transcription || '';
+        modalDescription.textContent = data.description || 'Описание отсутствует';
+        
+        if (data.pronunciation_url) {
+            modalPronunciation.href = data.pronunciation_url;
+            modalPronunciation.style.display = 'inline';
+        } else {
+            modalPronunciation.style.display = 'none';
+        }
+        
+        if (data.image_url) {
+            // Уменьшенные копии AVIF/WebP через srcset, оригинал — запасной вариант
+            const sources = Object.entries(data.image_srcset || {})
+                .sort(([a], [b]) => (a === 'avif' ? -1 : b === 'avif' ? 1 : 0))
+                .map(([format, srcset]) => `<source type="image/${format}" srcset="${srcset}" sizes="(max-width: 600px) 90vw, 500px">`)
+                .join('');
+            modalImage.innerHTML = `<picture>${sources}<img src="${data.image_url}" alt="Card image" decoding="async"></picture>`;
+            modalImage.style.display = 'block';
+        } else {
+            modalImage.style.display = 'none';
+        }
+        
+        modal.style.display = 'block';
+    }
+
+    // Закрытие модального окна
+    const modal = document.getElementById('cardInfoModal');
+    const span = document.getElementsByClassName('close')[0];
+    
+    span.onclick = function() {
+        modal.style.display = 'none';
+    }
+
+    window.onclick = function(event) {
+        if (event.target == modal) {
+            modal.style.display = 'none';
+        }
+    }
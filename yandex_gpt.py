@@ -2,9 +2,13 @@ import json
 import logging
 import os
 from copy import deepcopy
+from typing import AsyncIterator, Iterator, Optional
 
 import dotenv
-import requests
+
+from llm_clients import (StreamInterrupted, get_async_http_client, get_yandex_session,
+                         yandex_timeout)
+from logging_setup import Preview, sample_payload
 
 # Загружаем переменные окружения
 dotenv.load_dotenv()
@@ -26,93 +30,242 @@ if not catalog_id or not secret_key:
 logger = logging.getLogger(__name__)
 
 
+# Адрес можно переопределить, например, чтобы направить запросы на заглушку из bench/
+URL = os.getenv("YANDEX_GPT_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completion")
+HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Api-Key {secret_key}",
+}
+
+
+def _build_prompt(
+    original_context: list[dict], temperature: float, max_tokens: int, stream: bool
+) -> dict:
+    context = deepcopy(original_context)
+    sp = {
+        "role": "system",
+        "text": system_prompt,
+    }
+    if context:
+        context.insert(0, sp)
+
+    return {
+        "modelUri": f"gpt://{catalog_id}/yandexgpt/latest",
+        "completionOptions": {
+            "stream": stream,
+            "temperature": temperature,
+            "maxTokens": str(max_tokens),
+        },
+        "messages": context,
+    }
+
+
+def _parse_result(result) -> tuple:
+    # Проверяем структуру ответа
+    if not isinstance(result, dict):
+        logger.error("Unexpected response type: %s", type(result))
+        return None, None
+
+    if "result" not in result:
+        logger.error("No 'result' key in response: %s", Preview(result))
+        return None, None
+
+    result_data = result["result"]
+    if "alternatives" not in result_data or not result_data["alternatives"]:
+        logger.error("No alternatives in result: %s", Preview(result_data))
+        return None, None
+
+    first_alternative = result_data["alternatives"][0]
+    if (
+        "message" not in first_alternative
+        or "text" not in first_alternative["message"]
+    ):
+        logger.error("Invalid alternative format: %s", Preview(first_alternative))
+        return None, None
+
+    response_text = first_alternative["message"]["text"]
+    tokens = result_data.get("usage", {}).get("totalTokens", 0)
+
+    logger.info("Successfully got response from YandexGPT. Tokens used: %s", tokens)
+    return response_text, tokens
+
+
+def _parse_stream_line(line) -> tuple:
+    """Возвращает накопленный текст и число токенов (только в финальной строке)."""
+    result = json.loads(line).get("result", {})
+    alternatives = result.get("alternatives") or []
+    if not alternatives:
+        return "", None
+    text = alternatives[0].get("message", {}).get("text", "")
+    tokens = None
+    if "usage" in result and alternatives[0].get("status") == "ALTERNATIVE_STATUS_FINAL":
+        tokens = result["usage"].get("totalTokens", 0)
+    return text, tokens
+
+
 def _get_response_yandex_gpt(
     original_context: list[dict], temperature=0.7, max_tokens=2000
 ):
     try:
-        context = deepcopy(original_context)
-        sp = {
-            "role": "system",
-            "text": system_prompt,
-        }
-        if context:
-            context.insert(0, sp)
-
-        prompt = {
-            "modelUri": f"gpt://{catalog_id}/yandexgpt/latest",
-            "completionOptions": {
-                "stream": False,
-                "temperature": temperature,
-                "maxTokens": str(max_tokens),
-            },
-            "messages": context,
-        }
+        prompt = _build_prompt(original_context, temperature, max_tokens, stream=False)
 
-        logger.info(f"Sending request to YandexGPT with {len(context)} messages")
-        logger.info(f"Request payload: {json.dumps(prompt, ensure_ascii=False)}")
-
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Api-Key {secret_key}",
-        }
+        logger.info("Sending request to YandexGPT with %d messages", len(prompt["messages"]))
+        # Полный запрос — только для выборки вызовов и без текста сообщений
+        sample_payload(logger, "YandexGPT request", prompt)
 
-        response = requests.post(url, headers=headers, json=prompt, timeout=30)
-
-        # Добавляем логирование статуса ответа
-        logger.info(f"YandexGPT response status: {response.status_code}")
-        logger.info(
-            f"YandexGPT response: {response.text[:500]}..."
-        )  # Логируем первые 500 символов ответа
+        response = get_yandex_session().post(
+            URL, headers=HEADERS, json=prompt, timeout=yandex_timeout()
+        )
 
         if response.status_code != 200:
-            logger.error(f"YandexGPT error response: {response.text}")
+            logger.error("YandexGPT error response %d: %s", response.status_code,
+                         Preview(response.text))
             return None, None
 
         try:
             result = response.json()
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON response: {e}")
-            logger.error(f"Raw response: {response.text}")
+            logger.error("Failed to parse JSON response: %s; raw response: %s",
+                         e, Preview(response.text))
             return None, None
 
-        # Проверяем структуру ответа
-        if not isinstance(result, dict):
-            logger.error(f"Unexpected response type: {type(result)}")
-            return None, None
+        sample_payload(logger, "YandexGPT response", result)
+        return _parse_result(result)
+
+    except Exception as e:
+        logger.error("Unexpected error in _get_response_yandex_gpt: %s", e, exc_info=True)
+        return None, None
 
-        if "result" not in result:
-            logger.error(f"No 'result' key in response: {result}")
-            return None, None
 
-        result_data = result["result"]
-        if "alternatives" not in result_data or not result_data["alternatives"]:
-            logger.error(f"No alternatives in result: {result_data}")
+def _stream_response_yandex_gpt(
+    original_context: list[dict],
+    temperature=0.7,
+    max_tokens=2000,
+    usage: Optional[dict] = None,
+) -> Iterator[str]:
+    """Отдаёт ответ YandexGPT по частям по мере генерации.
+
+    В потоковом режиме API присылает JSON-объекты построчно, и каждый из них
+    содержит весь накопленный текст, поэтому наружу отдаём только приращение.
+    Закрытие генератора (например, при отключении клиента) закрывает
+    HTTP-соединение с API. Если передан ``usage``, расход токенов из
+    финальной строки записывается в ``usage["total_tokens"]``.
+
+    Ответ полон, только если пришла строка со статусом
+    ALTERNATIVE_STATUS_FINAL; обрыв после первого фрагмента поднимает
+    StreamInterrupted.
+    """
+    prompt = _build_prompt(original_context, temperature, max_tokens, stream=True)
+    logger.info("Streaming request to YandexGPT with %d messages", len(prompt["messages"]))
+    sample_payload(logger, "YandexGPT stream request", prompt)
+
+    response = None
+    sent = 0
+    finished = False
+    try:
+        response = get_yandex_session().post(
+            URL, headers=HEADERS, json=prompt, timeout=yandex_timeout(), stream=True
+        )
+        if response.status_code != 200:
+            logger.error("YandexGPT error response %d: %s", response.status_code,
+                         Preview(response.text))
+            return
+
+        for line in response.iter_lines():
+            if not line:
+                continue
+            text, tokens = _parse_stream_line(line)
+            if len(text) > sent:
+                yield text[sent:]
+                sent = len(text)
+            if tokens is not None:
+                finished = True
+                logger.info("YandexGPT stream finished. Tokens used: %s", tokens)
+                if usage is not None:
+                    usage["total_tokens"] = int(tokens)
+
+    except Exception as e:
+        logger.error("Unexpected error in _stream_response_yandex_gpt: %s", e, exc_info=True)
+    finally:
+        if response is not None:
+            response.close()
+    if sent and not finished:
+        raise StreamInterrupted("YandexGPT stream ended before the final status")
+
+
+async def _aget_response_yandex_gpt(
+    original_context: list[dict], temperature=0.7, max_tokens=2000
+):
+    """Асинхронный вариант _get_response_yandex_gpt для шлюза на asyncio."""
+    try:
+        prompt = _build_prompt(original_context, temperature, max_tokens, stream=False)
+        logger.info("Sending async request to YandexGPT with %d messages", len(prompt["messages"]))
+        sample_payload(logger, "YandexGPT request", prompt)
+
+        client = get_async_http_client()
+        response = await client.post(URL, headers=HEADERS, json=prompt)
+
+        if response.status_code != 200:
+            logger.error("YandexGPT error response %d: %s", response.status_code,
+                         Preview(response.text))
             return None, None
 
-        first_alternative = result_data["alternatives"][0]
-        if (
-            "message" not in first_alternative
-            or "text" not in first_alternative["message"]
-        ):
-            logger.error(f"Invalid alternative format: {first_alternative}")
+        try:
+            result = response.json()
+        except json.JSONDecodeError as e:
+            logger.error("Failed to parse JSON response: %s", e)
             return None, None
 
-        response_text = first_alternative["message"]["text"]
-        tokens = result_data.get("usage", {}).get("totalTokens", 0)
+        sample_payload(logger, "YandexGPT response", result)
+        return _parse_result(result)
+
+    except Exception as e:
+        logger.error("Unexpected error in _aget_response_yandex_gpt: %s", e, exc_info=True)
+        return None, None
+
 
-        logger.info(f"Successfully got response from YandexGPT. Tokens used: {tokens}")
-        logger.info(
-            f"Response text: {response_text[:100]}..."
-        )  # Логируем первые 100 символов ответа
+async def _astream_response_yandex_gpt(
+    original_context: list[dict],
+    temperature=0.7,
+    max_tokens=2000,
+    usage: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """Асинхронный вариант _stream_response_yandex_gpt.
 
-        return response_text, tokens
+    Отмена задачи или закрытие генератора закрывает соединение с API.
+    """
+    sent = 0
+    finished = False
+    prompt = _build_prompt(original_context, temperature, max_tokens, stream=True)
+    logger.info("Async streaming request to YandexGPT with %d messages", len(prompt["messages"]))
+    sample_payload(logger, "YandexGPT stream request", prompt)
+
+    try:
+        client = get_async_http_client()
+        async with client.stream("POST", URL, headers=HEADERS, json=prompt) as response:
+            if response.status_code != 200:
+                await response.aread()
+                logger.error("YandexGPT error response %d: %s", response.status_code,
+                             Preview(response.text))
+                return
+
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                text, tokens = _parse_stream_line(line)
+                if len(text) > sent:
+                    yield text[sent:]
+                    sent = len(text)
+                if tokens is not None:
+                    finished = True
+                    logger.info("YandexGPT stream finished. Tokens used: %s", tokens)
+                    if usage is not None:
+                        usage["total_tokens"] = int(tokens)
 
     except Exception as e:
-        logger.error(
-            f"Unexpected error in _get_response_yandex_gpt: {str(e)}", exc_info=True
-        )
-        return None, None
+        logger.error("Unexpected error in _astream_response_yandex_gpt: %s", e, exc_info=True)
+    if sent and not finished:
+        raise StreamInterrupted("YandexGPT stream ended before the final status")
 
 
 if __name__ == "__main__":